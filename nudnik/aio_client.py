@@ -0,0 +1,231 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import asyncio
+import threading
+import random
+
+import grpc
+import grpc.aio
+
+import nudnik
+import nudnik.pacing
+import nudnik.retry
+import nudnik.client
+import nudnik.templates
+import nudnik.utils as utils
+
+class AsyncClient(threading.Thread):
+    ''' Runs every stream of this process as a coroutine on a single asyncio event loop '''
+
+    def __init__(self, cfg, stream_ids, stats):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.stream_ids = stream_ids
+        self.stats = stats
+        self.meta_template = nudnik.templates.MetaTemplate(cfg)
+        self.retry_scheduler = None
+        if cfg.retry_mode == 'backoff':
+            self.retry_scheduler = nudnik.retry.get_scheduler(cfg, stats)
+        self.loop = None
+        self.stop = None
+        self.channel = None
+        self.channel_lock = None
+        self.stub = None
+        self.in_flight = None
+        self.tasks = set()
+        self.host_address = None
+        self.host_resolved_at = 0
+        self.name = '{}-aio'.format(cfg.name)
+        self.log.debug('Async client {} initiated with {} streams'.format(self.name, len(stream_ids)))
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+            self.gtfo = 1
+
+        self.log.debug('{} has left the building'.format(self))
+
+    async def main(self):
+        self.stop = asyncio.Event()
+        self.channel_lock = asyncio.Lock()
+        self.in_flight = asyncio.Semaphore(self.cfg.max_in_flight)
+
+        await self.open()
+
+        await asyncio.gather(*[self.run_stream(stream_id) for stream_id in self.stream_ids])
+
+        if len(self.tasks) > 0:
+            await asyncio.wait(list(self.tasks), timeout=self.cfg.timeout)
+        await self.close()
+
+    async def open(self):
+        await self.set_channel(True)
+
+    async def close(self):
+        await self.channel.close()
+
+    async def run_stream(self, stream_id):
+        self.log.debug('Stream {}-{} started, sending {} messages per second'.format(self.cfg.name, stream_id, (self.cfg.rate / float(self.cfg.interval))))
+
+        rate = self.cfg.rate
+        pacer = nudnik.pacing.Pacer(self.cfg.pacing, rate, self.cfg.interval)
+        template = nudnik.templates.RequestTemplate(self.cfg, stream_id)
+        message_id = 0
+        intended_at = utils.time_ns()
+
+        while not self.gtfo:
+            if self.cfg.pacing == 'burst':
+                sequence_id = message_id // self.cfg.rate if self.cfg.rate > 0 else message_id
+                for index in range(0, self.cfg.rate):
+                    if (self.cfg.count > 0) and (message_id >= self.cfg.count):
+                        return
+                    request = template.render(sequence_id, message_id, intended_at)
+                    await self.dispatch(request)
+                    message_id += 1
+
+                intended_at += int(self.cfg.interval * 10**9)
+                self.chaos()
+            else:
+                if (self.cfg.count > 0) and (message_id >= self.cfg.count):
+                    return
+                sequence_id = message_id // self.cfg.rate if self.cfg.rate > 0 else message_id
+                request = template.render(sequence_id, message_id, intended_at)
+                await self.dispatch(request)
+                message_id += 1
+                if rate != self.cfg.rate:
+                    rate = self.cfg.rate
+                    pacer.set_rate(rate, self.cfg.interval)
+                intended_at += pacer.next_gap_ns()
+                if self.cfg.rate > 0 and message_id % self.cfg.rate == 0:
+                    if self.cfg.vvv:
+                        self.log.debug('In flight requests: {}'.format(len(self.tasks)))
+                    self.chaos()
+
+            await self.wait_until(intended_at)
+
+    async def wait_until(self, timestamp):
+        time_now = utils.time_ns()
+        if timestamp > time_now:
+            try:
+                await asyncio.wait_for(self.stop.wait(), timeout=utils.diff_seconds(time_now, timestamp))
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch(self, request):
+        # Blocks the stream when too many requests are in flight, the delay is still
+        # accounted for since every request carries its intended send time
+        await self.in_flight.acquire()
+        task = self.loop.create_task(self.send(request))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send(self, request):
+        try:
+            request.worker_id = 0
+
+            if self.cfg.vvvvv:
+                self.log.debug('Handling message_id {}'.format(request.message_id))
+
+            retry_count = 0
+            try_count = 1 + self.cfg.retry_count
+            send_was_successful = False
+            while not self.gtfo and (not send_was_successful and ((self.cfg.retry_count < 0) or (try_count > 0))):
+                meta = nudnik.client.prepare_attempt(self.meta_template, request)
+                if self.retry_scheduler is not None:
+                    self.retry_scheduler.attempt(request)
+                for load in request.load:
+                    await self.loop.run_in_executor(None, utils.generate_load, self.log, load, meta)
+
+                response = await self.call(request)
+
+                if self.cfg.vvvvv:
+                    self.log.debug(response)
+
+                timestamp = utils.time_ns()
+
+                send_was_successful = nudnik.client.record_response(self.cfg, self.log, self.stats, request, response, timestamp)
+
+                if not send_was_successful and self.retry_scheduler is not None:
+                    # The budget is shared with the threads engine, but waiting does not block the loop
+                    if not self.retry_scheduler.allow(request):
+                        break
+                    await self.wait_until(utils.time_ns() + int(nudnik.retry.backoff(self.cfg, request.rcount) * 10**9))
+                    continue
+
+                if not send_was_successful:
+                    try_count -= 1
+                    retry_count += 1
+                    request.rtime=utils.time_ns()
+                    request.rcount = retry_count
+        finally:
+            self.in_flight.release()
+
+    async def call(self, request):
+        await self.set_channel(False)
+
+        channel = self.channel
+        try:
+            response = await self.stub.parse(request, timeout=self.cfg.timeout)
+        except grpc.aio.AioRpcError as e:
+            resp = {'status_code': 500}
+            response = nudnik.entity_pb2.Response(**resp)
+            if channel is self.channel:
+                self.log.warn('Reinitializing gRPC channel due to {}'.format(e.code()))
+                self.host_resolved_at = 0
+
+        return response
+
+    async def set_channel(self, force):
+        async with self.channel_lock:
+            resolved_elapsed = utils.diff_seconds(self.host_resolved_at, utils.time_ns())
+            if resolved_elapsed < self.cfg.dns_ttl and force is False:
+                return
+
+            await self.loop.run_in_executor(None, utils.resolv_host, self, True)
+
+            previous_channel = self.channel
+            self.channel = grpc.aio.insecure_channel(utils.join_host_port(self.host_address, self.cfg.port))
+            self.stub = nudnik.entity_pb2_grpc.ParserStub(self.channel)
+            if previous_channel is not None:
+                # Let requests that are already in flight finish on the previous channel
+                self.loop.create_task(previous_channel.close(grace=self.cfg.timeout))
+
+            if self.cfg.vvv:
+                self.log.debug('gRPC async channel to {} initialized'.format(self.host_address))
+
+    def chaos(self):
+        if self.cfg.chaos > 0 and random.randint(0, self.cfg.cycle_per_hour) <= self.cfg.chaos:
+            chaos_exception = utils.ChaosException(self.cfg.chaos_string)
+            self.log.fatal(chaos_exception)
+            self.exit()
+            raise chaos_exception
+
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
+        if self.stop is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self.stop.set)
+            except RuntimeError:
+                pass
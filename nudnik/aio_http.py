@@ -0,0 +1,264 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import asyncio
+import collections
+import itertools
+
+import nudnik
+import nudnik.aio_client
+import nudnik.utils as utils
+
+class HttpResponse(object):
+    def __init__(self, status_code, headers, content, connection):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.connection_id = connection.connection_id
+        self.connection_requests = connection.requests
+
+    def __repr__(self):
+        return '<HttpResponse [{}] connection {}/{}>'.format(self.status_code, self.connection_id, self.connection_requests)
+
+class HttpConnectionError(Exception): pass
+
+class HttpConnection(object):
+    ''' Keep-alive HTTP/1.1 connection, responses are read in the order their requests were written '''
+
+    def __init__(self, connection_id, address, port, reader, writer, loop):
+        self.connection_id = connection_id
+        self.address = address
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.closed = False
+        self.requests = 0
+        self.pending = collections.deque()
+        self.reader_task = loop.create_task(self.read_responses())
+
+    @property
+    def in_flight(self):
+        return len(self.pending)
+
+    def send(self, payload, method):
+        future = self.loop.create_future()
+        self.requests += 1
+        self.pending.append((future, method))
+        self.writer.write(payload)
+        return future
+
+    async def read_responses(self):
+        try:
+            while not self.closed:
+                status_line = await self.reader.readline()
+                if not status_line:
+                    raise HttpConnectionError('Connection closed by {}:{}'.format(self.address, self.port))
+
+                status_code = int(status_line.split(None, 2)[1])
+                headers = dict()
+                while True:
+                    line = await self.reader.readline()
+                    if line in [b'\r\n', b'\n', b'']:
+                        break
+                    key, value = line.decode('latin-1').split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                future, method = self.pending[0]
+                content = await self.read_body(headers, method, status_code)
+                # Interim responses precede the final response of the very same request
+                if status_code < 200 and status_code != 101:
+                    continue
+                self.pending.popleft()
+                if not future.done():
+                    future.set_result(HttpResponse(status_code, headers, content, self))
+
+                if headers.get('connection', '').lower() == 'close':
+                    raise HttpConnectionError('Connection closed by {}:{}'.format(self.address, self.port))
+        except (HttpConnectionError, ConnectionError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            self.close(e)
+        except asyncio.CancelledError:
+            self.close(HttpConnectionError('Connection to {}:{} cancelled'.format(self.address, self.port)))
+
+    async def read_body(self, headers, method, status_code):
+        # https://tools.ietf.org/html/rfc7230#section-3.3.3
+        if method.upper() == 'HEAD' or status_code < 200 or status_code in [204, 304]:
+            return b''
+
+        if 'content-length' in headers:
+            return await self.reader.readexactly(int(headers['content-length']))
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = list()
+            while True:
+                size = int((await self.reader.readline()).split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await self.reader.readline()) not in [b'\r\n', b'\n', b'']:
+                        pass
+                    return b''.join(chunks)
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+
+        # No framing, the body lasts until the server closes the connection
+        headers['connection'] = 'close'
+        return await self.reader.read()
+
+    def close(self, reason=None):
+        if self.closed:
+            return
+        self.closed = True
+        while len(self.pending) > 0:
+            future, method = self.pending.popleft()
+            if not future.done():
+                future.set_exception(reason or HttpConnectionError('Connection closed'))
+        self.writer.close()
+
+class HttpConnectionPool(object):
+    ''' Bounded keep-alive connections to a single target address '''
+
+    def __init__(self, cfg, log, address, loop, counter):
+        self.cfg = cfg
+        self.log = log
+        self.address = address
+        self.loop = loop
+        self.counter = counter
+        self.connections = list()
+        self.connecting = 0
+        self.condition = asyncio.Condition()
+        self.opened_connections = 0
+        self.closed_connections = 0
+        self.closed_connections_requests = 0
+
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                self.prune()
+
+                available = [c for c in self.connections if c.in_flight < self.cfg.http_pipelining]
+                if len(available) > 0:
+                    return min(available, key=lambda c: c.in_flight)
+
+                if (len(self.connections) + self.connecting) < self.cfg.http_connections:
+                    self.connecting += 1
+                    break
+
+                await self.condition.wait()
+
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.cfg.port), timeout=self.cfg.timeout)
+        finally:
+            self.connecting -= 1
+
+        connection = HttpConnection(next(self.counter), self.address, self.cfg.port, reader, writer, self.loop)
+        self.opened_connections += 1
+        self.connections.append(connection)
+        if self.cfg.vvv:
+            self.log.debug('HTTP connection {} to {}:{} opened'.format(connection.connection_id, self.address, self.cfg.port))
+        return connection
+
+    async def release(self):
+        async with self.condition:
+            self.condition.notify()
+
+    def prune(self):
+        for connection in [c for c in self.connections if c.closed]:
+            self.connections.remove(connection)
+            self.closed_connections += 1
+            self.closed_connections_requests += connection.requests
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.prune()
+
+    def reuse(self):
+        requests = self.closed_connections_requests + sum([c.requests for c in self.connections])
+        return requests, self.opened_connections
+
+class AsyncHttpClient(nudnik.aio_client.AsyncClient):
+    ''' HTTP/1.1 flavor of the asyncio engine, with keep-alive connection pools per resolved address '''
+
+    def __init__(self, cfg, stream_ids, stats):
+        super(AsyncHttpClient, self).__init__(cfg, stream_ids, stats)
+        self.pools = dict()
+        self.addresses = list()
+        self.address_counter = itertools.count()
+        self.connection_counter = itertools.count()
+        self.resolve_lock = None
+
+    async def open(self):
+        self.resolve_lock = asyncio.Lock()
+        await self.set_addresses(True)
+
+    async def close(self):
+        for address in self.pools:
+            pool = self.pools[address]
+            pool.close()
+            requests, connections = pool.reuse()
+            self.log.info('HTTP target {}:{} served {} requests over {} connections'.format(address, self.cfg.port, requests, connections))
+
+    async def set_addresses(self, force):
+        async with self.resolve_lock:
+            resolved_elapsed = utils.diff_seconds(self.host_resolved_at, utils.time_ns())
+            if resolved_elapsed < self.cfg.dns_ttl and force is False:
+                return
+
+            addresses = await self.loop.run_in_executor(None, utils.resolv_addresses, self)
+            self.host_resolved_at = utils.time_ns()
+            for address in addresses:
+                if address not in self.pools:
+                    self.pools[address] = HttpConnectionPool(self.cfg, self.log, address, self.loop, self.connection_counter)
+            self.addresses = sorted(addresses)
+
+    def serialize(self, request):
+        lines = ['{} {} HTTP/1.1'.format(request.method, self.cfg.path),
+                 'Host: {}:{}'.format(self.cfg.host, self.cfg.port)]
+        for key in request.headers:
+            lines.append('{}: {}'.format(key, request.headers[key]))
+        if 'Content-Length' not in request.headers:
+            lines.append('Content-Length: 0')
+
+        body = request.body or b''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return '\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + body
+
+    async def call(self, request):
+        await self.set_addresses(False)
+
+        addresses = self.addresses
+        address = addresses[next(self.address_counter) % len(addresses)]
+        pool = self.pools[address]
+
+        response = None
+        connection = None
+        try:
+            connection = await pool.acquire()
+            future = connection.send(self.serialize(request), request.method)
+            response = await asyncio.wait_for(future, timeout=self.cfg.timeout)
+            if response.status_code >= 200 and response.status_code < 300:
+                response.status_code = 0
+        except (OSError, HttpConnectionError, asyncio.TimeoutError) as e:
+            # Responses of a timed out pipelined connection can no longer be matched to their requests
+            if connection is not None:
+                connection.close(HttpConnectionError('Connection reset after {}'.format(type(e).__name__)))
+            self.log.warn('Resending request due to {}'.format(repr(e)))
+            self.host_resolved_at = 0
+        finally:
+            await pool.release()
+
+        return response
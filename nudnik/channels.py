@@ -0,0 +1,122 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import itertools
+import random
+
+import grpc
+
+import nudnik
+import nudnik.client
+import nudnik.utils as utils
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(cfg):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ChannelPool(cfg)
+    return _pool
+
+class ChannelPool(object):
+    ''' Process-wide gRPC channels, shared by every MessageSender of every stream '''
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.gtfo = False
+        self.counter = itertools.count()
+        self.clients = dict()
+        self.state = (list(), dict())
+        self.stale_clients = list()
+        self.host_resolved_at = 0
+
+        self.options = [('grpc.use_local_subchannel_pool', 1)]
+        if cfg.grpc_lb_policy in ['pick_first', 'round_robin']:
+            self.options.append(('grpc.lb_policy_name', cfg.grpc_lb_policy))
+
+        self.refresh(True)
+
+    def refresh(self, force):
+        with self.lock:
+            resolved_elapsed = utils.diff_seconds(self.host_resolved_at, utils.time_ns())
+            if resolved_elapsed < self.cfg.dns_ttl and force is False:
+                return
+            # Every failing sender asks for a refresh, honor only one per timeout
+            if force is True and resolved_elapsed < self.cfg.timeout and len(self.clients) > 0:
+                return
+
+            if self.cfg.grpc_resolver == 'dns':
+                # gRPC resolves the name and balances between the addresses on its own
+                addresses = ['dns:///{}:{}'.format(self.cfg.host, self.cfg.port)]
+            else:
+                addresses = sorted(utils.resolv_addresses(self))
+                if len(addresses) == 0:
+                    # The resolver exited before "host" was ever resolved, the name itself will do
+                    addresses = [self.cfg.host]
+            self.host_resolved_at = utils.time_ns()
+
+            # Channels are closed one refresh later, so requests in flight may complete
+            for client in self.stale_clients:
+                client.channel.close()
+            self.stale_clients = list()
+
+            clients = dict()
+            for address in addresses:
+                if address in self.clients:
+                    clients[address] = self.clients.pop(address)
+                else:
+                    clients[address] = [self.create_client(address) for index in range(0, self.cfg.grpc_channels_per_address)]
+
+            for address in self.clients:
+                self.log.debug('Address {} is no longer resolved for {}'.format(address, self.cfg.host))
+                self.stale_clients.extend(self.clients[address])
+
+            self.clients = clients
+            self.state = (addresses, clients)
+
+            if self.cfg.vvv:
+                self.log.debug('gRPC channel pool for {} contains {} channels to {}'.format(self.cfg.host, self.cfg.grpc_channels_per_address * len(addresses), addresses))
+
+    def create_client(self, address):
+        if self.cfg.grpc_resolver == 'dns':
+            target = address
+        else:
+            target = utils.join_host_port(address, self.cfg.port)
+        channel = grpc.insecure_channel(target, options=self.options)
+        return nudnik.client.ParserClient(address, self.cfg.port, self.cfg.timeout, channel=channel)
+
+    def get_client(self):
+        if utils.diff_seconds(self.host_resolved_at, utils.time_ns()) >= self.cfg.dns_ttl:
+            self.refresh(False)
+
+        addresses, clients = self.state
+        index = next(self.counter)
+        if self.cfg.grpc_lb_policy == 'random':
+            address = random.choice(addresses)
+            return random.choice(clients[address])
+        elif self.cfg.grpc_lb_policy == 'pick_first':
+            address = addresses[0]
+        else:
+            address = addresses[index % len(addresses)]
+
+        address_clients = clients[address]
+        return address_clients[(index // len(addresses)) % len(address_clients)]
@@ -19,11 +19,15 @@ import sys
 import threading
 
 import nudnik.stats
+import nudnik.outputs
 import nudnik.metrics
 import nudnik.grpc_server
 import nudnik.etcd_server
 import nudnik.client
+import nudnik.shard
+import nudnik.search
 import nudnik.load
+import nudnik.resolver
 import nudnik.utils as utils
 
 if (sys.version_info >= (3, 0)):
@@ -32,11 +36,26 @@ else:
     import nudnik.ruok2 as ruok
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'report':
+        # Reports may load NumPy, which load tests have no use for
+        import nudnik.report as report
+        return report.main(sys.argv[2:])
+
     args = utils.parse_args()
     cfg = utils.parse_config(args)
     log = utils.get_logger(cfg.debug)
 
     threads = list()
+    writers = list()
+
+    # Forking a process that already runs threads may leave a lock, of logging for example, held forever in the child
+    shard_queue = None
+    shards = list()
+    collector = None
+    if not cfg.server and cfg.processes > 1 and cfg.streams > 0:
+        log.debug('Starting {} streams in {} processes'.format(cfg.streams, cfg.processes))
+        shard_queue, shards = nudnik.shard.start_shards(cfg)
+        threads.extend(shards)
 
     if cfg.ruok is True:
         ruokthread = ruok.Ruok(cfg)
@@ -49,11 +68,16 @@ def main():
         threads.append(metricsthread)
         metricsthread.daemon = True
         metricsthread.start()
+        writers.append(metricsthread)
 
     statsthread = nudnik.stats.Stats(cfg)
     threads.append(statsthread)
     statsthread.daemon = True
     statsthread.start()
+    writers.append(statsthread)
+
+    if cfg.ruok is True:
+        ruokthread.attach(statsthread)
 
     if cfg.server:
         log.debug('Running Nudnik in server mode')
@@ -68,15 +92,19 @@ def main():
 
     else:
         log.debug('Running Nudnik in client mode')
-        log.debug('Starting {} streams'.format(cfg.streams))
-        for i in range(0, cfg.streams):
-            try:
-                stream_id = cfg.initial_stream_index + i
-                stream = nudnik.client.Stream(cfg, stream_id, statsthread)
-                threads.append(stream)
-                stream.start()
-            except Exception as e:
-                log.fatal('Fatal error during stream initialization: {}'.format(e))
+        if shard_queue is not None:
+            collector = nudnik.shard.start_collector(cfg, shard_queue, statsthread)
+            threads.append(collector)
+        else:
+            log.debug('Starting {} streams'.format(cfg.streams))
+            streams = nudnik.client.start_streams(cfg, statsthread)
+            threads.extend(streams)
+
+            if cfg.search != 'off':
+                searchthread = nudnik.search.Search(cfg, statsthread, streams)
+                threads.append(searchthread)
+                searchthread.daemon = True
+                searchthread.start()
 
         if cfg.streams == 0 and len(cfg.load_list) > 0:
             load_thread = nudnik.load.Load(cfg)
@@ -97,8 +125,16 @@ def main():
                 else:
                     stream.join(0.25)
     except KeyboardInterrupt:
+        # Workers still waiting for "host" to resolve are released first, streams join them on exit
+        nudnik.resolver.stop_resolver()
+        if collector is not None:
+            # The last interval of every shard is merged before the stats are written out
+            nudnik.shard.stop_shards(cfg, shards, collector)
         for s in threads:
             s.exit()
+        # Outputs write whatever they still hold before the process leaves
+        for writer in writers:
+            writer.join(nudnik.outputs.EXIT_TIMEOUT + 1)
 
     log.debug('You are the weakest link, goodbye!'.format(''))
     return 1
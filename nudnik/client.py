@@ -18,6 +18,7 @@ import time
 from datetime import datetime
 import sys
 import random
+import collections
 if (sys.version_info >= (3, 0)):
     import queue as queue
 else:
@@ -26,14 +27,18 @@ import threading
 import requests
 
 import grpc
-import etcd3
 
 import nudnik
+import nudnik.channels
+import nudnik.etcd_client
+import nudnik.pacing
+import nudnik.retry
+import nudnik.templates
 import nudnik.utils as utils
 
 class ParserClient(object):
 
-    def __init__(self, host, port, timeout):
+    def __init__(self, host, port, timeout, channel=None):
         self.host = host
         self.port = port
         self.timeout = timeout
@@ -41,7 +46,9 @@ class ParserClient(object):
 #        max_message_size = (100 * 1024 * 1024)
 #        options=[('grpc.max_message_length', -1), ('grpc.max_recieve_message_length', -1), ('grpc.max_send_message_length', -1)]
         options=[]
-        self.channel = grpc.insecure_channel('{}:{}'.format(self.host, self.port), options=options)
+        if channel is None:
+            channel = grpc.insecure_channel(utils.join_host_port(self.host, self.port), options=options)
+        self.channel = channel
 
         # bind the client to the server channel
         self.stub = nudnik.entity_pb2_grpc.ParserStub(self.channel)
@@ -49,6 +56,38 @@ class ParserClient(object):
     def get_response_for_request(self, request):
         return self.stub.parse(request, timeout=self.timeout)
 
+class SendQueue(queue.Queue):
+    ''' Stream queue with an overflow policy, counts the messages that did not fit '''
+
+    def __init__(self, maxsize, overflow):
+        queue.Queue.__init__(self, maxsize)
+        self.overflow = overflow
+        self.dropped = 0
+        self.shed = 0
+        self.blocked = 0
+
+    def offer(self, item):
+        try:
+            self.put(item, block=False)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == 'drop':
+            self.dropped += 1
+            return False
+
+        # Shed the oldest message in favor of the newest one
+        with self.not_full:
+            if self._qsize() > 0:
+                self._get()
+                self.unfinished_tasks -= 1
+                self.shed += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return True
+
 class Stream(threading.Thread):
     def __init__(self, cfg, stream_id, stats):
         threading.Thread.__init__(self)
@@ -59,81 +98,133 @@ class Stream(threading.Thread):
         self.log = utils.get_logger(cfg.debug)
         self.stream_id = stream_id
         self.stats = stats
-        self.queue = queue.Queue()
+        self.queue = SendQueue(cfg.queue_size, cfg.queue_overflow)
+        if cfg.queue_size > 0:
+            stats.register_queue(cfg.name, stream_id, self.queue)
+        self.template = nudnik.templates.RequestTemplate(cfg, stream_id)
+        self.meta_template = nudnik.templates.MetaTemplate(cfg)
         self.name = '{}-{}'.format(cfg.name, stream_id)
         self.log.debug('Stream {} initiated'.format(self.name))
 
     def run(self):
         self.log.debug('Stream {} started, sending {} messages per second'.format(self.name, (self.cfg.rate / float(self.cfg.interval))))
 
-        sequence_id = 0
+        if self.cfg.protocol == 'grpc' and self.cfg.grpc_call == 'stream':
+            # A single long-lived call pipelines all the messages of this stream
+            sender_class = StreamingSender
+            workers = 1
+        else:
+            sender_class = MessageSender
+            workers = self.cfg.workers
 
-        active_workers = threading.Semaphore(self.cfg.workers)
-        for worker_id in range(0, self.cfg.workers):
+        active_workers = threading.Semaphore(workers)
+        for worker_id in range(0, workers):
             active_workers.acquire()
-            thread = MessageSender(self.cfg, self.log, self.stream_id, worker_id, active_workers, self.queue, self.stats)
+            thread = sender_class(self.cfg, self.log, self.stream_id, worker_id, active_workers, self.queue, self.stats, self.meta_template)
             thread.daemon = True
             self.workers.append(thread)
             thread.start()
 
         # Wait for all workers to initialize clients
-        for worker_id in range(0, self.cfg.workers):
+        for worker_id in range(0, workers):
             active_workers.acquire()
 
+        if self.cfg.pacing == 'burst':
+            self.run_burst()
+        else:
+            self.run_open_loop()
+
+    def run_burst(self):
+        sequence_id = 0
+        message_id = 0
+
         while not self.gtfo:
             time_start = utils.time_ns()
 
+            # The rate may be changed on the fly, e.g. by the search mode
             for index in range(0, self.cfg.rate):
 
-                message_id = (sequence_id * self.cfg.rate) + index
                 if (self.cfg.count > 0) and (message_id >= self.cfg.count):
                     self.exit()
                     return
 
-                if self.cfg.protocol in ['grpc', 'etcd']:
-                    request = nudnik.entity_pb2.Request(name=self.cfg.name,
-                                                        stream_id=self.stream_id,
-                                                        sequence_id=sequence_id,
-                                                        message_id=message_id,
-                                                        ctime=utils.time_ns(),
-                                                        load=self.cfg.load_list)
-                else:
-                    headers = dict()
-                    for header in self.cfg.headers:
-                        headers.update({str(header[0]): str(header[1])})
-                    data = self.cfg.request_format.format(name=self.cfg.name,
-                                                          stream_id=self.stream_id,
-                                                          sequence_id=sequence_id,
-                                                          message_id=message_id,
-                                                          ctime=utils.time_ns(),
-                                                          load=self.cfg.load_list)
-
-                    req = requests.Request(self.cfg.method, 'http://place_holder', data=data, headers=headers)
-                    request = req.prepare()
-                    request.name = self.cfg.name
-                    request.stream_id=self.stream_id
-                    request.sequence_id=sequence_id
-                    request.message_id=message_id
-                    request.ctime=utils.time_ns()
-                    request.load=self.cfg.load_list
-
-                self.queue.put(request)
+                request = self.get_request(sequence_id, message_id, time_start)
+                self.enqueue(request)
+                message_id += 1
 
             if self.cfg.vvv:
                 self.log.debug('Active workers/tasks: {}/{}'.format(threading.active_count(), self.queue.qsize()))
 
             sequence_id += 1
 
-            if self.cfg.chaos > 0 and random.randint(0, self.cfg.cycle_per_hour) <= self.cfg.chaos:
-                chaos_exception = utils.ChaosException(self.cfg.chaos_string)
-                self.log.fatal(chaos_exception)
-                self.exit()
-                raise chaos_exception
+            self.chaos()
 
             elapsed = utils.diff_seconds(time_start, utils.time_ns())
             if elapsed < self.cfg.interval:
                 self.event.wait(timeout=(self.cfg.interval - elapsed))
 
+    def run_open_loop(self):
+        rate = self.cfg.rate
+        pacer = nudnik.pacing.Pacer(self.cfg.pacing, rate, self.cfg.interval)
+
+        message_id = 0
+        # Every message is scheduled on its own intended send time, regardless of
+        # how long the previous messages took, thus late messages are never "forgiven"
+        intended_at = utils.time_ns()
+
+        while not self.gtfo:
+            if (self.cfg.count > 0) and (message_id >= self.cfg.count):
+                self.exit()
+                return
+
+            time_now = utils.time_ns()
+            if intended_at > time_now:
+                self.event.wait(timeout=utils.diff_seconds(time_now, intended_at))
+                if self.gtfo:
+                    return
+
+            sequence_id = message_id // self.cfg.rate if self.cfg.rate > 0 else message_id
+            request = self.get_request(sequence_id, message_id, intended_at)
+            self.enqueue(request)
+
+            message_id += 1
+            if rate != self.cfg.rate:
+                rate = self.cfg.rate
+                pacer.set_rate(rate, self.cfg.interval)
+            intended_at += pacer.next_gap_ns()
+
+            if self.cfg.rate > 0 and message_id % self.cfg.rate == 0:
+                if self.cfg.vvv:
+                    lag = utils.diff_seconds(intended_at, utils.time_ns())
+                    self.log.debug('Active workers/tasks: {}/{}, schedule lag: {}'.format(threading.active_count(), self.queue.qsize(), lag))
+
+                self.chaos()
+
+    def get_request(self, sequence_id, message_id, itime):
+        return self.template.render(sequence_id, message_id, itime)
+
+    def enqueue(self, request):
+        if self.cfg.queue_overflow != 'block':
+            if not self.queue.offer(request) and self.cfg.vvvv:
+                self.log.debug('Queue is full, dropped message_id {}'.format(request.message_id))
+            return
+
+        if self.queue.full():
+            self.queue.blocked += 1
+        while not self.gtfo:
+            try:
+                self.queue.put(request, block=True, timeout=0.2)
+                return
+            except queue.Full:
+                pass
+
+    def chaos(self):
+        if self.cfg.chaos > 0 and random.randint(0, self.cfg.cycle_per_hour) <= self.cfg.chaos:
+            chaos_exception = utils.ChaosException(self.cfg.chaos_string)
+            self.log.fatal(chaos_exception)
+            self.exit()
+            raise chaos_exception
+
     def exit(self):
         self.gtfo = 1
         self.event.set()
@@ -156,35 +247,37 @@ class Stream(threading.Thread):
 
 class MessageSender(threading.Thread):
 
-    def __init__(self, cfg, log, stream_id, worker_id, active_workers, queue, stats):
+    def __init__(self, cfg, log, stream_id, worker_id, active_workers, queue, stats, meta_template):
         threading.Thread.__init__(self)
         self.gtfo = False
         self.event = threading.Event()
-        self.lock = threading.Semaphore(1)
         self.active_workers = active_workers
         self.cfg = cfg
         self.log = log
         self.client = None
+        self.dispatcher = None
         self.host_address = None
         self.host_resolved_at = 0
+        self.url = None
+        self.url_address = None
         self.session = requests.Session()
         self.queue = queue
+        self.meta_template = meta_template
         self.stats = stats
+        self.retry_scheduler = None
+        if cfg.retry_mode == 'backoff':
+            self.retry_scheduler = nudnik.retry.get_scheduler(cfg, stats)
         self.worker_id = worker_id
         self.name = '{}-{}-{}'.format(cfg.name, stream_id, worker_id)
 
-
-    def watch_callback_key_release(self, event):
-        if type(event) == etcd3.events.PutEvent:
-            self.lock.release()
-
     def run(self):
         if self.cfg.protocol == 'grpc':
             self.set_grpc_client(True)
         elif self.cfg.protocol == 'etcd':
             request_prefix = self.cfg.etcd_format_key_request.format(name=self.cfg.name)
             response_prefix = self.cfg.etcd_format_key_response.format(name=self.cfg.name)
-            utils.set_etcd_client(self, True)
+            self.dispatcher = nudnik.etcd_client.get_dispatcher(self.cfg)
+            self.client = self.dispatcher.client
 
         self.active_workers.release()
 
@@ -196,9 +289,7 @@ class MessageSender(threading.Thread):
 
             if self.cfg.protocol == 'grpc':
                 self.set_grpc_client(False)
-            elif self.cfg.protocol == 'etcd':
-                utils.set_etcd_client(self, False)
-            else:
+            elif self.cfg.protocol != 'etcd':
                 utils.resolv_host(self, False)
 
             request = None
@@ -219,10 +310,9 @@ class MessageSender(threading.Thread):
             try_count = 1 + self.cfg.retry_count
             send_was_successful = False
             while not self.gtfo and (not send_was_successful and ((self.cfg.retry_count < 0) or (try_count > 0))):
-                request.stime=utils.time_ns()
-
-                meta = self.cfg.meta.format(req=request, node=nudnik.metrics.MetricNode()) if self.cfg.meta is not None else None
-                request.meta = utils.get_meta(meta, self.cfg.meta_size)
+                meta = prepare_attempt(self.meta_template, request)
+                if self.retry_scheduler is not None:
+                    self.retry_scheduler.attempt(request)
 
                 if getattr(request, 'load', None) is not None:
                     for load in request.load:
@@ -242,31 +332,25 @@ class MessageSender(threading.Thread):
                     try:
                         if self.cfg.vvv:
                             self.log.debug('Etcd request: {}'.format(request))
-                        key = '{}/{}/{}'.format(self.cfg.etcd_format_key_request.format(name=request.name), request.sequence_id, request.message_id)
+                        # Every attempt has a key of its own, a late response to an abandoned attempt must not answer the next one
+                        key = '{}/{}/{}/{}/{}'.format(self.cfg.etcd_format_key_request.format(name=request.name), request.stream_id, request.sequence_id, request.message_id, request.rcount)
                         value = request.SerializeToString()
-                        if self.cfg.vvvvv:
-                            self.log.debug('Writing {} => {}'.format(key, value))
-                        self.client.put(key, value)
                         response_key = key.replace(request_prefix, response_prefix, 1)
-                        watch_id = self.client.add_watch_callback(response_key, self.watch_callback_key_release)
-                        self.lock.acquire()
                         if self.cfg.vvvvv:
-                            self.log.debug('Waiting for response at "{}"'.format(response_key))
-                        with self.lock:
-                            self.client.cancel_watch(watch_id)
-                            resp = self.client.get(response_key)
-                            response = nudnik.entity_pb2.Response()
-                            response.ParseFromString(resp[0])
-                            self.client.delete(response_key)
+                            self.log.debug('Writing {} => {}, waiting for response at "{}"'.format(key, value, response_key))
+                        response = nudnik.entity_pb2.Response()
+                        response.ParseFromString(self.dispatcher.send(key, value, response_key, self.cfg.timeout))
                     except Exception as e:
                         resp = {'status_code': 500}
                         response = nudnik.entity_pb2.Response(**resp)
-                        self.log.warn('Reinitializing Etcd client due to "{}"'.format(e))
-                        utils.set_etcd_client(self, True)
+                        self.log.warn('Resending request due to "{}"'.format(e))
 
                 else:
                     try:
-                        request.url = '{}://{}:{}{}'.format(self.cfg.protocol, self.host_address, self.cfg.port, self.cfg.path)
+                        if self.url_address != self.host_address:
+                            self.url = '{}://{}{}'.format(self.cfg.protocol, utils.join_host_port(self.host_address, self.cfg.port), self.cfg.path)
+                            self.url_address = self.host_address
+                        request.url = self.url
                         response = self.session.send(request)
                         if response.status_code >= 200 and response.status_code < 300:
                            response.status_code = 0
@@ -280,17 +364,14 @@ class MessageSender(threading.Thread):
 
                 timestamp = utils.time_ns()
 
-                send_was_successful = ( (response is not None) and (response.status_code == 0) and (self.stats.get_fail_ratio() >= self.cfg.fail_ratio))
+                send_was_successful = record_response(self.cfg, self.log, self.stats, request, response, timestamp)
 
-                if send_was_successful:
-                    if self.cfg.vvvvv:
-                        self.log.debug('Request was successful')
-                    self.stats.add_success()
-                    stat = nudnik.stats.Stat(request, response, timestamp)
-                    self.stats.append(stat)
-                else:
-                    self.log.warn('Request was not successful')
-                    self.stats.add_failure()
+                if not send_was_successful and self.retry_scheduler is not None:
+                    # Free this worker for fresh messages, the retry is re-queued after its backoff
+                    self.retry_scheduler.retry(request, self.queue)
+                    break
+
+                if not send_was_successful:
                     try_count -= 1
                     retry_count += 1
                     request.rtime=utils.time_ns()
@@ -304,6 +385,14 @@ class MessageSender(threading.Thread):
         self.log.debug('{} has left the building'.format(self))
 
     def set_grpc_client(self, force):
+        if self.cfg.grpc_channels_per_address > 0:
+            pool = nudnik.channels.get_pool(self.cfg)
+            if force:
+                pool.refresh(True)
+            self.client = pool.get_client()
+            self.host_address = self.client.host
+            return
+
         resolved_elapsed = utils.diff_seconds(self.host_resolved_at, utils.time_ns())
         if resolved_elapsed < self.cfg.dns_ttl and force is False:
             return
@@ -325,6 +414,149 @@ class MessageSender(threading.Thread):
     def exit(self):
         self.gtfo = 1
         self.event.set()
-        if self.lock:
-            self.lock.release()
-            self.lock = None
+
+class StreamingSender(MessageSender):
+    ''' Pipelines the messages of a stream over a single long-lived bidi-streaming call '''
+
+    def __init__(self, cfg, log, stream_id, worker_id, active_workers, queue, stats, meta_template):
+        super(StreamingSender, self).__init__(cfg, log, stream_id, worker_id, active_workers, queue, stats, meta_template)
+        self.calls_lock = threading.Lock()
+
+    def requests(self, window, pending, stopped):
+        ''' Messages of a single call, "pending" and "stopped" belong to that call only '''
+        while not self.gtfo and not stopped.is_set():
+            try:
+                request = self.queue.get(block=True, timeout=0.2)
+            except queue.Empty:
+                continue
+
+            while not window.acquire(True, 0.2):
+                if self.gtfo or stopped.is_set():
+                    self.queue.put(request)
+                    return
+
+            # gRPC keeps consuming the generator of a broken call, what it takes from now on belongs to the next call
+            with self.calls_lock:
+                if stopped.is_set():
+                    self.queue.put(request)
+                    return
+                pending.append(request)
+
+            request.worker_id = self.worker_id
+            meta = prepare_attempt(self.meta_template, request)
+            if self.retry_scheduler is not None:
+                self.retry_scheduler.attempt(request)
+            for load in request.load:
+                utils.generate_load(self.log, load, meta)
+
+            if self.cfg.vvvvv:
+                self.log.debug('Streaming message_id {}'.format(request.message_id))
+
+            yield request
+
+    def stop_call(self, pending, stopped):
+        with self.calls_lock:
+            stopped.set()
+
+        # Every message that was in flight on the call has failed
+        while len(pending) > 0:
+            request = pending.popleft()
+            record_response(self.cfg, self.log, self.stats, request, None, utils.time_ns())
+            self.retry(request)
+
+    def run(self):
+        self.set_grpc_client(True)
+        self.active_workers.release()
+
+        failed_calls = 0
+        while not self.gtfo:
+            window = threading.Semaphore(self.cfg.max_in_flight)
+            pending = collections.deque()
+            stopped = threading.Event()
+            responses = self.client.stub.parse_stream(self.requests(window, pending, stopped))
+            try:
+                for response in responses:
+                    timestamp = utils.time_ns()
+                    request = pending.popleft()
+                    window.release()
+                    failed_calls = 0
+
+                    if self.cfg.vvvvv:
+                        self.log.debug(response)
+
+                    if not record_response(self.cfg, self.log, self.stats, request, response, timestamp):
+                        self.retry(request)
+            except grpc.RpcError as e:
+                if self.gtfo:
+                    break
+
+                self.stop_call(pending, stopped)
+                self.log.warn('Reinitializing gRPC stream due to {}'.format(e))
+                self.event.wait(timeout=min(1.0, (failed_calls * 100)/1000))
+                failed_calls += 1
+                self.set_grpc_client(True)
+                continue
+
+            self.stop_call(pending, stopped)
+
+        self.log.debug('{} has left the building'.format(self))
+
+    def retry(self, request):
+        if self.retry_scheduler is not None:
+            self.retry_scheduler.retry(request, self.queue)
+            return
+        if self.gtfo or (self.cfg.retry_count >= 0 and request.rcount >= self.cfg.retry_count):
+            return
+        request.rtime = utils.time_ns()
+        request.rcount += 1
+        self.queue.put(request)
+
+def start_streams(cfg, stats):
+    log = utils.get_logger(cfg.debug)
+    threads = list()
+
+    if cfg.streams > 0:
+        utils.get_resolver(cfg).attach(stats)
+
+    if cfg.engine == 'asyncio' and cfg.streams > 0:
+        # asyncio requires Python 3, so only import it when requested
+        stream_ids = [(cfg.initial_stream_index + i) for i in range(0, cfg.streams)]
+        if cfg.protocol == 'http':
+            import nudnik.aio_http as aio_http
+            client = aio_http.AsyncHttpClient(cfg, stream_ids, stats)
+        else:
+            import nudnik.aio_client as aio_client
+            client = aio_client.AsyncClient(cfg, stream_ids, stats)
+        threads.append(client)
+        client.start()
+    else:
+        for i in range(0, cfg.streams):
+            try:
+                stream_id = cfg.initial_stream_index + i
+                stream = Stream(cfg, stream_id, stats)
+                threads.append(stream)
+                stream.start()
+            except Exception as e:
+                log.fatal('Fatal error during stream initialization: {}'.format(e))
+
+    return threads
+
+def prepare_attempt(meta_template, request):
+    request.stime=utils.time_ns()
+
+    meta, request.meta = meta_template.render(request)
+    return meta
+
+def record_response(cfg, log, stats, request, response, timestamp):
+    send_was_successful = ( (response is not None) and (response.status_code == 0) and not stats.inject_failure())
+
+    if send_was_successful:
+        if cfg.vvvvv:
+            log.debug('Request was successful')
+        stats.add_success()
+        stats.record(request, response, timestamp)
+    else:
+        log.warn('Request was not successful')
+        stats.add_failure()
+
+    return send_was_successful
@@ -0,0 +1,76 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+
+import nudnik
+import nudnik.utils as utils
+
+class Clock(object):
+    ''' Offsets of the clocks of the servers from the local clock, estimated NTP style from the timestamps of every response '''
+
+    def __init__(self, cfg):
+        # The best sample of every stats interval is kept for "clock_offset_window" seconds
+        self.intervals = max(1, int(round(float(cfg.clock_offset_window) / cfg.stats_interval)))
+        self.servers = dict()
+        self.offsets = dict()
+
+    def update(self, stats, timestamp):
+        ''' Adds the responses of an interval, returns a report per server '''
+        best = dict()
+        counts = dict()
+        columns = zip(stats.hosts,
+                      stats.request_column('stime'),
+                      stats.response_column('ctime'),
+                      stats.response_column('ltime'),
+                      stats.response_column('stime'),
+                      stats.timestamps)
+        for host, client_stime, server_ctime, server_ltime, server_stime, client_rtime in columns:
+            # Only grpc and etcd servers timestamp their responses
+            if server_ltime == 0 or client_stime == 0:
+                continue
+            counts[host] = counts.get(host, 0) + 1
+            # The round trip without the time spent in the server, the shortest one has the most symmetric network delays
+            delay = (client_rtime - client_stime) - (server_stime - server_ctime)
+            if host not in best or delay < best[host][0]:
+                best[host] = (delay, ((server_ctime - client_stime) + (server_stime - client_rtime)) // 2)
+
+        for host in best:
+            if host not in self.servers:
+                self.servers[host] = collections.deque(maxlen=self.intervals)
+        reports = list()
+        for host in list(self.servers):
+            samples = self.servers[host]
+            samples.append(best.get(host))
+            window = [sample for sample in samples if sample is not None]
+            # Servers that did not answer for a whole window are forgotten
+            if len(window) == 0:
+                del self.servers[host]
+                del self.offsets[host]
+                continue
+            delay, offset = min(window)
+            self.offsets[host] = offset
+            reports.append(ClockStat(timestamp, host, offset, delay, counts.get(host, 0)))
+        return reports
+
+class ClockStat(utils.NudnikObject):
+    def __init__(self, timestamp, host, offset, delay, samples):
+        super(ClockStat, self).__init__(timestamp)
+        self.host = host
+        self.offset = offset
+        self.delay = delay
+        self.error = delay // 2
+        self.samples = samples
@@ -0,0 +1,102 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import json
+import mmap
+import array
+import struct
+
+# A file starts with FILE_MAGIC, the format version and the length of a JSON header that lists the columns,
+# it is followed by chunks, every chunk holds CHUNK_MAGIC, its number of rows, the length of its names table,
+# the names table (newline separated, padded to 8 bytes) and then every column as "rows" little-endian int64 values
+FILE_MAGIC = b'NUDNIKST'
+FORMAT_VERSION = 1
+CHUNK_MAGIC = b'CHNK'
+FILE_HEADER = struct.Struct('<8sII')
+CHUNK_HEADER = struct.Struct('<4sIII')
+
+if (sys.version_info >= (3, 3)):
+    INT64 = 'q'
+else:
+    INT64 = 'l'
+
+def columns(request_fields, response_fields):
+    ''' Column names, "name" holds indexes into the names table of its chunk '''
+    return ['timestamp', 'name'] + ['req_{}'.format(field) for field in request_fields] + ['res_{}'.format(field) for field in response_fields]
+
+def _padding(length):
+    return (8 - (length % 8)) % 8
+
+def _little_endian(column):
+    if sys.byteorder == 'little':
+        return column
+    column = array.array(INT64, column)
+    column.byteswap()
+    return column
+
+def write_header(f, header):
+    data = json.dumps(header).encode('utf-8')
+    data += b' ' * _padding(FILE_HEADER.size + len(data))
+    f.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, len(data)))
+    f.write(data)
+
+def write_chunk(f, rows, names, columns):
+    ''' Writes "rows" rows of int64 columns, "names" is the names table referenced by the "name" column '''
+    table = '\n'.join(names).encode('utf-8')
+    table += b'\0' * _padding(len(table))
+    f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, rows, len(table), 0))
+    f.write(table)
+    for column in columns:
+        data = _little_endian(column)
+        if hasattr(data, 'tobytes'):
+            f.write(data.tobytes())
+        else:
+            f.write(data.tostring())
+
+def read_header(buf):
+    magic, version, length = FILE_HEADER.unpack_from(buf, 0)
+    if magic != FILE_MAGIC:
+        raise ValueError('Not a Nudnik binary stats file')
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported binary stats format version {}'.format(version))
+    header = json.loads(buf[FILE_HEADER.size:FILE_HEADER.size + length].decode('utf-8'))
+    return header, FILE_HEADER.size + length
+
+def read_chunks(buf, offset, column_count):
+    ''' Yields (rows, names, offsets of every column) without copying the columns themselves '''
+    while offset + CHUNK_HEADER.size <= len(buf):
+        magic, rows, table_length, reserved = CHUNK_HEADER.unpack_from(buf, offset)
+        if magic != CHUNK_MAGIC:
+            raise ValueError('Corrupted chunk at offset {}'.format(offset))
+        offset += CHUNK_HEADER.size
+        table = buf[offset:offset + table_length].rstrip(b'\0').decode('utf-8')
+        offset += table_length
+
+        end = offset + (rows * 8 * column_count)
+        # A writer may still be in the middle of the last chunk
+        if end > len(buf):
+            return
+        names = table.split('\n') if rows > 0 else list()
+        yield rows, names, [offset + (rows * 8 * index) for index in range(0, column_count)]
+        offset = end
+
+def open_file(path):
+    ''' Maps a whole binary stats file, returns (header, map, offset of its first chunk) '''
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header, offset = read_header(buf)
+    return header, buf, offset
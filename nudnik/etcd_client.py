@@ -0,0 +1,173 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import threading
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+else:
+    import Queue as queue
+
+import etcd3
+
+import nudnik
+import nudnik.utils as utils
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher(cfg):
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher(cfg)
+            _dispatcher.daemon = True
+            _dispatcher.start()
+    return _dispatcher
+
+def commit(client, operations):
+    ''' Writes (key, value) pairs in a single transaction, a None value deletes the key '''
+    success = list()
+    for key, value in operations:
+        if value is None:
+            success.append(client.transactions.delete(key))
+        else:
+            success.append(client.transactions.put(key, value))
+    return client.transaction(compare=[], success=success, failure=[])
+
+def put_events(response):
+    # Depending on the etcd3 version, callbacks get either single events or whole watch responses
+    for event in getattr(response, 'events', [response]):
+        if isinstance(event, etcd3.events.PutEvent):
+            yield event
+
+class EtcdResponseTimeout(Exception): pass
+
+class Waiter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def set(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout):
+        if not self.event.wait(timeout=timeout):
+            raise EtcdResponseTimeout('No response within {} seconds'.format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class Dispatcher(threading.Thread):
+    ''' Process-wide etcd client, a single prefix watch routes responses to their senders and writes are batched in transactions '''
+
+    def __init__(self, cfg):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.client = None
+        self.watched_client = None
+        self.host_address = None
+        self.host_resolved_at = 0
+        self.waiters = dict()
+        self.operations = queue.Queue()
+        self.response_prefix = cfg.etcd_format_key_response.format(name=cfg.name)
+        self.name = '{}-etcd-dispatcher'.format(cfg.name)
+        self.connect(True)
+
+    def connect(self, force):
+        utils.set_etcd_client(self, force)
+        if self.client is None or self.client is self.watched_client:
+            return
+
+        self.client.add_watch_prefix_callback(self.response_prefix, self.callback)
+        self.watched_client = self.client
+        if self.cfg.vvv:
+            self.log.debug('Watching etcd responses under "{}" on {}'.format(self.response_prefix, self.host_address))
+
+    def callback(self, response):
+        if isinstance(response, Exception):
+            self.log.warn('Etcd watch on "{}" failed, "{}"'.format(self.response_prefix, response))
+            self.watched_client = None
+            return
+
+        for event in put_events(response):
+            key = event.key.decode('utf-8')
+            with self.lock:
+                waiter = self.waiters.pop(key, None)
+            if waiter is not None:
+                waiter.set(value=event.value)
+            # Responses are consumed once, including late responses of abandoned attempts
+            self.operations.put((key, None, None))
+
+    def send(self, key, value, response_key, timeout):
+        waiter = Waiter()
+        with self.lock:
+            self.waiters[response_key] = waiter
+        try:
+            self.operations.put((key, value, response_key))
+            return waiter.wait(timeout)
+        finally:
+            with self.lock:
+                if self.waiters.get(response_key) is waiter:
+                    self.waiters.pop(response_key)
+
+    def run(self):
+        while not self.gtfo:
+            if self.watched_client is None or self.watched_client is not self.client:
+                self.connect(True)
+            else:
+                self.connect(False)
+
+            try:
+                batch = [self.operations.get(block=True, timeout=0.2)]
+            except queue.Empty:
+                continue
+
+            # Whatever accumulated while the previous transaction was in flight is written together
+            while len(batch) < self.cfg.etcd_batch_size:
+                try:
+                    batch.append(self.operations.get(block=False))
+                except queue.Empty:
+                    break
+
+            try:
+                commit(self.client, [(key, value) for key, value, response_key in batch])
+                if self.cfg.vvvvv:
+                    self.log.debug('Committed {} etcd operations'.format(len(batch)))
+            except Exception as e:
+                self.log.warn('Reinitializing Etcd client due to "{}"'.format(e))
+                for key, value, response_key in batch:
+                    self.fail(response_key, e)
+                self.connect(True)
+
+    def fail(self, response_key, error):
+        if response_key is None:
+            return
+        with self.lock:
+            waiter = self.waiters.pop(response_key, None)
+        if waiter is not None:
+            waiter.set(error=error)
+
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
@@ -15,55 +15,119 @@
 #    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
 #
 from concurrent import futures
-import time
-from datetime import datetime
+import sys
 import threading
-import random
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+else:
+    import Queue as queue
 
 import nudnik
+import nudnik.stats
+import nudnik.etcd_client
 import nudnik.utils as utils
 
 class Server(threading.Thread):
-    event = threading.Event()
+    ''' Consumes requests from a prefix watch, parses them on a worker pool and writes the results in batched transactions '''
 
     def __init__(self, cfg, stats):
         threading.Thread.__init__(self)
         self.gtfo = False
+        self.event = threading.Event()
+        self.lock = threading.Lock()
         self.cfg = cfg
         self.log = utils.get_logger(cfg.debug)
         self.stats = stats
+        self.client = None
+        self.watched_client = None
         self.host_resolved_at = 0
+        self.pending = set()
+        self.operations = queue.Queue()
+        self.executor = futures.ThreadPoolExecutor(max_workers=cfg.workers)
+        self.request_prefix = cfg.etcd_format_key_request.format(name=cfg.name)
+        self.response_prefix = cfg.etcd_format_key_response.format(name=cfg.name)
 
     def run(self):
-        utils.set_etcd_client(self, True)
+        utils.get_resolver(self.cfg).attach(self.stats)
+        self.connect(True)
         self.log.info('Parser server "{}" binded to queue on "{}:{}"'.format(self.cfg.name, self.cfg.host, self.cfg.port))
 
-        request_prefix = self.cfg.etcd_format_key_request.format(name=self.cfg.name)
-        response_prefix = self.cfg.etcd_format_key_response.format(name=self.cfg.name)
-
         while not self.gtfo:
-            time_start = utils.time_ns()
-            utils.set_etcd_client(self, False)
-            messages = self.client.get_prefix(request_prefix)
-            for message in messages:
-                timestamp = utils.time_ns()
-                request = nudnik.entity_pb2.Request()
-                request.ParseFromString(message[0])
-                response = utils.parse_request(self, request, timestamp)
-                grpc_response = nudnik.entity_pb2.Response(**response)
-
-                request_key = message[1].key
-                response_key = request_key.replace(request_prefix, response_prefix, 1)
-                stat = nudnik.stats.Stat(request, grpc_response, timestamp)
-                self.stats.append(stat)
-                self.client.put(response_key, grpc_response.SerializeToString())
-                self.client.delete(request_key)
-
-
-
-            elapsed = utils.diff_seconds(time_start, utils.time_ns())
-            if elapsed < self.cfg.interval:
-                self.event.wait(timeout=(self.cfg.interval - elapsed))
+            if self.watched_client is None or self.watched_client is not self.client:
+                self.connect(True)
+            else:
+                self.connect(False)
+
+            try:
+                batch = list(self.operations.get(block=True, timeout=0.2))
+            except queue.Empty:
+                continue
+
+            # The response put and request delete of a message are always committed together
+            while len(batch) < self.cfg.etcd_batch_size:
+                try:
+                    batch.extend(self.operations.get(block=False))
+                except queue.Empty:
+                    break
+
+            try:
+                nudnik.etcd_client.commit(self.client, batch)
+            except Exception as e:
+                self.log.warn('Reinitializing Etcd client due to "{}"'.format(e))
+                self.watched_client = None
+                # Requests that were not deleted are picked up again after reconnecting
+            finally:
+                with self.lock:
+                    for key, value in batch:
+                        if value is None:
+                            self.pending.discard(key)
+
+        self.executor.shutdown(wait=False)
+
+    def connect(self, force):
+        utils.set_etcd_client(self, force)
+        if self.client is None or self.client is self.watched_client:
+            return
+
+        self.client.add_watch_prefix_callback(self.request_prefix, self.callback)
+        self.watched_client = self.client
+
+        # Requests written before the watch was established
+        for value, metadata in self.client.get_prefix(self.request_prefix):
+            self.submit(metadata.key.decode('utf-8'), value)
+
+    def callback(self, response):
+        if isinstance(response, Exception):
+            self.log.warn('Etcd watch on "{}" failed, "{}"'.format(self.request_prefix, response))
+            self.watched_client = None
+            return
+
+        for event in nudnik.etcd_client.put_events(response):
+            self.submit(event.key.decode('utf-8'), event.value)
+
+    def submit(self, request_key, value):
+        with self.lock:
+            if request_key in self.pending:
+                return
+            self.pending.add(request_key)
+        self.executor.submit(self.handle, request_key, value)
+
+    def handle(self, request_key, value):
+        timestamp = utils.time_ns()
+        try:
+            request = nudnik.entity_pb2.Request()
+            request.ParseFromString(value)
+            response = utils.parse_request(self, request, timestamp)
+            grpc_response = nudnik.entity_pb2.Response(**response)
+        except Exception as e:
+            self.log.fatal('Failed parsing "{}", {}'.format(request_key, e))
+            self.operations.put([(request_key, None)])
+            return
+
+        self.stats.record(request, grpc_response, timestamp)
+
+        response_key = request_key.replace(self.request_prefix, self.response_prefix, 1)
+        self.operations.put([(response_key, grpc_response.SerializeToString()), (request_key, None)])
 
     def exit(self):
         self.gtfo = 1
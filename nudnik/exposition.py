@@ -0,0 +1,131 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import bisect
+import threading
+
+import nudnik
+import nudnik.utils as utils
+
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_BILLION = float(10**9)
+
+class Exposition(object):
+    ''' Cumulative counters and latency histograms of every recorded message, served by the RUOK server on "ruok_metrics_path" '''
+
+    def __init__(self, cfg, stats):
+        self.cfg = cfg
+        self.stats = stats
+        self.mode = 'serverstats' if cfg.server else 'clientstats'
+        self.lock = threading.Lock()
+        # Bounds are configured in seconds, messages are recorded in nanoseconds
+        self.bounds = [int(bound * _BILLION) for bound in cfg.ruok_metrics_buckets]
+        self.series = dict()
+        self.statuses = dict()
+
+    def observe(self, stats):
+        columns = zip(stats.names,
+                      stats.request_column('stream_id'),
+                      stats.request_column('ctime'),
+                      stats.request_column('rcount'),
+                      stats.response_column('status_code'),
+                      stats.timestamps)
+        # A scrape only waits for a single interval to be added, never for the messages to be recorded
+        with self.lock:
+            for name, stream_id, ctime, rcount, status_code, timestamp in columns:
+                key = (name, stream_id)
+                series = self.series.get(key)
+                if series is None:
+                    series = Series(len(self.bounds))
+                    self.series[key] = series
+                rtt = utils.diff_nanoseconds(ctime, timestamp)
+                series.record(bisect.bisect_left(self.bounds, rtt), rtt, rcount)
+
+                key = (name, stream_id, status_code)
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self):
+        lines = list()
+        mode = _escape(self.mode)
+
+        lines.append('# HELP nudnik_requests_total Requests sent or served, by result')
+        lines.append('# TYPE nudnik_requests_total counter')
+        lines.append('nudnik_requests_total{{mode="{}",result="success"}} {}'.format(mode, self.stats.successful_requests))
+        lines.append('nudnik_requests_total{{mode="{}",result="failure"}} {}'.format(mode, self.stats.failed_requests))
+
+        lines.append('# HELP nudnik_output_lines_total Lines handed to the stats backends, by backend and outcome')
+        lines.append('# TYPE nudnik_output_lines_total counter')
+        for output in list(self.stats.outputs):
+            for outcome in ['written', 'dropped', 'failed']:
+                lines.append('nudnik_output_lines_total{{mode="{}",backend="{}",outcome="{}"}} {}'.format(mode, _escape(output.backend), outcome, getattr(output, outcome)))
+
+        with self.lock:
+            statuses = sorted(self.statuses.items())
+            series = sorted([(key, value.copy()) for key, value in self.series.items()])
+
+        lines.append('# HELP nudnik_messages_total Messages recorded, by status code')
+        lines.append('# TYPE nudnik_messages_total counter')
+        for (name, stream_id, status_code), count in statuses:
+            lines.append('nudnik_messages_total{{mode="{}",name="{}",stream="{}",status="{}"}} {}'.format(mode, _escape(name), stream_id, status_code, count))
+
+        lines.append('# HELP nudnik_retransmits_total Retransmits of the messages recorded')
+        lines.append('# TYPE nudnik_retransmits_total counter')
+        for (name, stream_id), value in series:
+            lines.append('nudnik_retransmits_total{{mode="{}",name="{}",stream="{}"}} {}'.format(mode, _escape(name), stream_id, value.retransmits))
+
+        lines.append('# HELP nudnik_rtt_seconds Round trip time of the messages recorded')
+        lines.append('# TYPE nudnik_rtt_seconds histogram')
+        for (name, stream_id), value in series:
+            labels = 'mode="{}",name="{}",stream="{}"'.format(mode, _escape(name), stream_id)
+            cumulative = 0
+            for bound, count in zip(self.cfg.ruok_metrics_buckets, value.counts):
+                cumulative += count
+                lines.append('nudnik_rtt_seconds_bucket{{{},le="{}"}} {}'.format(labels, float(bound), cumulative))
+            lines.append('nudnik_rtt_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, value.count))
+            lines.append('nudnik_rtt_seconds_sum{{{}}} {}'.format(labels, value.sum / _BILLION))
+            lines.append('nudnik_rtt_seconds_count{{{}}} {}'.format(labels, value.count))
+
+        lines.append('')
+        return '\n'.join(lines)
+
+class Series(object):
+    ''' Histogram buckets (not cumulative, the last one is +Inf) and counters of a single name and stream '''
+    __slots__ = ['counts', 'count', 'sum', 'retransmits']
+
+    def __init__(self, bounds):
+        self.counts = [0] * (bounds + 1)
+        self.count = 0
+        self.sum = 0
+        self.retransmits = 0
+
+    def record(self, bucket, value, rcount):
+        self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.retransmits += rcount
+
+    def copy(self):
+        series = Series(len(self.counts) - 1)
+        series.counts = list(self.counts)
+        series.count = self.count
+        series.sum = self.sum
+        series.retransmits = self.retransmits
+        return series
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
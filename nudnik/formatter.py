@@ -0,0 +1,70 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import string
+import threading
+
+_formatters = dict()
+_formatters_lock = threading.Lock()
+
+def format_fields(fmt):
+    ''' Top level names referenced by a format, including those nested in format specs '''
+    fields = set()
+    for literal_text, field_name, format_spec, conversion in string.Formatter().parse(fmt):
+        if field_name:
+            fields.add(field_name.split('.')[0].split('[')[0])
+        if format_spec:
+            fields.update(format_fields(format_spec))
+    return fields
+
+def compile_formatter(dataformat, getters, getter_factory=None):
+    ''' Parses "dataformat" once per process, formats are shared by every interval and output '''
+    key = (dataformat, id(getters), getter_factory)
+    formatter = _formatters.get(key)
+    if formatter is None:
+        with _formatters_lock:
+            formatter = _formatters.get(key)
+            if formatter is None:
+                formatter = Formatter(dataformat, getters, getter_factory)
+                _formatters[key] = formatter
+    return formatter
+
+class Formatter(object):
+    ''' Renders a format, computing only the fields it references, "getter_factory" handles fields missing from "getters" '''
+
+    def __init__(self, dataformat, getters, getter_factory=None):
+        self.dataformat = dataformat
+        self.fields = format_fields(dataformat)
+        self.getters = list()
+        for name in sorted(self.fields):
+            getter = getters.get(name)
+            if getter is None and getter_factory is not None:
+                getter = getter_factory(name)
+            # Unknown fields are left out, str.format reports them when rendering
+            if getter is not None:
+                self.getters.append((name, getter))
+
+        if len(self.getters) == 0:
+            self.render = self.render_static
+
+    def render(self, item, context):
+        fields = dict()
+        for name, getter in self.getters:
+            fields[name] = getter(item, context)
+        return self.dataformat.format(**fields)
+
+    def render_static(self, item, context):
+        return self.dataformat.format()
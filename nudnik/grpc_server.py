@@ -34,25 +34,48 @@ class ParseService(nudnik.entity_pb2_grpc.ParserServicer):
         self.cfg = cfg
         self.log = utils.get_logger(cfg.debug)
         self.stats = stats
+        # Every streaming call holds a pool thread for its whole lifetime, at most "grpc_stream_workers" calls may hold one at once
+        self.streams = threading.BoundedSemaphore(cfg.grpc_stream_workers) if cfg.grpc_stream_workers > 0 else None
 
     def parse(self, request, context):
         timestamp = utils.time_ns()
         response = utils.parse_request(self, request, timestamp)
         grpc_response = nudnik.entity_pb2.Response(**response)
 
-        stat = nudnik.stats.Stat(request, grpc_response, timestamp)
-        self.stats.append(stat)
+        self.stats.record(request, grpc_response, timestamp)
 
         return grpc_response
 
-    def start_server(self):
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.cfg.workers))
+    def parse_stream(self, request_iterator, context):
+        # Streams beyond the limit fail fast, waiting would hold a thread without ever being served
+        if self.streams is None or not self.streams.acquire(False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'All {} streaming calls are taken'.format(self.cfg.grpc_stream_workers))
+
+        try:
+            for request in request_iterator:
+                timestamp = utils.time_ns()
+                response = utils.parse_request(self, request, timestamp)
+                grpc_response = nudnik.entity_pb2.Response(**response)
+
+                self.stats.record(request, grpc_response, timestamp)
+
+                yield grpc_response
+        finally:
+            self.streams.release()
+
+    def create_server(self):
+        # Calls beyond the pool queue for a thread as they always did, it has a thread for every allowed stream on top of "workers"
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.cfg.workers + self.cfg.grpc_stream_workers))
         nudnik.entity_pb2_grpc.add_ParserServicer_to_server(ParseService(self.cfg, self.stats), server)
         bind_host = self.cfg.host if self.cfg.host != '0.0.0.0' else '[::]'
-        server.add_insecure_port('{}:{}'.format(bind_host, self.cfg.port))
+        port = server.add_insecure_port('{}:{}'.format(bind_host, self.cfg.port))
+        return server, bind_host, port
+
+    def start_server(self):
+        server, bind_host, port = self.create_server()
         # Non blocking
         server.start()
-        self.log.info('Parser Server "{}" binded to "{}:{}"'.format(self.cfg.name, bind_host, self.cfg.port))
+        self.log.info('Parser Server "{}" binded to "{}:{}"'.format(self.cfg.name, bind_host, port))
 
         try:
             while not self.event.is_set():
@@ -0,0 +1,95 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+
+import nudnik
+import nudnik.utils as utils
+
+# Percentiles of a summary, named after the fields they are reported as
+SUMMARY_PERCENTILES = [('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9)]
+
+class Histogram(object):
+    ''' Log-linear (HDR style) histogram of integers, with a relative error below 2 ** (1 - precision) '''
+
+    def __init__(self, precision=8):
+        self.precision = precision
+        self.mask = (1 << precision) - 1
+        self.counts = dict()
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        # Deltas between the clocks of different nodes may be negative, those are mirrored below zero
+        if value < 0:
+            return -self.bucket(-value) - 1
+        shift = max(0, value.bit_length() - self.precision)
+        return (shift << self.precision) | (value >> shift)
+
+    def bucket_value(self, bucket):
+        if bucket < 0:
+            return -self.bucket_value(-bucket - 1)
+        # The middle of the range of values that share the bucket
+        shift = bucket >> self.precision
+        lowest = (bucket & self.mask) << shift
+        return lowest + ((1 << shift) >> 1)
+
+    def record(self, value, count=1):
+        value = int(value)
+        if self.count == 0:
+            self.min = value
+            self.max = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.count += count
+
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        for bucket in other.counts:
+            self.counts[bucket] = self.counts.get(bucket, 0) + other.counts[bucket]
+        self.min = other.min if self.count == 0 else min(self.min, other.min)
+        self.max = other.max if self.count == 0 else max(self.max, other.max)
+        self.count += other.count
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.max, max(self.min, self.bucket_value(bucket)))
+        return self.max
+
+    def summary(self, timestamp, metric):
+        return SummaryStat(timestamp, metric, self)
+
+class SummaryStat(utils.NudnikObject):
+    def __init__(self, timestamp, metric, histogram):
+        super(SummaryStat, self).__init__(timestamp)
+        self.metric = metric
+        self.count = histogram.count
+        self.min = histogram.min
+        for name, p in SUMMARY_PERCENTILES:
+            setattr(self, name, histogram.percentile(p))
+        self.max = histogram.max
@@ -22,6 +22,18 @@ import platform
 
 import nudnik.utils as utils
 import nudnik.outputs
+import nudnik.formatter
+
+_node = None
+_node_lock = threading.Lock()
+
+def get_node():
+    ''' Node attributes never change while running, they are only probed once per process '''
+    global _node
+    with _node_lock:
+        if _node is None:
+            _node = MetricNode()
+    return _node
 
 class Metrics(threading.Thread):
 
@@ -31,18 +43,26 @@ class Metrics(threading.Thread):
         self.event = threading.Event()
         self.cfg = cfg
         self.log = utils.get_logger(cfg.debug)
-        self.workers = list()
-        self.node = MetricNode()
+        self.outputs = list()
+        self.node = get_node()
+        # Only the probes referenced by the configured formats are sampled
+        self.probes = set()
+        outputs = set(cfg.metrics)
+        if cfg.debug:
+            outputs.add('stdout')
+        for output in outputs:
+            self.probes.update(nudnik.formatter.format_fields(cfg.get('metrics_format_{}'.format(output))))
         self.log.debug('Metrics thread initiated')
 
     def run(self):
         self.log.debug('Running {}'.format(self.name))
         mode = 'servermetrics' if self.cfg.server else 'clientmetrics'
+        self.start_outputs(mode)
 
         while not self.gtfo:
             time_start = utils.time_ns()
 
-            metric = Metric(self.node)
+            metric = Metric(self.node, self.probes)
 
             if self.cfg.debug:
                 for strmetric in _parse_metrics(self.log, mode, [metric], self.cfg.metrics_format_stdout):
@@ -51,30 +71,25 @@ class Metrics(threading.Thread):
                 for strmetric in _parse_metrics(self.log, mode, [metric], self.cfg.metrics_format_stdout):
                     self.log.info(strmetric)
 
-            if 'file' in self.cfg.metrics:
-                thread = MetricsFileOutput(self.log, self.cfg.metrics_file_path, mode, [metric], self.cfg.metrics_format_file)
-                thread.start()
-                self.workers.append(thread)
-            if 'influxdb' in self.cfg.metrics:
-                thread = MetricsInfluxdbOutput(self.log, self.cfg.influxdb_url_metrics, mode, [metric], self.cfg.metrics_format_influxdb)
-                thread.start()
-                self.workers.append(thread)
-            if 'prometheus' in self.cfg.metrics:
-                thread = MetricsPrometheusOutput(self.log, self.cfg.prometheus_url_metrics, mode, [metric], self.cfg.metrics_format_prometheus)
-                thread.start()
-                self.workers.append(thread)
-
-            while len(self.workers) > 0:
-                for index, thread in enumerate(self.workers):
-                    if thread.is_alive():
-                        thread.join(0.25)
-                    else:
-                        self.workers.pop(index)
+            for output in self.outputs:
+                output.submit([metric], 1)
 
             elapsed = utils.diff_seconds(time_start, utils.time_ns())
             if elapsed < self.cfg.metrics_interval:
                 self.event.wait(timeout=(self.cfg.metrics_interval - elapsed))
 
+        nudnik.outputs.stop_outputs(self.outputs)
+
+    def start_outputs(self, mode):
+        if 'file' in self.cfg.metrics:
+            self.outputs.append(MetricsFileOutput(self.cfg, self.log, self.cfg.metrics_file_path, mode, self.cfg.metrics_format_file))
+        if 'influxdb' in self.cfg.metrics:
+            self.outputs.append(MetricsInfluxdbOutput(self.cfg, self.log, self.cfg.influxdb_url_metrics, mode, self.cfg.metrics_format_influxdb))
+        if 'prometheus' in self.cfg.metrics:
+            self.outputs.append(MetricsPrometheusOutput(self.cfg, self.log, self.cfg.prometheus_url_metrics, mode, self.cfg.metrics_format_prometheus))
+        for output in self.outputs:
+            output.start()
+
     def exit(self):
         self.gtfo = 1
         self.event.set()
@@ -87,8 +102,9 @@ class MetricNode(utils.NudnikObject):
         self.major, self.minor, self.micro, self.releaselevel, self.serial = sys.version_info
         for index, v in enumerate(sys.version.split('\n')):
             setattr(self, 'version_{index}'.format(index=index), v)
-        self.dist = ''.join(platform.dist())
-        self.distribution = ''.join(platform.linux_distribution())
+        # Both were removed from the platform module in Python 3.8
+        self.dist = ''.join(getattr(platform, 'dist', _no_distribution)())
+        self.distribution = ''.join(getattr(platform, 'linux_distribution', _linux_distribution)())
         self.platform = platform.platform()
 
 class MetricCpu(utils.NudnikObject):
@@ -160,49 +176,61 @@ class MetricNet(utils.NudnikObject):
         for key in net.keys():
             setattr(self, '{key}'.format(key=key), net[key])
 
+PROBES = {'cpu': MetricCpu, 'mem': MetricMemory, 'disk': MetricDisk, 'net': MetricNet}
+
 class Metric(utils.NudnikObject):
-    def __init__(self, node):
+    def __init__(self, node, probes=PROBES):
         super(Metric, self).__init__(timestamp=utils.time_ns())
         self.node = node
-        self.cpu = MetricCpu()
-        self.mem = MetricMemory()
-        self.disk = MetricDisk()
-        self.net = MetricNet()
+        for name in PROBES:
+            setattr(self, name, PROBES[name]() if name in probes else None)
 
 class MetricsFileOutput(nudnik.outputs.FileOutput):
 
-    def parse(self):
-        for stat in _parse_metrics(self.log, self.mode, self.data, self.format):
-            self.parsed_data.append(stat)
+    def parse(self, data):
+        return list(_parse_metrics(self.log, self.mode, data, self.format))
 
 class MetricsInfluxdbOutput(nudnik.outputs.InfluxdbOutput):
 
-    def parse(self):
-        for stat in _parse_metrics(self.log, self.mode, self.data, self.format):
-            self.parsed_data.append(stat)
+    def parse(self, data):
+        return list(_parse_metrics(self.log, self.mode, data, self.format))
 
-class MetricsPrometheusOutput(nudnik.outputs.InfluxdbOutput):
+class MetricsPrometheusOutput(nudnik.outputs.PrometheusOutput):
 
-    def parse(self):
-        for stat in _parse_metrics(self.log, self.mode, self.data, self.format):
-            self.parsed_data.append(stat)
+    def parse(self, data):
+        return list(_parse_metrics(self.log, self.mode, data, self.format))
 
 def _parse_metrics(log, mode, metrics, dataformat):
+    formatter = nudnik.formatter.compile_formatter(dataformat, METRIC_FIELDS)
     for metric in metrics:
         try:
-            metricstring = dataformat.format(mode=mode,
-                                         timestamp=metric.timestamp,
-                                         node=metric.node,
-                                         cpu=metric.cpu,
-                                         mem=metric.mem,
-                                         disk=metric.disk,
-                                         net=metric.net)
+            metricstring = formatter.render(metric, mode)
         except Exception as e:
             log.fatal('Fatal error occured while parsing provided format: "{}", {}'.format(dataformat, e))
             break
 
         yield metricstring
 
+def _no_distribution():
+    return ('', '', '')
+
+def _linux_distribution():
+    try:
+        release = platform.freedesktop_os_release()
+    except (AttributeError, OSError):
+        return _no_distribution()
+    return (release.get('NAME', ''), release.get('VERSION_ID', ''), release.get('VERSION_CODENAME', ''))
+
+METRIC_FIELDS = {
+    'mode': lambda metric, mode: mode,
+    'timestamp': lambda metric, mode: metric.timestamp,
+    'node': lambda metric, mode: metric.node,
+    'cpu': lambda metric, mode: metric.cpu,
+    'mem': lambda metric, mode: metric.mem,
+    'disk': lambda metric, mode: metric.disk,
+    'net': lambda metric, mode: metric.net,
+}
+
 def _minus_h(b):
     symbols = ('K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y', 'S')
     prefix = {}
@@ -14,87 +14,360 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
 #
+import os
+import sys
+import time
+import zlib
+import fcntl
+import random
 import threading
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+    from urllib.parse import urlparse, parse_qs
+else:
+    import Queue as queue
+    from urlparse import urlparse, parse_qs
+
+import requests
 import requests_unixsocket
 
+# Spooled bodies replayed after every successful write
+SPOOL_REPLAY_BATCH = 10
+
+# Seconds the outputs are given to write what they hold on exit
+EXIT_TIMEOUT = 10
+
+# Held for the lifetime of the process, see lock_spool
+_spool_lock = None
+
 class Output(threading.Thread):
-    def __init__(self, log, data, format):
+    ''' Long-lived writer of a single backend, fed through a bounded queue so a slow backend never blocks its producer '''
+
+    def __init__(self, cfg, log, mode, format):
         threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.cfg = cfg
         self.log = log
-        self.data = data
-        self.parsed_data = []
+        self.mode = mode
         self.format = format
+        self.queue = queue.Queue(maxsize=max(1, cfg.output_queue_size))
+        self.batch = list()
+        self.batch_rows = 0
+        self.batch_started = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.spooled = 0
+        self.replayed = 0
+        # Whether the messages are sampled by "stats_sample_ratio" and "stats_sample_reservoir" before they are submitted
+        self.sampled = True
+        self.daemon = True
+
+    def submit(self, data, count):
+        ''' Never blocks, "count" items are accounted as dropped if the queue is full '''
+        try:
+            self.queue.put_nowait((data, count))
+            return True
+        except queue.Full:
+            pass
+
+        if self.cfg.output_overflow == 'shed':
+            # Make room for the newest data by discarding the oldest one waiting
+            try:
+                shed_data, shed_count = self.queue.get_nowait()
+                self.dropped += shed_count
+                self.queue.put_nowait((data, count))
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        self.dropped += count
+        if self.cfg.vv:
+            self.log.debug('{} is falling behind, dropped {} items'.format(self.name, count))
+        return False
 
     def run(self):
-        self.parse()
-        self.out()
+        while not self.event.is_set():
+            try:
+                data, count = self.queue.get(block=True, timeout=0.25)
+                self.add(data)
+            except queue.Empty:
+                pass
+            if self.event.is_set():
+                break
 
-    def parse(self):
-        pass
+            if self.batch_rows >= self.cfg.output_batch_size:
+                self.flush()
+            elif len(self.batch) > 0 and (time.time() - self.batch_started) >= self.cfg.output_batch_interval:
+                self.flush()
+
+        # Whatever was already handed over is still written on exit
+        while True:
+            try:
+                data, count = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.add(data)
+        self.flush()
+
+    def add(self, data):
+        if len(self.batch) == 0:
+            self.batch_started = time.time()
+        items = self.parse(data)
+        self.batch.extend(items)
+        self.batch_rows += self.size(items)
 
-    def out(self):
+    def flush(self):
+        batch = self.batch
+        self.batch = list()
+        self.batch_rows = 0
+        # Chunks are bounded by rows, an item of the binary backend holds many of them
+        chunk = list()
+        rows = 0
+        for item in batch:
+            chunk.append(item)
+            rows += self.rows(item)
+            if rows >= self.cfg.output_batch_size:
+                self.write_chunk(chunk, rows)
+                chunk = list()
+                rows = 0
+        if len(chunk) > 0:
+            self.write_chunk(chunk, rows)
+
+    def write_chunk(self, chunk, rows):
+        try:
+            success = self.out(chunk)
+        except Exception as e:
+            self.log.error('{} failed writing {} items, "{}"'.format(self.name, rows, e))
+            success = False
+
+        self.batches += 1
+        if success is False:
+            self.failed += rows
+        else:
+            self.written += rows
+
+    def parse(self, data):
+        return data
+
+    def rows(self, item):
+        return 1
+
+    def size(self, data):
+        return sum([self.rows(item) for item in data])
+
+    def out(self, data):
         pass
 
-class PrintOutput(Output):
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
 
-    def out(self):
-        print(self.format.format(self.data))
+def stop_outputs(outputs):
+    ''' Asks every output to write what it holds and waits for all of them, EXIT_TIMEOUT seconds at most '''
+    for output in outputs:
+        output.exit()
+    deadline = time.time() + EXIT_TIMEOUT
+    for output in outputs:
+        output.join(max(0, deadline - time.time()))
+        if output.is_alive():
+            output.log.warn('{} did not finish writing within {} seconds'.format(output.name, EXIT_TIMEOUT))
 
 class FileOutput(Output):
-    def __init__(self, log, path, mode, data, format):
-        super(FileOutput, self).__init__(log, data, format)
-        self.mode = mode
+    def __init__(self, cfg, log, path, mode, format):
+        super(FileOutput, self).__init__(cfg, log, mode, format)
         self.path = path
+        self.backend = 'file'
+        self.name = '{}-file'.format(mode)
 
-    def out(self):
-        self.log.debug('Writing {} items to {}'.format(len(self.parsed_data), self.path))
+    def out(self, data):
+        self.log.debug('Writing {} items to {}'.format(len(data), self.path))
         with open(self.path, 'a') as statsfile:
-            statsfile.write('\n'.join(self.parsed_data))
+            statsfile.write('\n'.join(data))
             statsfile.write('\n')
 
 class InfluxdbOutput(Output):
-    def __init__(self, log, url, mode, data, format):
-        super(InfluxdbOutput, self).__init__(log, data, format)
-        self.mode = mode
+    ''' Writes gzipped line protocol over a single pooled connection, what could not be written is spooled to disk and replayed '''
+
+    def __init__(self, cfg, log, url, mode, format):
+        super(InfluxdbOutput, self).__init__(cfg, log, mode, format)
         self.url = url
+        self.session = None
+        self.backend = 'influxdb'
+        self.name = '{}-influxdb'.format(mode)
+        self.spool = None
+        if cfg.influxdb_spool_path:
+            # Keyed by the instance name too, nudnik processes sharing a directory must not replay each other's writes
+            self.spool = Spool(os.path.join(cfg.influxdb_spool_path, '{}-{}'.format(cfg.name, self.name)), cfg.influxdb_spool_max_size * (2**20))
 
-    def out(self):
-        self.log.debug('Writing {} items to InfluxDB'.format(len(self.parsed_data)))
-        session = requests_unixsocket.Session()
-        res = session.post(self.url, data='\n'.join(self.parsed_data))
-        session.close()
-        if res.status_code != 204:
-            self.log.error('InfluxDB response: "{}"'.format(res.text))
+    def out(self, data):
+        self.log.debug('Writing {} items to InfluxDB'.format(len(data)))
+        body = '\n'.join(data).encode('utf-8')
+        if self.cfg.influxdb_gzip:
+            body = gzip(body)
+
+        status = self.write(body, self.cfg.influxdb_gzip)
+        if status == 'unavailable' and self.spool is not None:
+            if self.spool.put(body, len(data), self.cfg.influxdb_gzip):
+                self.spooled += len(data)
+                self.log.warn('Spooled {} items to {}, InfluxDB is unavailable'.format(len(data), self.spool.path))
+            else:
+                self.log.error('Dropping {} items, the spool at {} is full'.format(len(data), self.spool.path))
+            return False
+
+        if status == 'written' and self.spool is not None:
+            self.replay()
+        return status == 'written'
+
+    def replay(self):
+        # Only a few spooled bodies per flush, fresh data must not wait for a whole outage to be replayed
+        for path, count, gzipped in self.spool.oldest(SPOOL_REPLAY_BATCH):
+            try:
+                body = self.spool.read(path)
+            except EnvironmentError as e:
+                self.log.warn('Skipping spooled items in {}, "{}"'.format(path, e))
+                continue
+            status = self.write(body, gzipped)
+            if status == 'unavailable':
+                return
+            try:
+                self.spool.remove(path)
+            except EnvironmentError as e:
+                self.log.warn('Failed removing replayed items in {}, "{}"'.format(path, e))
+            if status == 'written':
+                self.replayed += count
+
+    def write(self, body, gzipped):
+        ''' Returns "written", "rejected" when InfluxDB refused the points themselves, or "unavailable" '''
+        headers = {'Content-Type': 'application/octet-stream'}
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
+
+        for attempt in range(0, 1 + max(0, self.cfg.influxdb_retries)):
+            if attempt > 0:
+                delay = min(self.cfg.influxdb_retry_backoff_max, self.cfg.influxdb_retry_backoff * (2 ** (attempt - 1)))
+                self.event.wait(timeout=random.uniform(delay / 2.0, delay))
+
+            if self.session is None:
+                self.session = requests_unixsocket.Session()
+            try:
+                res = self.session.post(self.url, data=body, headers=headers, timeout=self.cfg.influxdb_timeout)
+            except requests.exceptions.RequestException as e:
+                self.log.warn('Failed writing to InfluxDB, attempt {}, "{}"'.format(attempt + 1, e))
+                self.session.close()
+                self.session = None
+                continue
+
+            if res.status_code == 204:
+                return 'written'
+            elif res.status_code == 404 and 'database not found' in res.text:
+                self.log.warn('InfluxDB database is missing, attempt {}'.format(attempt + 1))
+                create_influxdb_database(self.cfg.influxdb_protocol, self.cfg.influxdb_host_port, self.database(), self.session)
+            elif res.status_code == 429 or res.status_code >= 500:
+                self.log.warn('InfluxDB response {}, attempt {}: "{}"'.format(res.status_code, attempt + 1, res.text))
+            else:
+                self.log.error('InfluxDB response: "{}"'.format(res.text))
+                return 'rejected'
+        return 'unavailable'
+
+    def database(self):
+        return parse_qs(urlparse(self.url).query).get('db', [''])[0]
+
+class Spool(object):
+    ''' Line protocol bodies that could not be written, a file each, replayed oldest first '''
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in os.listdir(path):
+            # Bodies still being written are neither replayed nor counted
+            if not name.startswith('.'):
+                self.size += os.path.getsize(os.path.join(path, name))
+
+    def put(self, body, count, gzipped):
+        if self.size + len(body) > self.max_size:
+            return False
+        name = '{:020d}-{}-{}.lp{}'.format(int(time.time() * (10**9)), os.getpid(), count, '.gz' if gzipped else '')
+        # Written aside and renamed, so a replay never reads a partial body
+        temp_path = os.path.join(self.path, '.{}'.format(name))
+        with open(temp_path, 'wb') as spoolfile:
+            spoolfile.write(body)
+        os.rename(temp_path, os.path.join(self.path, name))
+        self.size += len(body)
+        return True
+
+    def oldest(self, count):
+        names = sorted([name for name in os.listdir(self.path) if not name.startswith('.')])
+        return [(os.path.join(self.path, name), int(name.split('.')[0].split('-')[-1]), name.endswith('.gz')) for name in names[0:count]]
+
+    def read(self, path):
+        with open(path, 'rb') as spoolfile:
+            return spoolfile.read()
+
+    def remove(self, path):
+        self.size -= os.path.getsize(path)
+        os.remove(path)
 
 class PrometheusOutput(Output):
-    def __init__(self, log, url, mode, data, format):
-        super(PrometheusOutput, self).__init__(log, data, format)
-        self.mode = mode
+    def __init__(self, cfg, log, url, mode, format):
+        super(PrometheusOutput, self).__init__(cfg, log, mode, format)
         self.url = url
+        self.session = None
+        self.backend = 'prometheus'
+        self.name = '{}-prometheus'.format(mode)
 
-    def out(self):
-        self.log.debug('Writing {} to Prometheus {}'.format(len(self.parsed_data), self.url))
-        session = requests_unixsocket.Session()
+    def out(self, data):
+        self.log.debug('Writing {} to Prometheus {}'.format(len(data), self.url))
+        if self.session is None:
+            self.session = requests_unixsocket.Session()
         # TODO handle PUT
-        for stat in self.parsed_data:
-            res = session.post(self.url, stat)
+        success = True
+        for stat in data:
+            res = self.session.post(self.url, stat)
             if res.status_code != 202:
                 self.log.error('Response: "{}"'.format(res.text))
-            return False
+                success = False
+        return success
 
-        session.close()
-        return True
+def lock_spool(cfg):
+    ''' Returns False if another nudnik process with the same "name" already spools to "influxdb_spool_path" '''
+    global _spool_lock
+    if not os.path.isdir(cfg.influxdb_spool_path):
+        os.makedirs(cfg.influxdb_spool_path)
+    lock_file = open(os.path.join(cfg.influxdb_spool_path, '.{}.lock'.format(cfg.name)), 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except EnvironmentError:
+        lock_file.close()
+        return False
+    _spool_lock = lock_file
+    return True
 
-def create_influxdb_database(protocol, host, database_name):
+def gzip(body):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+def create_influxdb_database(protocol, host, database_name, session=None):
     # https://docs.influxdata.com/influxdb/v1.7/tools/api/
     # https://docs.influxdata.com/influxdb/v1.7/query_language/database_management/#create-database
     query ='q=CREATE DATABASE "{}"'.format(database_name)
-    session = requests_unixsocket.Session()
-    res = session.post('{}://{}/query?{}'.format(protocol, host, query))
-    session.close()
-    if res.status_code == 200:
-        print('Response to {}: "{}"'.format(query, res.text))
-    else:
-        print('Response to {}: "{}"'.format(query, res.text))
-        raise RuntimeException(res.text)
+    close_session = session is None
+    if session is None:
+        session = requests_unixsocket.Session()
+    try:
+        res = session.post('{}://{}/query?{}'.format(protocol, host, query))
+    except requests.exceptions.RequestException as e:
+        # Writes are spooled until InfluxDB is back, they create the database then
+        print('InfluxDB is unavailable, {}: "{}"'.format(query, e))
+        return False
+    finally:
+        if close_session:
+            session.close()
 
+    print('Response to {}: "{}"'.format(query, res.text))
+    return res.status_code == 200
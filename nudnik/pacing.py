@@ -0,0 +1,44 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import random
+
+PACING_MODES = ['burst', 'constant', 'poisson', 'uniform']
+
+_BILLION = 10**9
+
+class Pacer(object):
+    ''' Open-loop inter-arrival generator, yields the gap until the next intended send time '''
+
+    def __init__(self, mode, rate, interval):
+        self.mode = mode
+        self.set_rate(rate, interval)
+
+    def set_rate(self, rate, interval):
+        if rate > 0:
+            self.mean_gap = float(interval) / rate
+        else:
+            self.mean_gap = float(interval)
+
+    def next_gap(self):
+        if self.mode == 'poisson':
+            return random.expovariate(1.0 / self.mean_gap)
+        elif self.mode == 'uniform':
+            return random.uniform(0.0, 2.0 * self.mean_gap)
+        return self.mean_gap
+
+    def next_gap_ns(self):
+        return int(self.next_gap() * _BILLION)
@@ -0,0 +1,131 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import mmap
+import threading
+import random
+
+RANDOM_SOURCES = ['random', 'urandom', '/dev/random', '/dev/urandom']
+
+_sources = dict()
+_sources_lock = threading.Lock()
+
+def get_meta(cfg, meta):
+    ''' Payload of a single message, sized according to "payload_size_distribution" '''
+    if meta is None or meta == '':
+        return ''.encode()
+    if meta[0] != '@':
+        return meta.encode()
+
+    return get_source(meta[1:], cfg.meta_size, cfg.payload_ring_size, cfg.payload_refresh_interval).get(get_size(cfg))
+
+def get_size(cfg):
+    if cfg.payload_size_distribution == 'uniform':
+        return random.randint(cfg.payload_size_min, cfg.meta_size)
+    elif cfg.payload_size_distribution == 'exponential':
+        size = int(random.expovariate(1.0 / max(1, cfg.payload_size_mean)))
+        return min(cfg.meta_size, max(cfg.payload_size_min, size))
+    return cfg.meta_size
+
+def get_source(path, size, ring_size=4, refresh_interval=1):
+    source = _sources.get(path)
+    if source is not None and source.size >= size:
+        return source
+
+    with _sources_lock:
+        source = _sources.get(path)
+        if source is None or source.size < size:
+            if isinstance(source, RandomRing):
+                # Messages already holding buffers of the smaller ring keep them, only its refresher stops
+                source.exit()
+            if path in RANDOM_SOURCES:
+                source = RandomRing(size, ring_size, refresh_interval)
+            else:
+                source = FilePayload(path, size)
+            _sources[path] = source
+    return source
+
+class FilePayload(object):
+    ''' Maps a payload file once, messages are sliced out of the mapping instead of re-reading the file '''
+
+    def __init__(self, path, size):
+        with open(path, 'rb') as f:
+            length = os.fstat(f.fileno()).st_size
+            if length > 0:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mmap = ''.encode()
+        self.size = size
+        # Messages of the maximum size share a single immutable copy
+        self.full = self.mmap[:size]
+
+    def get(self, size):
+        if size >= len(self.full):
+            return self.full
+        # A protobuf bytes field takes nothing but bytes, a memoryview would only move this single copy to the caller
+        return self.mmap[:size]
+
+class RandomRing(object):
+    ''' Pre-generated random buffers, one of them is replaced every "refresh_interval" seconds in the background '''
+
+    def __init__(self, size, ring_size, refresh_interval):
+        self.size = size
+        self.buffers = [os.urandom(size) for index in range(0, max(1, ring_size))]
+        self.index = 0
+        self.refresher = None
+        if refresh_interval > 0 and size > 0:
+            self.refresher = RingRefresher(self, refresh_interval)
+            self.refresher.daemon = True
+            self.refresher.start()
+
+    def get(self, size):
+        self.index = (self.index + 1) % len(self.buffers)
+        buf = self.buffers[self.index]
+        if size >= self.size:
+            return buf
+        offset = random.randint(0, self.size - size)
+        # Copied once, as in FilePayload.get
+        return buf[offset:offset + size]
+
+    def refresh(self, index):
+        self.buffers[index % len(self.buffers)] = os.urandom(self.size)
+
+    def exit(self):
+        if self.refresher is not None:
+            self.refresher.exit()
+
+class RingRefresher(threading.Thread):
+    def __init__(self, ring, refresh_interval):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.ring = ring
+        self.refresh_interval = refresh_interval
+        self.name = 'payload-refresher'
+
+    def run(self):
+        index = 0
+        while not self.gtfo:
+            self.event.wait(timeout=self.refresh_interval)
+            if self.gtfo:
+                return
+            self.ring.refresh(index)
+            index += 1
+
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
@@ -0,0 +1,333 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import math
+import array
+import argparse
+
+# NumPy is optional, without it the very same report is computed in plain Python, only slower
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import nudnik
+import nudnik.columnar as columnar
+
+PERCENTILES = [('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9)]
+
+# Column of every breakdown
+BREAKDOWNS = {'stream': 'req_stream_id', 'worker': 'req_worker_id', 'name': 'name', 'status': 'res_status_code', 'file': 'file'}
+
+# Phase deltas are only reported by grpc and etcd servers, messages without them are left out
+METRICS = ['rtt', 'crtt', 'cdelta', 'sdelta', 'pdelta', 'bdelta']
+
+_BILLION = float(10**9)
+_MILLION = float(10**6)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='nudnik report',
+        description='Analyze the files written by the "binary" stats backend',
+        epilog='2019 (C) Salo Shp <https://github.com/salosh/nudnik.git>')
+    parser.add_argument('paths',
+                        nargs='+',
+                        help='Binary stats files, for example the files of all clients of a single run')
+    parser.add_argument('--metric',
+                        type=str,
+                        choices=METRICS,
+                        default='rtt',
+                        help='Latency used for the timeline and the breakdowns (Default: rtt)')
+    parser.add_argument('--interval',
+                        type=float,
+                        default=1.0,
+                        help='Length of a timeline bucket in seconds (Default: 1.0)')
+    parser.add_argument('--by',
+                        type=str,
+                        action='append',
+                        choices=sorted(BREAKDOWNS.keys()),
+                        help='Break the messages down by stream, worker, name, status or file, may be specified multiple times (Default: None)')
+    parser.add_argument('--no-timeline',
+                        action='store_false',
+                        dest='timeline',
+                        help='Do not output the timeline (default: False)')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    if args.interval <= 0:
+        print('The "interval" must be positive')
+        return 1
+
+    try:
+        report = Report(args.paths)
+    except (ValueError, EnvironmentError) as e:
+        print('Failed loading binary stats, {}'.format(e))
+        return 1
+
+    if report.count == 0:
+        print('No messages were recorded in {}'.format(', '.join(args.paths)))
+        return 1
+
+    report.summary()
+    report.latencies()
+    if args.timeline:
+        report.timeline(args.metric, args.interval)
+    for by in args.by or list():
+        report.breakdown(by, args.metric)
+    return 0
+
+class Report(object):
+    ''' Columns of every message of one or more binary stats files, read through mmap and copied once into contiguous arrays '''
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.modes = list()
+        self.names = list()
+        self.columns = dict()
+        self.orders = dict()
+
+        names = dict()
+        parts = dict()
+        columns = None
+        for file_id, path in enumerate(paths):
+            header, buf, offset = columnar.open_file(path)
+            if columns is None:
+                columns = header['columns']
+            elif header['columns'] != columns:
+                raise ValueError('{} was written with other columns than {}'.format(path, paths[0]))
+            self.modes.append(header.get('mode'))
+
+            for rows, chunk_names, offsets in columnar.read_chunks(buf, offset, len(columns)):
+                # Every chunk has a names table of its own, make them global
+                mapping = [names.setdefault(name, len(names)) for name in chunk_names]
+                for column, column_offset in zip(columns, offsets):
+                    values = _column(buf, column_offset, rows)
+                    if column == 'name':
+                        values = _remap(values, mapping)
+                    parts.setdefault(column, list()).append(values)
+                parts.setdefault('file', list()).append(_constant(file_id, rows))
+
+        self.names = sorted(names, key=names.get)
+        for column in parts:
+            self.columns[column] = _concatenate(parts[column])
+        self.count = len(self.columns['timestamp']) if 'timestamp' in self.columns else 0
+
+    def metric(self, metric):
+        ''' Latencies of "metric" in nanoseconds, and the mask of the messages that have one (None if all do) '''
+        c = self.columns
+        if metric == 'rtt':
+            return _subtract(c['timestamp'], c['req_ctime']), None
+        elif metric == 'crtt':
+            return _subtract(c['timestamp'], _nonzero_or(c['req_itime'], c['req_ctime'])), None
+        elif metric == 'cdelta':
+            return _subtract(c['req_stime'], c['req_ctime']), None
+
+        mask = _nonzero(c['res_ltime'])
+        if metric == 'sdelta':
+            values = _subtract(c['res_ctime'], c['req_stime'])
+        elif metric == 'pdelta':
+            values = _subtract(c['res_stime'], c['res_ltime'])
+        else:
+            values = _subtract(c['timestamp'], c['res_stime'])
+        return _select(values, mask), mask
+
+    def order(self, metric, values):
+        # The timeline and every breakdown of a metric share a single sort of its values
+        if numpy is None:
+            return None
+        if metric not in self.orders:
+            self.orders[metric] = numpy.argsort(values)
+        return self.orders[metric]
+
+    def keys(self, column, mask=None):
+        return _select(self.columns[column], mask)
+
+    def summary(self):
+        timestamps = self.columns['timestamp']
+        duration = (_maximum(timestamps) - _minimum(timestamps)) / _BILLION
+        print('files,modes,messages,duration,throughput')
+        print('{},{},{},{},{}'.format(len(self.paths), '|'.join(sorted(set([str(mode) for mode in self.modes]))), self.count,
+                                      round(duration, 3), round(self.count / duration, 3) if duration > 0 else 0))
+        print('')
+
+    def latencies(self):
+        print('metric,count,min,{},max'.format(','.join([name for name, p in PERCENTILES])))
+        for metric in METRICS:
+            values, mask = self.metric(metric)
+            if len(values) == 0:
+                continue
+            for key, count, minimum, percentiles, maximum in _group_percentiles(None, values):
+                print('{},{},{},{},{}'.format(metric, count, _ms(minimum), ','.join([str(_ms(value)) for value in percentiles]), _ms(maximum)))
+        print('')
+
+    def timeline(self, metric, interval):
+        values, mask = self.metric(metric)
+        timestamps = self.keys('timestamp', mask)
+        if len(values) == 0:
+            return
+        start = _minimum(timestamps)
+        buckets = _bucket(timestamps, start, int(interval * _BILLION))
+
+        print('second,messages,throughput,{}_p50,{}_p99,{}_max'.format(metric, metric, metric))
+        previous = -1
+        for key, count, minimum, percentiles, maximum in _group_percentiles(buckets, values, self.order(metric, values)):
+            # Intervals without a single message are reported too, they usually matter the most
+            for empty in range(previous + 1, key):
+                print('{},0,0,0,0,0'.format(round(empty * interval, 3)))
+            print('{},{},{},{},{},{}'.format(round(key * interval, 3), count, round(count / interval, 3), _ms(percentiles[0]), _ms(percentiles[2]), _ms(maximum)))
+            previous = key
+        print('')
+
+    def breakdown(self, by, metric):
+        values, mask = self.metric(metric)
+        if len(values) == 0:
+            return
+        timestamps = self.columns['timestamp']
+        duration = (_maximum(timestamps) - _minimum(timestamps)) / _BILLION
+
+        print('{},messages,throughput,{}_p50,{}_p90,{}_p99,{}_max'.format(by, metric, metric, metric, metric))
+        for key, count, minimum, percentiles, maximum in _group_percentiles(self.keys(BREAKDOWNS[by], mask), values, self.order(metric, values)):
+            if by == 'name':
+                key = self.names[key]
+            elif by == 'file':
+                key = self.paths[key]
+            print('{},{},{},{},{},{},{}'.format(key, count, round(count / duration, 3) if duration > 0 else 0,
+                                                _ms(percentiles[0]), _ms(percentiles[1]), _ms(percentiles[2]), _ms(maximum)))
+        print('')
+
+def _ms(value):
+    return round(value / _MILLION, 3)
+
+def _rank(p, count):
+    ''' Index of the nearest-rank percentile, as in nudnik.search.percentile '''
+    return max(0, int(math.ceil(p / 100.0 * count)) - 1)
+
+def _group_percentiles(keys, values, order=None):
+    ''' Yields (key, count, min, [percentiles], max) of "values" for every distinct key in key order, a single group if "keys" is None '''
+    if numpy is not None:
+        for group in _numpy_group_percentiles(keys, values, order):
+            yield group
+        return
+
+    groups = dict()
+    if keys is None:
+        groups[0] = list(values)
+    else:
+        for key, value in zip(keys, values):
+            groups.setdefault(key, list()).append(value)
+    for key in sorted(groups):
+        group = sorted(groups[key])
+        yield key, len(group), group[0], [group[_rank(p, len(group))] for name, p in PERCENTILES], group[-1]
+
+def _numpy_group_percentiles(keys, values, order):
+    if keys is None:
+        unique = numpy.zeros(1, dtype=numpy.int64)
+        values = numpy.sort(values)
+        counts = numpy.array([len(values)])
+    else:
+        # Keys are mostly small ranges of ids, those are sorted in linear time as 16 bits codes
+        low = int(keys.min())
+        if int(keys.max()) - low < 2**16:
+            codes = (keys - low).astype(numpy.uint16)
+            unique = None
+        else:
+            unique, codes = numpy.unique(keys, return_inverse=True)
+        # Sorting by value and then stably by key leaves every group sorted by value
+        if order is None:
+            order = numpy.argsort(values)
+        order = order[numpy.argsort(codes[order], kind='stable')]
+        values = values[order]
+        counts = numpy.bincount(codes)
+        if unique is None:
+            unique = numpy.arange(len(counts), dtype=numpy.int64) + low
+        present = counts > 0
+        unique = unique[present]
+        counts = counts[present]
+
+    starts = numpy.cumsum(counts) - counts
+    columns = list()
+    for name, p in PERCENTILES:
+        ranks = numpy.maximum(numpy.ceil(p / 100.0 * counts).astype(numpy.int64) - 1, 0)
+        columns.append(values[starts + ranks])
+    minimums = values[starts]
+    maximums = values[starts + counts - 1]
+    return [(int(unique[index]), int(counts[index]), int(minimums[index]), [int(column[index]) for column in columns], int(maximums[index])) for index in range(0, len(unique))]
+
+def _column(buf, offset, rows):
+    if numpy is not None:
+        return numpy.frombuffer(buf, dtype='<i8', count=rows, offset=offset)
+    column = array.array(columnar.INT64)
+    data = buf[offset:offset + (rows * 8)]
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+def _remap(values, mapping):
+    if numpy is not None:
+        return numpy.asarray(mapping, dtype=numpy.int64)[values]
+    return array.array(columnar.INT64, [mapping[value] for value in values])
+
+def _constant(value, rows):
+    if numpy is not None:
+        return numpy.full(rows, value, dtype=numpy.int64)
+    return array.array(columnar.INT64, [value]) * rows
+
+def _concatenate(parts):
+    if numpy is not None:
+        # A single chunk stays a view of the map
+        return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+    column = array.array(columnar.INT64)
+    for part in parts:
+        column.extend(part)
+    return column
+
+def _subtract(after, before):
+    if numpy is not None:
+        return after - before
+    return [a - b for a, b in zip(after, before)]
+
+def _nonzero_or(values, defaults):
+    if numpy is not None:
+        return numpy.where(values != 0, values, defaults)
+    return [value or default for value, default in zip(values, defaults)]
+
+def _nonzero(values):
+    if numpy is not None:
+        return values != 0
+    return [value != 0 for value in values]
+
+def _select(values, mask):
+    if mask is None:
+        return values
+    if numpy is not None:
+        return values[mask]
+    return [value for value, selected in zip(values, mask) if selected]
+
+def _bucket(timestamps, start, width):
+    if numpy is not None:
+        return (timestamps - start) // width
+    return [(timestamp - start) // width for timestamp in timestamps]
+
+def _minimum(values):
+    return int(values.min()) if numpy is not None else min(values)
+
+def _maximum(values):
+    return int(values.max()) if numpy is not None else max(values)
@@ -0,0 +1,161 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import socket
+import threading
+import itertools
+
+import nudnik
+import nudnik.utils as utils
+
+DNS_FAMILIES = {'ipv4': socket.AF_INET, 'ipv6': socket.AF_INET6, 'any': socket.AF_UNSPEC}
+
+_resolver = None
+_resolver_pid = None
+_resolver_lock = threading.Lock()
+
+def get_resolver(cfg):
+    global _resolver, _resolver_pid
+    with _resolver_lock:
+        # Shard processes must not inherit the resolver of their parent, its thread is not forked
+        if _resolver is None or _resolver_pid != os.getpid():
+            _resolver = Resolver(cfg)
+            _resolver_pid = os.getpid()
+            _resolver.daemon = True
+            _resolver.start()
+    return _resolver
+
+def stop_resolver():
+    with _resolver_lock:
+        if _resolver is not None and _resolver_pid == os.getpid():
+            _resolver.exit()
+
+class Resolver(threading.Thread):
+    ''' Process-wide cache of the addresses of "host", refreshed every "dns_ttl" seconds in the background '''
+
+    def __init__(self, cfg):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.stats = None
+        self.events = list()
+        self.counter = itertools.count()
+        self.addresses = list()
+        self.resolved_at = 0
+        # Set once "host" has any address, or on exit, callers wait on it instead of resolving on their own
+        self.resolved = threading.Event()
+        self.name = '{}-resolver'.format(cfg.name)
+
+    def attach(self, stats):
+        with self.lock:
+            self.stats = stats
+            for dns_stat in self.events:
+                stats.add_report('dns', dns_stat)
+            self.events = list()
+
+    def lookup(self):
+        family = DNS_FAMILIES[self.cfg.dns_family]
+        addresses = list()
+        for address in socket.getaddrinfo(self.cfg.host, 0, family, socket.SOCK_STREAM):
+            if address[-1][0] not in addresses:
+                addresses.append(address[-1][0])
+        return addresses
+
+    def refresh(self):
+        try:
+            addresses = self.lookup()
+        except socket.error as e:
+            self.log.warn('Failed resolving {}, keeping {}, "{}"'.format(self.cfg.host, self.addresses, e))
+            self.resolved_at = utils.time_ns()
+            return
+
+        self.resolved_at = utils.time_ns()
+        if len(addresses) == 0 or addresses == self.addresses:
+            return
+
+        previous_addresses = self.addresses
+        self.addresses = addresses
+        for address in addresses:
+            if address not in previous_addresses:
+                self.add_event(address, 'added')
+        for address in previous_addresses:
+            if address not in addresses:
+                self.add_event(address, 'removed')
+
+        if self.cfg.vvv:
+            self.log.debug('Host {} resolved as {}'.format(self.cfg.host, addresses))
+
+    def add_event(self, address, action):
+        dns_stat = DnsStat(utils.time_ns(), self.cfg.host, address, action, len(self.addresses))
+        if self.cfg.vv:
+            self.log.debug('Address {} of {} was {}'.format(address, self.cfg.host, action))
+        with self.lock:
+            if self.stats is None:
+                self.events.append(dns_stat)
+            else:
+                self.stats.add_report('dns', dns_stat)
+
+    def get_addresses(self):
+        self.resolved.wait()
+        return list(self.addresses)
+
+    def next_address(self):
+        ''' Returns None if the resolver exited before "host" had any address '''
+        self.resolved.wait()
+        addresses = self.addresses
+        if len(addresses) == 0:
+            return None
+        return addresses[next(self.counter) % len(addresses)]
+
+    def invalidate(self):
+        # Every failing sender asks for a refresh, honor at most one per second
+        if utils.diff_seconds(self.resolved_at, utils.time_ns()) >= 1:
+            self.event.set()
+
+    def run(self):
+        index = 0
+        while len(self.addresses) == 0 and not self.gtfo:
+            self.event.wait(timeout=min(1, (index * 100)/1000))
+            self.event.clear()
+            if self.gtfo:
+                return
+            self.refresh()
+            index += 1
+        self.resolved.set()
+
+        while not self.gtfo:
+            self.event.wait(timeout=self.cfg.dns_ttl)
+            self.event.clear()
+            if self.gtfo:
+                return
+            self.refresh()
+
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
+        self.resolved.set()
+
+class DnsStat(utils.NudnikObject):
+    def __init__(self, timestamp, host, address, action, addresses):
+        super(DnsStat, self).__init__(timestamp)
+        self.host = host
+        self.address = address
+        self.action = action
+        self.addresses = addresses
@@ -0,0 +1,193 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import threading
+import itertools
+import heapq
+import random
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+else:
+    import Queue as queue
+
+import nudnik
+import nudnik.utils as utils
+
+# Number of seconds over which the retry budget is accounted
+BUDGET_WINDOW = 10
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(cfg, stats):
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RetryScheduler(cfg, stats)
+            _scheduler.daemon = True
+            _scheduler.start()
+    return _scheduler
+
+def backoff(cfg, rcount):
+    delay = min(cfg.retry_backoff_max, cfg.retry_backoff * (2 ** max(0, rcount - 1)))
+    if cfg.retry_jitter == 'full':
+        return random.uniform(0, delay)
+    elif cfg.retry_jitter == 'equal':
+        return (delay / 2.0) + random.uniform(0, delay / 2.0)
+    return delay
+
+class RetryBudget(object):
+    ''' Allows retries up to a percent of the first attempts sent within the last BUDGET_WINDOW seconds '''
+
+    def __init__(self, percent, min_per_second):
+        self.percent = percent
+        self.min_per_second = min_per_second
+        self.lock = threading.Lock()
+        self.second = 0
+        # Per second buckets of [first attempts, retries]
+        self.buckets = [[0, 0] for index in range(0, BUDGET_WINDOW)]
+
+    def bucket(self):
+        second = utils.time_ns() // 10**9
+        if second != self.second:
+            for elapsed in range(1, min(BUDGET_WINDOW, second - self.second) + 1):
+                self.buckets[(self.second + elapsed) % BUDGET_WINDOW] = [0, 0]
+            self.second = second
+        return self.buckets[second % BUDGET_WINDOW]
+
+    def deposit(self):
+        with self.lock:
+            self.bucket()[0] += 1
+
+    def withdraw(self):
+        if self.percent < 0:
+            return True
+
+        with self.lock:
+            bucket = self.bucket()
+            attempts = sum([b[0] for b in self.buckets])
+            retries = sum([b[1] for b in self.buckets])
+            allowed = (self.min_per_second * BUDGET_WINDOW) + (attempts * self.percent / 100.0)
+            if retries >= allowed:
+                return False
+            bucket[1] += 1
+            return True
+
+class RetryScheduler(threading.Thread):
+    ''' Process-wide delay queue, failed requests are put back on their stream queue once their backoff expires '''
+
+    def __init__(self, cfg, stats):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.heap = list()
+        self.budget = RetryBudget(cfg.retry_budget, cfg.retry_budget_min)
+        self.attempts = 0
+        self.first_attempts = 0
+        self.retries = 0
+        self.rejected = 0
+        self.exhausted = 0
+        self.name = '{}-retry'.format(cfg.name)
+        stats.register_reporter('retry', self)
+
+    def attempt(self, request):
+        first_attempt = (getattr(request, 'rcount', 0) or 0) == 0
+        with self.lock:
+            self.attempts += 1
+            if first_attempt:
+                self.first_attempts += 1
+        if first_attempt:
+            self.budget.deposit()
+
+    def allow(self, request):
+        rcount = getattr(request, 'rcount', 0) or 0
+        if self.gtfo or (self.cfg.retry_count >= 0 and rcount >= self.cfg.retry_count):
+            with self.lock:
+                self.exhausted += 1
+            return False
+        if not self.budget.withdraw():
+            with self.lock:
+                self.rejected += 1
+            if self.cfg.vvvv:
+                self.log.debug('Retry budget exceeded, giving up on message_id {}'.format(request.message_id))
+            return False
+
+        with self.lock:
+            self.retries += 1
+        request.rtime = utils.time_ns()
+        request.rcount = rcount + 1
+        return True
+
+    def retry(self, request, target_queue):
+        if not self.allow(request):
+            return False
+
+        self.schedule(request, target_queue, backoff(self.cfg, request.rcount))
+        return True
+
+    def schedule(self, request, target_queue, delay):
+        due = utils.time_ns() + int(delay * 10**9)
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.counter), request, target_queue))
+            if self.heap[0][2] is request:
+                self.condition.notify()
+
+    def run(self):
+        while not self.gtfo:
+            with self.condition:
+                while not self.gtfo:
+                    timeout = 1
+                    if len(self.heap) > 0:
+                        timeout = utils.diff_seconds(utils.time_ns(), self.heap[0][0])
+                        if timeout <= 0:
+                            break
+                    self.condition.wait(timeout=min(1, timeout))
+
+                if self.gtfo:
+                    return
+                due, index, request, target_queue = heapq.heappop(self.heap)
+
+            try:
+                target_queue.put(request, block=False)
+            except queue.Full:
+                # Never block behind a full stream queue, try again once a backoff expires
+                self.schedule(request, target_queue, self.cfg.retry_backoff)
+
+    def report(self, timestamp):
+        return RetryStat(timestamp, self.cfg.name, self.attempts, self.first_attempts, self.retries, self.rejected, self.exhausted, len(self.heap))
+
+    def exit(self):
+        with self.condition:
+            self.gtfo = 1
+            self.condition.notify()
+
+class RetryStat(utils.NudnikObject):
+    def __init__(self, timestamp, name, attempts, first_attempts, retries, rejected, exhausted, pending):
+        super(RetryStat, self).__init__(timestamp)
+        self.name = name
+        self.attempts = attempts
+        self.first_attempts = first_attempts
+        self.retries = retries
+        self.rejected = rejected
+        self.exhausted = exhausted
+        self.pending = pending
+        self.amplification = round(attempts / float(first_attempts), 3) if first_attempts > 0 else 0
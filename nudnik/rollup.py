@@ -0,0 +1,131 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+
+import nudnik
+import nudnik.utils as utils
+import nudnik.histogram
+
+_BILLION = 10**9
+
+class Rollup(object):
+    ''' Counters and an rtt histogram per set of "stats_rollup" labels, reported once per key for every window '''
+
+    def __init__(self, cfg):
+        self.mode = 'serverstats' if cfg.server else 'clientstats'
+        self.labels = list(cfg.stats_rollup)
+        self.indexes = [utils.ROLLUP_LABELS.index(label) for label in self.labels]
+        self.window = int(cfg.stats_rollup_window * _BILLION)
+        # A tumbling window is a sliding window of a single pane
+        self.pane = int((cfg.stats_rollup_slide or cfg.stats_rollup_window) * _BILLION)
+        # Messages are swapped up to a stats interval after they were recorded, panes are only closed after that
+        self.grace = int(cfg.stats_interval * _BILLION)
+        self.panes = dict()
+        self.history = collections.deque(maxlen=int(round(float(self.window) / self.pane)))
+        self.closed = None
+
+    def roll(self, stats, timestamp):
+        ''' Adds the messages of an interval, returns the reports of every window that ended since the previous call '''
+        columns = zip(stats.timestamps,
+                      stats.names,
+                      stats.request_column('stream_id'),
+                      stats.request_column('worker_id'),
+                      stats.request_column('ctime'),
+                      stats.request_column('rcount'),
+                      stats.response_column('status_code'))
+        for stat_timestamp, name, stream_id, worker_id, ctime, rcount, status_code in columns:
+            pane = stat_timestamp // self.pane
+            # Only shards forward messages later than that, they are added to the first pane still open
+            if self.closed is not None and pane <= self.closed:
+                pane = self.closed + 1
+
+            row = (name, stream_id, worker_id, self.mode, status_code)
+            key = tuple([row[index] for index in self.indexes])
+            aggregates = self.panes.get(pane)
+            if aggregates is None:
+                aggregates = dict()
+                self.panes[pane] = aggregates
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = Aggregate()
+                aggregates[key] = aggregate
+            aggregate.record(utils.diff_nanoseconds(ctime, stat_timestamp), rcount, status_code)
+
+        if self.closed is None:
+            if len(self.panes) == 0:
+                return list()
+            self.closed = min(self.panes) - 1
+
+        reports = list()
+        last = ((timestamp - self.grace) // self.pane) - 1
+        while self.closed < last:
+            if len(self.panes) == 0 and sum([len(aggregates) for aggregates in self.history]) == 0:
+                # Idle, there is nothing to report until a message is recorded again
+                self.closed = last
+                break
+            self.closed += 1
+            self.history.append(self.panes.pop(self.closed, dict()))
+            reports.extend(self.report((self.closed + 1) * self.pane))
+        return reports
+
+    def report(self, end):
+        merged = dict()
+        for aggregates in self.history:
+            for key in aggregates:
+                if key not in merged:
+                    merged[key] = Aggregate()
+                merged[key].merge(aggregates[key])
+
+        for key in sorted(merged):
+            yield RollupStat(end, self.window, dict(zip(self.labels, key)), merged[key])
+
+class Aggregate(object):
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.retransmits = 0
+        self.histogram = nudnik.histogram.Histogram()
+
+    def record(self, rtt, rcount, status_code):
+        self.count += 1
+        self.retransmits += rcount
+        if status_code != 0:
+            self.failures += 1
+        self.histogram.record(rtt)
+
+    def merge(self, other):
+        self.count += other.count
+        self.failures += other.failures
+        self.retransmits += other.retransmits
+        self.histogram.merge(other.histogram)
+
+class RollupStat(utils.NudnikObject):
+    def __init__(self, timestamp, window, labels, aggregate):
+        super(RollupStat, self).__init__(timestamp)
+        self.window = window / float(_BILLION)
+        # Labels that are not part of the key were rolled up
+        for label in utils.ROLLUP_LABELS:
+            if label != 'mode':
+                setattr(self, label, labels.get(label, '*'))
+        self.count = aggregate.count
+        self.throughput = round(aggregate.count / self.window, 3)
+        self.failures = aggregate.failures
+        self.retransmits = aggregate.retransmits
+        self.min = aggregate.histogram.min
+        for name, p in nudnik.histogram.SUMMARY_PERCENTILES:
+            setattr(self, name, aggregate.histogram.percentile(p))
+        self.max = aggregate.histogram.max
@@ -23,6 +23,7 @@ import BaseHTTPServer
 import SimpleHTTPServer
 
 from nudnik import __version__
+import nudnik.exposition
 import nudnik.utils as utils
 
 class Ruok(threading.Thread):
@@ -39,6 +40,11 @@ class Ruok(threading.Thread):
 
         self.log.info('RUOK Server binded to "{}:{}"'.format(cfg.ruok_host, cfg.ruok_port))
 
+    def attach(self, stats):
+        exposition = nudnik.exposition.Exposition(self.cfg, stats)
+        stats.register_observer(exposition)
+        setattr(self.Handler, 'exposition', exposition)
+
     def run(self):
 
         while not self.gtfo:
@@ -52,6 +58,7 @@ class Ruok(threading.Thread):
         self.httpd.shutdown()
 
 class NudnikHttpRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    exposition = None
 
     def __init__(self, request, client_address, server):
         SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(self, request, client_address, server)
@@ -69,6 +76,14 @@ class NudnikHttpRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
             response = json.dumps(json.loads(self.cfg.ruok_response_format.format(date=str(datetime.utcnow()))))
             self.wfile.write(bytes(response))
+        elif self.path == self.cfg.ruok_metrics_path and self.exposition is not None:
+            self.protocol_version='HTTP/1.1'
+            response = self.exposition.render().encode('utf-8')
+            self.send_response(200, 'OK')
+            self.send_header('Content-type', nudnik.exposition.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
         elif self.path == '/config':
             self.protocol_version='HTTP/1.1'
             self.send_response(200, 'OK')
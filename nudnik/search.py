@@ -0,0 +1,151 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import math
+
+import nudnik
+import nudnik.utils as utils
+
+class Search(threading.Thread):
+    ''' Ramps the rate of the running streams until the latency or error SLO is breached '''
+
+    def __init__(self, cfg, stats, streams):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.stats = stats
+        self.streams = streams
+        self.latencies = list()
+        self.steps = list()
+        self.name = '{}-search'.format(cfg.name)
+        stats.register_observer(self)
+
+    def observe(self, stats):
+        latencies = list()
+        for timestamp, ctime, itime in zip(stats.timestamps, stats.request_column('ctime'), stats.request_column('itime')):
+            # Measured from the intended send time, so a saturated client does not hide the knee
+            latencies.append(utils.diff_nanoseconds(itime or ctime, timestamp))
+        with self.lock:
+            self.latencies.extend(latencies)
+
+    def run(self):
+        self.log.debug('Running {} in {} mode, starting at rate {}'.format(self.name, self.cfg.search, self.cfg.rate))
+
+        rate = self.cfg.rate
+        lower = 0
+        upper = 0
+        while not self.gtfo:
+            step = self.measure(rate)
+            if step is None:
+                return
+            self.steps.append(step)
+
+            if step.passed:
+                lower = rate
+            else:
+                upper = rate
+
+            if self.cfg.search == 'step':
+                rate = rate + self.cfg.search_step if step.passed else 0
+            elif upper == 0:
+                rate = rate * 2
+            else:
+                rate = lower + ((upper - lower) // 2)
+                if (upper - lower) <= self.cfg.search_step:
+                    rate = 0
+
+            if self.cfg.search_max_rate > 0 and rate > self.cfg.search_max_rate:
+                rate = self.cfg.search_max_rate if lower < self.cfg.search_max_rate else 0
+            if rate <= 0 or rate == lower:
+                break
+
+        self.summarize(lower)
+
+        for stream in self.streams:
+            stream.exit()
+        self.stats.exit()
+        self.gtfo = 1
+
+    def measure(self, rate):
+        self.cfg.rate = rate
+        self.event.wait(timeout=self.cfg.search_warmup)
+
+        successful_requests = self.stats.successful_requests
+        failed_requests = self.stats.failed_requests
+        with self.lock:
+            self.latencies = list()
+
+        time_start = utils.time_ns()
+        self.event.wait(timeout=self.cfg.search_step_duration)
+        if self.gtfo:
+            return None
+        # Let the Stats thread hand over the latencies of the last interval
+        self.event.wait(timeout=self.cfg.stats_interval)
+        duration = utils.diff_seconds(time_start, utils.time_ns())
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+            self.latencies = list()
+
+        successful = self.stats.successful_requests - successful_requests
+        failed = self.stats.failed_requests - failed_requests
+        step = SearchStat(utils.time_ns(), self.cfg, len(self.steps), rate, duration, successful, failed, latencies)
+
+        self.stats.add_report('search', step)
+        self.log.info('Search step {}: rate {} ({} rps offered) achieved {} rps, p99 {}ms, errors {}%, {}'.format(step.step, step.rate, step.offered, step.achieved, step.p99, step.error_ratio, 'passed' if step.passed else 'breached'))
+        return step
+
+    def summarize(self, rate):
+        self.log.info('Search finished after {} steps, SLO: p99 <= {}ms, errors <= {}%'.format(len(self.steps), self.cfg.search_slo_p99, self.cfg.search_slo_error_ratio))
+        self.log.info('step,rate,offered,achieved,p50,p90,p99,max,error_ratio,passed')
+        for step in self.steps:
+            self.log.info('{},{},{},{},{},{},{},{},{},{}'.format(step.step, step.rate, step.offered, step.achieved, step.p50, step.p90, step.p99, step.max, step.error_ratio, step.passed))
+        if rate > 0:
+            self.log.info('Maximum sustainable rate is {} per stream ({} rps)'.format(rate, round(rate * self.cfg.streams / float(self.cfg.interval), 3)))
+        else:
+            self.log.info('The SLO was breached at the initial rate of {}'.format(self.steps[0].rate if len(self.steps) > 0 else self.cfg.rate))
+
+    def exit(self):
+        self.gtfo = 1
+        self.event.set()
+
+class SearchStat(utils.NudnikObject):
+    def __init__(self, timestamp, cfg, step, rate, duration, successful, failed, latencies):
+        super(SearchStat, self).__init__(timestamp)
+        self.name = cfg.name
+        self.step = step
+        self.rate = rate
+        self.offered = round(rate * cfg.streams / float(cfg.interval), 3)
+        self.achieved = round(successful / duration, 3) if duration > 0 else 0
+        self.successful = successful
+        self.failed = failed
+        self.error_ratio = round(100.0 * failed / (successful + failed), 3) if (successful + failed) > 0 else 0
+        self.p50 = percentile(latencies, 50)
+        self.p90 = percentile(latencies, 90)
+        self.p99 = percentile(latencies, 99)
+        self.max = percentile(latencies, 100)
+        self.passed = successful > 0 and self.p99 <= cfg.search_slo_p99 and self.error_ratio <= cfg.search_slo_error_ratio
+
+def percentile(values, p):
+    ''' Nearest-rank percentile of sorted nanoseconds, in milliseconds '''
+    if len(values) == 0:
+        return 0
+    index = max(0, int(math.ceil(p / 100.0 * len(values))) - 1)
+    return round(values[index] / 10.0**6, 3)
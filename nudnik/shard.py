@@ -0,0 +1,194 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import time
+import threading
+import multiprocessing
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+else:
+    import Queue as queue
+
+import nudnik
+import nudnik.stats
+import nudnik.client
+import nudnik.resolver
+import nudnik.utils as utils
+
+SHARD_EXIT_TIMEOUT = 10
+
+def start_shards(cfg):
+    ''' Forks the shard processes, must be called before any thread is started since a forked process only inherits the forking thread '''
+    shard_queue = multiprocessing.Queue()
+    shards = list()
+
+    initial_stream_index = cfg.initial_stream_index
+    for shard_index in range(0, cfg.processes):
+        # Spread the streams as evenly as possible, the first shards get the remainder
+        streams = (cfg.streams // cfg.processes) + (1 if shard_index < (cfg.streams % cfg.processes) else 0)
+        if streams == 0:
+            continue
+
+        shard = Shard(cfg, shard_index, initial_stream_index, streams, shard_queue)
+        shard.start()
+        shards.append(shard)
+        initial_stream_index += streams
+
+    return shard_queue, shards
+
+def start_collector(cfg, shard_queue, stats):
+    collector = StatsCollector(cfg, shard_queue, stats)
+    collector.daemon = True
+    collector.start()
+    return collector
+
+def stop_shards(cfg, shards, collector):
+    ''' Waits for the last forward of every shard, the collector keeps reading meanwhile so no shard blocks on a full pipe '''
+    log = utils.get_logger(cfg.debug)
+    for shard in shards:
+        shard.exit()
+
+    deadline = time.time() + SHARD_EXIT_TIMEOUT
+    for shard in shards:
+        shard.join(max(0, deadline - time.time()))
+        if shard.is_alive():
+            log.warn('Shard {} did not exit within {} seconds, terminating it'.format(shard.name, SHARD_EXIT_TIMEOUT))
+            shard.terminate()
+            shard.join()
+
+    collector.exit()
+    collector.join()
+    collector.drain()
+
+class Shard(multiprocessing.Process):
+    def __init__(self, cfg, shard_index, initial_stream_index, streams, shard_queue):
+        multiprocessing.Process.__init__(self)
+        self.gtfo = False
+        self.stop_event = multiprocessing.Event()
+        self.cfg = cfg
+        self.shard_index = shard_index
+        self.initial_stream_index = initial_stream_index
+        self.streams = streams
+        self.shard_queue = shard_queue
+        self.name = '{}-shard-{}'.format(cfg.name, shard_index)
+
+    def run(self):
+        self.cfg.initial_stream_index = self.initial_stream_index
+        self.cfg.streams = self.streams
+        log = utils.get_logger(self.cfg.debug)
+        log.debug('Shard {} started with streams {}-{}'.format(self.name, self.initial_stream_index, (self.initial_stream_index + self.streams - 1)))
+
+        statsthread = ShardStats(self.cfg, self.shard_index, self.shard_queue)
+        statsthread.daemon = True
+        statsthread.start()
+
+        threads = nudnik.client.start_streams(self.cfg, statsthread)
+        try:
+            while len(threads) > 0 and not self.stop_event.is_set():
+                for index, stream in enumerate(threads):
+                    if stream.gtfo or not stream.is_alive():
+                        threads.pop(index)
+                    else:
+                        stream.join(0.25)
+        except KeyboardInterrupt:
+            pass
+
+        nudnik.resolver.stop_resolver()
+        for stream in threads:
+            stream.exit()
+
+        # Forward whatever was collected since the last interval before leaving
+        statsthread.exit()
+        statsthread.join()
+        log.debug('Shard {} has left the building'.format(self.name))
+
+    def exit(self):
+        self.gtfo = 1
+        self.stop_event.set()
+
+class ShardStats(nudnik.stats.Stats):
+    ''' Forwards counters, stats and reports of a shard process to the parent process instead of the outputs '''
+
+    def __init__(self, cfg, shard_index, shard_queue):
+        super(ShardStats, self).__init__(cfg)
+        self.shard_index = shard_index
+        self.shard_queue = shard_queue
+        self.forwarded_successful_requests = 0
+        self.forwarded_failed_requests = 0
+
+    def run(self):
+        self.log.debug('Running {}'.format(self.name))
+
+        while not self.gtfo:
+            time_start = utils.time_ns()
+
+            self.forward()
+
+            elapsed = utils.diff_seconds(time_start, utils.time_ns())
+            if elapsed < self.cfg.stats_interval:
+                self.event.wait(timeout=(self.cfg.stats_interval - elapsed))
+
+        self.forward()
+
+    def forward(self):
+        current_report = self.swap()
+        current_reports = self.collect_reports()
+
+        successful_requests = self.successful_requests
+        failed_requests = self.failed_requests
+        successful_delta = successful_requests - self.forwarded_successful_requests
+        failed_delta = failed_requests - self.forwarded_failed_requests
+        if len(current_report) == 0 and len(current_reports) == 0 and successful_delta == 0 and failed_delta == 0:
+            return
+
+        self.shard_queue.put((self.shard_index, successful_delta, failed_delta, current_report, current_reports))
+        self.forwarded_successful_requests = successful_requests
+        self.forwarded_failed_requests = failed_requests
+
+class StatsCollector(threading.Thread):
+    ''' Merges counters and stats forwarded by the shard processes into the main Stats thread '''
+
+    def __init__(self, cfg, shard_queue, stats):
+        threading.Thread.__init__(self)
+        self.gtfo = False
+        self.cfg = cfg
+        self.log = utils.get_logger(cfg.debug)
+        self.shard_queue = shard_queue
+        self.stats = stats
+
+    def run(self):
+        while not self.gtfo:
+            self.merge_next()
+
+    def merge_next(self):
+        try:
+            shard_index, successful_delta, failed_delta, current_report, current_reports = self.shard_queue.get(block=True, timeout=0.25)
+        except queue.Empty:
+            return False
+
+        if self.cfg.vvv:
+            self.log.debug('Merging {} items from shard {}'.format(len(current_report), shard_index))
+        self.stats.merge(successful_delta, failed_delta, current_report, current_reports)
+        return True
+
+    def drain(self):
+        ''' Merges whatever the shards forwarded before they exited, once the collector thread is gone '''
+        while self.merge_next():
+            pass
+
+    def exit(self):
+        self.gtfo = 1
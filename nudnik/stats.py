@@ -14,14 +14,36 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
 #
+import sys
+import array
+import random
 import threading
 import requests_unixsocket
 
 import nudnik.utils as utils
 import nudnik.outputs
 import nudnik.metrics
+import nudnik.histogram
+import nudnik.rollup
+import nudnik.clock
+import nudnik.formatter
+import nudnik.columnar
 
-import requests.models
+# Per interval reports, formatted by the matching stats_format_<kind>_<output>
+REPORT_KINDS = ['summary', 'rollup', 'clock', 'queue', 'retry', 'search', 'dns', 'output']
+
+# Latencies that are summarized on every interval, phase deltas are only available for grpc and etcd,
+# the one-way "uplink" and "downlink" latencies are corrected by the estimated clock offset of the server (see nudnik.clock)
+SUMMARY_METRICS = ['rtt', 'crtt', 'cdelta', 'sdelta', 'ldelta', 'pdelta', 'bdelta', 'uplink', 'downlink']
+
+# Only these fields of a message are kept once it is recorded, payloads and loads are dropped right away
+REQUEST_FIELDS = ['stream_id', 'worker_id', 'sequence_id', 'message_id', 'ctime', 'stime', 'rtime', 'rcount', 'itime']
+RESPONSE_FIELDS = ['status_code', 'ctime', 'ltime', 'stime', 'connection_id', 'connection_requests']
+
+if (sys.version_info >= (3, 3)):
+    INT64 = 'q'
+else:
+    INT64 = 'l'
 
 class Stats(threading.Thread):
 
@@ -29,170 +51,578 @@ class Stats(threading.Thread):
         threading.Thread.__init__(self)
         self.gtfo = False
         self.event = threading.Event()
-        self.lock = threading.Lock()
-        self.stats = list()
-        self.successful_requests = 0
-        self.failed_requests = 0
+        self.cells = list()
+        self.cells_lock = threading.Lock()
+        self.queues = list()
+        self.reporters = list()
+        self.observers = list()
+        self.reports = list()
+        self.successes = ShardedCounter()
+        self.failures = ShardedCounter()
+        self.local = threading.local()
         self.cfg = cfg
         self.log = utils.get_logger(cfg.debug)
-        self.workers = list()
+        self.outputs = list()
+        self.sampler = Sampler(cfg.stats_sample_ratio, cfg.stats_sample_reservoir, cfg.stats_sample_keep_failures)
+        self.rollup = nudnik.rollup.Rollup(cfg) if len(cfg.stats_rollup) > 0 else None
+        self.clock = nudnik.clock.Clock(cfg) if not cfg.server and cfg.clock_offset_window > 0 else None
 
         self.log.debug('Stats thread initiated')
 
     def run(self):
         self.log.debug('Running {}'.format(self.name))
         mode = 'serverstats' if self.cfg.server else 'clientstats'
+        self.start_outputs(mode)
 
         while not self.gtfo:
             time_start = utils.time_ns()
 
-            current_report = list(self.stats)
-            current_report_length = len(current_report)
-            if current_report_length > 0:
-                if self.cfg.vvv:
-                    self.log.debug('Reporting {}/{} items'.format(current_report_length, len(self.stats)))
-
-                if self.cfg.debug:
-                    for stat in _parse_stats(self.log, mode, current_report, self.cfg.stats_format_stdout, self.cfg.stats_format_retransmit_stdout):
-                        self.log.debug(stat)
-                elif 'stdout' in self.cfg.stats:
-                    for stat in _parse_stats(self.log, mode, current_report, self.cfg.stats_format_stdout, self.cfg.stats_format_retransmit_stdout):
-                        self.log.info(stat)
-
-                if 'file' in self.cfg.stats:
-                    thread = FileStats(self.log, self.cfg.stats_file_path, mode, current_report, self.cfg.stats_format_file, self.cfg.stats_format_retransmit_file)
-                    thread.start()
-                    self.workers.append(thread)
-                if 'influxdb' in self.cfg.stats:
-                    thread = InfluxdbStats(self.log, self.cfg.influxdb_url_stats, mode, current_report, self.cfg.stats_format_influxdb, self.cfg.stats_format_retransmit_influxdb)
-                    thread.start()
-                    self.workers.append(thread)
-                if 'prometheus' in self.cfg.stats:
-                    thread = PrometheusStats(self.log, self.cfg.prometheus_url_stats, mode, current_report, self.cfg.stats_format_prometheus, self.cfg.stats_format_retransmit_prometheus)
-                    thread.start()
-                    self.workers.append(thread)
-
-                for i in range(0, current_report_length):
-                    if self.cfg.vvvvv:
-                        self.log.debug('Popping {}/{} items'.format(i, current_report_length))
-                    self.stats.pop(0)
-
-                while len(self.workers) > 0:
-                    for index, thread in enumerate(self.workers):
-                        if thread.is_alive():
-                            thread.join(0.25)
-                        else:
-                            self.workers.pop(index)
-
-            elif self.cfg.vvvv:
-                self.log.debug('Nothing to report')
+            self.report(mode)
 
             elapsed = utils.diff_seconds(time_start, utils.time_ns())
             if elapsed < self.cfg.stats_interval:
                 self.event.wait(timeout=(self.cfg.stats_interval - elapsed))
 
+        # Messages recorded since the last interval are still reported, and written before leaving
+        self.report(mode)
+        nudnik.outputs.stop_outputs(self.outputs)
+
+    def report(self, mode):
+        current_report = self.swap()
+        current_report_length = len(current_report)
+        offsets = dict()
+        if self.clock is not None:
+            for clock_stat in self.clock.update(current_report, utils.time_ns()):
+                self.add_report('clock', clock_stat)
+            offsets = self.clock.offsets
+        if self.cfg.stats_summary:
+            for summary in _summarize(current_report, utils.time_ns(), offsets):
+                self.add_report('summary', summary)
+        if self.rollup is not None:
+            for rollup_stat in self.rollup.roll(current_report, utils.time_ns()):
+                self.add_report('rollup', rollup_stat)
+        current_reports = self.collect_reports()
+        # Per message stats are still collected for the summaries, only their output is optional
+        output_report = self.sampler.sample(current_report) if self.cfg.stats_per_message else list()
+        if self.cfg.vvv and len(output_report) < current_report_length:
+            self.log.debug('Sampled {} out of {} items'.format(len(output_report), current_report_length))
+        for observer in self.observers:
+            observer.observe(current_report)
+
+        if current_report_length > 0 or len(current_reports) > 0:
+            if self.cfg.vvv:
+                self.log.debug('Reporting {} items and {} reports'.format(current_report_length, len(current_reports)))
+
+            if self.cfg.debug:
+                for stat in _parse_stats(self.log, mode, output_report, self.cfg.stats_format_stdout, self.cfg.stats_format_retransmit_stdout):
+                    self.log.debug(stat)
+                for report in _parse_reports(self.log, mode, current_reports, self.report_formats('stdout')):
+                    self.log.debug(report)
+            elif 'stdout' in self.cfg.stats:
+                for stat in _parse_stats(self.log, mode, output_report, self.cfg.stats_format_stdout, self.cfg.stats_format_retransmit_stdout):
+                    self.log.info(stat)
+                for report in _parse_reports(self.log, mode, current_reports, self.report_formats('stdout')):
+                    self.log.info(report)
+
+            for output in self.outputs:
+                stats = output_report
+                # "nudnik report" computes throughput and percentiles out of every message, it must never see a sample
+                if not output.sampled and self.cfg.stats_per_message:
+                    stats = current_report
+                output.submit((stats, current_reports), len(stats) + len(current_reports))
+
+        elif self.cfg.vvvv:
+            self.log.debug('Nothing to report')
+
+    def start_outputs(self, mode):
+        if 'file' in self.cfg.stats:
+            self.outputs.append(FileStats(self.cfg, self.log, self.cfg.stats_file_path, mode, self.cfg.stats_format_file, self.cfg.stats_format_retransmit_file, self.report_formats('file')))
+        if 'influxdb' in self.cfg.stats:
+            self.outputs.append(InfluxdbStats(self.cfg, self.log, self.cfg.influxdb_url_stats, mode, self.cfg.stats_format_influxdb, self.cfg.stats_format_retransmit_influxdb, self.report_formats('influxdb')))
+        if 'binary' in self.cfg.stats:
+            self.outputs.append(BinaryStats(self.cfg, self.log, self.cfg.stats_binary_path, mode))
+        if 'prometheus' in self.cfg.stats:
+            self.outputs.append(PrometheusStats(self.cfg, self.log, self.cfg.prometheus_url_stats, mode, self.cfg.stats_format_prometheus, self.cfg.stats_format_retransmit_prometheus, self.report_formats('prometheus')))
+        for output in self.outputs:
+            output.start()
+
+    def register_queue(self, name, stream_id, send_queue):
+        self.queues.append((name, stream_id, send_queue))
+
+    def register_observer(self, observer):
+        self.observers.append(observer)
+
+    def register_reporter(self, kind, reporter):
+        self.reporters.append((kind, reporter))
+
+    def add_report(self, kind, report):
+        # Reports come from many threads, the list is only ever appended to or swapped under the lock
+        with self.cells_lock:
+            self.reports.append((kind, report))
+
+    def collect_reports(self):
+        timestamp = utils.time_ns()
+        for name, stream_id, send_queue in self.queues:
+            self.add_report('queue', QueueStat(timestamp, name, stream_id, send_queue))
+        for output in self.outputs:
+            self.add_report('output', OutputStat(timestamp, output))
+        for kind, reporter in self.reporters:
+            self.add_report(kind, reporter.report(timestamp))
+
+        with self.cells_lock:
+            current_reports, self.reports = self.reports, list()
+        return current_reports
+
+    def report_formats(self, output):
+        formats = dict()
+        for kind in REPORT_KINDS:
+            formats[kind] = self.cfg.get('stats_format_{}_{}'.format(kind, output))
+        return formats
+
+    @property
+    def successful_requests(self):
+        return self.successes.value
+
+    @property
+    def failed_requests(self):
+        return self.failures.value
+
     def add_success(self):
-        with self.lock:
-            self.successful_requests += 1
+        self.successes.add()
 
     def add_failure(self):
-        with self.lock:
-            self.failed_requests += 1
+        self.failures.add()
+
+    def inject_failure(self):
+        if self.cfg.fail_ratio <= 0:
+            return False
+
+        sequencer = getattr(self.local, 'sequencer', None)
+        if sequencer is None:
+            sequencer = FailSequencer(self.cfg.fail_ratio)
+            self.local.sequencer = sequencer
+        return sequencer.next()
 
     def get_fail_ratio(self):
-        total = self.failed_requests + self.successful_requests
+        failed_requests = self.failed_requests
+        total = failed_requests + self.successful_requests
         try:
-            current_fail_ratio = float((self.failed_requests / total) * 100)
+            current_fail_ratio = float((failed_requests / float(total)) * 100)
         except ZeroDivisionError:
             current_fail_ratio = 100.0
 
         if self.cfg.vvvvv:
             logformat = 'failed={},success={},current_fail_ratio={},conf_fail_ratio={}'
-            self.log.debug(logformat.format(self.failed_requests,
-                                            self.successful_requests,
+            self.log.debug(logformat.format(failed_requests,
+                                            total - failed_requests,
                                             current_fail_ratio,
                                             self.cfg.fail_ratio))
         return current_fail_ratio
 
-    def append(self, stat):
-        self.stats.append(stat)
+    def get_cell(self):
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = BufferCell()
+            with self.cells_lock:
+                self.cells.append(cell)
+            self.local.cell = cell
+        return cell
+
+    def record(self, request, response, timestamp):
+        cell = self.get_cell()
+        # Only contended while the Stats thread swaps this very buffer
+        with cell.lock:
+            cell.buffer.append(request, response, timestamp)
+
+    def swap(self):
+        ''' Takes everything recorded since the previous swap, every thread carries on with an empty buffer '''
+        current_report = StatsBuffer()
+        with self.cells_lock:
+            cells = list(self.cells)
+        for cell in cells:
+            with cell.lock:
+                buf, cell.buffer = cell.buffer, StatsBuffer()
+            current_report.extend(buf)
+        return current_report
+
+    def merge(self, successful_requests, failed_requests, stats, reports):
+        self.successes.add(successful_requests)
+        self.failures.add(failed_requests)
+        cell = self.get_cell()
+        with cell.lock:
+            cell.buffer.extend(stats)
+        with self.cells_lock:
+            self.reports.extend(reports)
 
     def exit(self):
         self.gtfo = 1
         self.event.set()
 
+class ShardedCounter(object):
+    ''' Every thread increments a cell of its own without locking, the cells are only summed when read '''
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells = list()
+
+    def add(self, value=1):
+        cell = getattr(self.local, 'cell', None)
+        if cell is None:
+            cell = [0]
+            with self.lock:
+                self.cells.append(cell)
+            self.local.cell = cell
+        cell[0] += value
+
+    @property
+    def value(self):
+        return sum([cell[0] for cell in list(self.cells)])
+
+class FailSequencer(object):
+    ''' Fails exactly "fail_ratio" percent of the messages of a single thread, spread as evenly as possible '''
+
+    def __init__(self, fail_ratio):
+        self.fail_ratio = fail_ratio
+        self.accumulator = 0.0
+
+    def next(self):
+        self.accumulator += self.fail_ratio
+        if self.accumulator >= 100:
+            self.accumulator -= 100
+            return True
+        return False
+
 class FileStats(nudnik.outputs.FileOutput):
-    def __init__(self, log, path, mode, data, format, retransmit_format):
-        super(FileStats, self).__init__(log, path, mode, data, format)
+    def __init__(self, cfg, log, path, mode, format, retransmit_format, report_formats):
+        super(FileStats, self).__init__(cfg, log, path, mode, format)
         self.retransmit_format = retransmit_format
+        self.report_formats = report_formats
 
-    def parse(self):
-        for stat in _parse_stats(self.log, self.mode, self.data, self.format, self.retransmit_format):
-            self.parsed_data.append(stat)
+    def parse(self, data):
+        return _parse_output(self, data)
 
 class InfluxdbStats(nudnik.outputs.InfluxdbOutput):
-    def __init__(self, log, url, mode, data, format, retransmit_format):
-        super(InfluxdbStats, self).__init__(log, url, mode, data, format)
+    def __init__(self, cfg, log, url, mode, format, retransmit_format, report_formats):
+        super(InfluxdbStats, self).__init__(cfg, log, url, mode, format)
         self.retransmit_format = retransmit_format
+        self.report_formats = report_formats
 
-    def parse(self):
-        for stat in _parse_stats(self.log, self.mode, self.data, self.format, self.retransmit_format):
-            self.parsed_data.append(stat)
+    def parse(self, data):
+        return _parse_output(self, data)
 
 class PrometheusStats(nudnik.outputs.PrometheusOutput):
-    def __init__(self, log, url, mode, data, format, retransmit_format):
-        super(PrometheusStats, self).__init__(log, url, mode, data, format)
+    def __init__(self, cfg, log, url, mode, format, retransmit_format, report_formats):
+        super(PrometheusStats, self).__init__(cfg, log, url, mode, format)
         self.retransmit_format = retransmit_format
+        self.report_formats = report_formats
+
+    def parse(self, data):
+        return _parse_output(self, data)
+
+class BinaryStats(nudnik.outputs.Output):
+    ''' Appends the recorded messages to a binary file, a chunk of int64 columns per batch, see nudnik.columnar '''
+
+    def __init__(self, cfg, log, path, mode):
+        super(BinaryStats, self).__init__(cfg, log, mode, None)
+        self.path = path
+        self.columns = nudnik.columnar.columns(REQUEST_FIELDS, RESPONSE_FIELDS)
+        self.checked = False
+        self.sampled = False
+        self.backend = 'binary'
+        self.name = '{}-binary'.format(mode)
+
+    def parse(self, data):
+        stats, reports = data
+        # A whole interval is submitted at once, it is split so that "output_batch_size" bounds the rows of a chunk
+        batch_size = self.cfg.output_batch_size
+        if len(stats) <= batch_size:
+            return [stats] if len(stats) > 0 else list()
+        return [stats.slice(start, start + batch_size) for start in range(0, len(stats), batch_size)]
+
+    def rows(self, item):
+        return len(item)
+
+    def out(self, data):
+        buf = StatsBuffer()
+        for stats in data:
+            buf.extend(stats)
+
+        name_ids = array.array(INT64)
+        names = dict()
+        for name in buf.names:
+            name_ids.append(names.setdefault(name, len(names)))
+        table = sorted(names, key=names.get)
+
+        self.log.debug('Writing {} items to {}'.format(len(buf), self.path))
+        with open(self.path, 'ab') as statsfile:
+            if statsfile.tell() == 0:
+                nudnik.columnar.write_header(statsfile, {'mode': self.mode, 'node': nudnik.metrics.get_node().nodename, 'columns': self.columns})
+                self.checked = True
+            elif not self.checked and not self.check():
+                return False
+            nudnik.columnar.write_chunk(statsfile, len(buf), table, [buf.timestamps, name_ids] + buf.requests + buf.responses)
+        return True
 
-    def parse(self):
-        for stat in _parse_stats(self.log, self.mode, self.data, self.format, self.retransmit_format):
-            self.parsed_data.append(stat)
+    def check(self):
+        # Chunks may only be appended to a file that was written with the very same columns
+        try:
+            header, buf, offset = nudnik.columnar.open_file(self.path)
+            buf.close()
+        except (ValueError, EnvironmentError) as e:
+            self.log.error('Refusing to append to {}, "{}"'.format(self.path, e))
+            return False
+        if header.get('columns') != self.columns:
+            self.log.error('Refusing to append to {}, it was written with other columns'.format(self.path))
+            return False
+        self.checked = True
+        return True
+
+class Sampler(object):
+    ''' Picks the recorded messages that are sent to the outputs, every message is still counted and summarized '''
+
+    def __init__(self, ratio, reservoir, keep_failures):
+        self.ratio = ratio
+        self.reservoir = reservoir
+        self.keep_failures = keep_failures
+        self.random = random.Random()
+
+    def sample(self, stats):
+        if self.ratio >= 1 and (self.reservoir == 0 or len(stats) <= self.reservoir):
+            return stats
+
+        kept = list()
+        candidates = list()
+        rcounts = stats.request_column('rcount')
+        status_codes = stats.response_column('status_code')
+        for index in range(0, len(stats)):
+            if self.keep_failures and (status_codes[index] != 0 or rcounts[index] > 0):
+                kept.append(index)
+            elif self.ratio >= 1 or self.random.random() < self.ratio:
+                candidates.append(index)
+
+        # The whole interval is at hand, so the reservoir is a uniform sample of it
+        if self.reservoir > 0 and len(candidates) > self.reservoir:
+            candidates = sorted(self.random.sample(candidates, self.reservoir))
+        if len(kept) > 0:
+            candidates = sorted(kept + candidates)
+        return stats.take(candidates)
+
+# A single copy of every server hostname is shared by all the messages it answered
+_hosts = dict()
+
+class BufferCell(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffer = StatsBuffer()
+
+class StatsBuffer(object):
+    ''' Recorded messages stored column by column, a message takes about a hundred bytes whatever its payload was '''
+
+    def __init__(self):
+        self.timestamps = array.array(INT64)
+        self.names = list()
+        self.hosts = list()
+        self.requests = [array.array(INT64) for field in REQUEST_FIELDS]
+        self.responses = [array.array(INT64) for field in RESPONSE_FIELDS]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        for index in range(0, len(self)):
+            yield Stat(self, index)
+
+    def append(self, request, response, timestamp):
+        self.names.append(request.name)
+        host = getattr(response, 'hostname', '')
+        self.hosts.append(_hosts.setdefault(host, host))
+        for field, column in zip(REQUEST_FIELDS, self.requests):
+            column.append(int(getattr(request, field, 0) or 0))
+        for field, column in zip(RESPONSE_FIELDS, self.responses):
+            column.append(int(getattr(response, field, 0) or 0))
+        self.timestamps.append(timestamp)
+
+    def extend(self, other):
+        self.names.extend(other.names)
+        self.hosts.extend(other.hosts)
+        for column, other_column in zip(self.requests, other.requests):
+            column.extend(other_column)
+        for column, other_column in zip(self.responses, other.responses):
+            column.extend(other_column)
+        self.timestamps.extend(other.timestamps)
+
+    def take(self, indexes):
+        ''' A buffer of the messages at "indexes", in that order '''
+        buf = StatsBuffer()
+        buf.timestamps = array.array(INT64, [self.timestamps[index] for index in indexes])
+        buf.names = [self.names[index] for index in indexes]
+        buf.hosts = [self.hosts[index] for index in indexes]
+        buf.requests = [array.array(INT64, [column[index] for index in indexes]) for column in self.requests]
+        buf.responses = [array.array(INT64, [column[index] for index in indexes]) for column in self.responses]
+        return buf
+
+    def slice(self, start, stop):
+        ''' A buffer of the messages from "start" up to "stop" '''
+        buf = StatsBuffer()
+        buf.timestamps = self.timestamps[start:stop]
+        buf.names = self.names[start:stop]
+        buf.hosts = self.hosts[start:stop]
+        buf.requests = [column[start:stop] for column in self.requests]
+        buf.responses = [column[start:stop] for column in self.responses]
+        return buf
+
+    def request_column(self, field):
+        return self.requests[REQUEST_FIELDS.index(field)]
+
+    def response_column(self, field):
+        return self.responses[RESPONSE_FIELDS.index(field)]
+
+class Stat(object):
+    ''' A single recorded message, only materialized when it is formatted '''
+    __slots__ = ['timestamp', 'request', 'response']
+
+    def __init__(self, buf, index):
+        self.timestamp = buf.timestamps[index]
+        self.request = StatRequest(buf, index)
+        self.response = StatResponse(buf, index)
 
-class Stat(utils.NudnikObject):
-    def __init__(self, request, response, timestamp):
-        super(Stat, self).__init__(timestamp)
-        self.request = request
-        self.response = response
+class StatRequest(object):
+    __slots__ = ['name'] + REQUEST_FIELDS
+
+    def __init__(self, buf, index):
+        self.name = buf.names[index]
+        for field, column in zip(REQUEST_FIELDS, buf.requests):
+            setattr(self, field, column[index])
+
+class StatResponse(object):
+    __slots__ = RESPONSE_FIELDS
+
+    def __init__(self, buf, index):
+        for field, column in zip(RESPONSE_FIELDS, buf.responses):
+            setattr(self, field, column[index])
+
+class QueueStat(utils.NudnikObject):
+    def __init__(self, timestamp, name, stream_id, send_queue):
+        super(QueueStat, self).__init__(timestamp)
+        self.name = name
+        self.stream_id = stream_id
+        self.depth = send_queue.qsize()
+        self.maxsize = send_queue.maxsize
+        self.dropped = send_queue.dropped
+        self.shed = send_queue.shed
+        self.blocked = send_queue.blocked
+
+class OutputStat(utils.NudnikObject):
+    def __init__(self, timestamp, output):
+        super(OutputStat, self).__init__(timestamp)
+        self.backend = output.backend
+        self.pending = output.queue.qsize()
+        self.written = output.written
+        self.dropped = output.dropped
+        self.failed = output.failed
+        self.batches = output.batches
+        self.spooled = output.spooled
+        self.replayed = output.replayed
+
+def _parse_output(output, data):
+    stats, reports = data
+    parsed_data = list(_parse_stats(output.log, output.mode, stats, output.format, output.retransmit_format))
+    parsed_data.extend(_parse_reports(output.log, output.mode, reports, output.report_formats))
+    return parsed_data
+
+def _summarize(stats, timestamp, offsets):
+    histograms = dict()
+    for metric in SUMMARY_METRICS:
+        histograms[metric] = nudnik.histogram.Histogram()
+
+    columns = zip(stats.timestamps,
+                  stats.hosts,
+                  stats.request_column('ctime'),
+                  stats.request_column('itime'),
+                  stats.request_column('stime'),
+                  stats.response_column('ctime'),
+                  stats.response_column('ltime'),
+                  stats.response_column('stime'))
+    for stat_timestamp, host, ctime, itime, stime, res_ctime, res_ltime, res_stime in columns:
+        histograms['rtt'].record(utils.diff_nanoseconds(ctime, stat_timestamp))
+        histograms['crtt'].record(utils.diff_nanoseconds(itime or ctime, stat_timestamp))
+        if stime:
+            histograms['cdelta'].record(utils.diff_nanoseconds(ctime, stime))
+        if res_ltime:
+            histograms['sdelta'].record(utils.diff_nanoseconds(stime, res_ctime))
+            histograms['ldelta'].record(utils.diff_nanoseconds(res_ctime, res_ltime))
+            histograms['pdelta'].record(utils.diff_nanoseconds(res_ltime, res_stime))
+            histograms['bdelta'].record(utils.diff_nanoseconds(res_stime, stat_timestamp))
+            offset = offsets.get(host)
+            if offset is not None and stime:
+                histograms['uplink'].record(utils.diff_nanoseconds(stime, res_ctime - offset))
+                histograms['downlink'].record(utils.diff_nanoseconds(res_stime - offset, stat_timestamp))
+
+    for metric in SUMMARY_METRICS:
+        if histograms[metric].count > 0:
+            yield histograms[metric].summary(timestamp, metric)
+
+def _parse_reports(log, mode, reports, report_formats):
+    for kind, report in reports:
+        dataformat = report_formats.get(kind)
+        if not dataformat:
+            continue
+
+        formatter = nudnik.formatter.compile_formatter(dataformat, REPORT_FIELDS, _report_attribute)
+        try:
+            reportstring = formatter.render(report, mode)
+        except Exception as e:
+            log.fatal('Fatal error occured while parsing provided format"{}", {}'.format(dataformat, str(e)))
+            break
+
+        yield reportstring
 
 def _parse_stats(log, mode, stats, format, retransmit_format):
+    formatter = nudnik.formatter.compile_formatter(format, STAT_FIELDS)
+    retransmit_formatter = nudnik.formatter.compile_formatter(retransmit_format, STAT_FIELDS)
     for stat in stats:
-        if getattr(stat.request, 'rcount', None) is None or stat.request.rcount == 0:
-            dataformat = format
+        if stat.request.rcount == 0:
+            current_formatter = formatter
         else:
-            dataformat = retransmit_format
+            current_formatter = retransmit_formatter
 
         try:
-            if type(stat.request) == requests.models.PreparedRequest:
-                statstring = dataformat.format(timestamp_str=str(stat.timestamp),
-                                           timestamp=stat.timestamp,
-                                           mode=mode,
-                                           node=nudnik.metrics.MetricNode(),
-                                           req=stat.request,
-                                           res=stat.response,
-                                           cdelta=utils.diff_nanoseconds(stat.request.ctime, stat.request.stime),
-                                           rdelta=utils.diff_nanoseconds(getattr(stat.request, 'rtime', 0), stat.request.stime),
-                                           sdelta=utils.diff_nanoseconds(stat.request.stime, getattr(stat.response, 'ctime', 0)),
-                                           ldelta=utils.diff_nanoseconds(getattr(stat.response, 'ctime', 0), getattr(stat.response, 'ltime', 0)),
-                                           pdelta=utils.diff_nanoseconds(getattr(stat.response, 'ltime', 0), getattr(stat.response, 'stime', 0)),
-                                           bdelta=utils.diff_nanoseconds(getattr(stat.response, 'stime', 0), stat.timestamp),
-                                           rtt=utils.diff_nanoseconds(stat.request.ctime, stat.timestamp))
-            else:
-                statstring = dataformat.format(timestamp_str=str(stat.timestamp),
-                                           timestamp=stat.timestamp,
-                                           mode=mode,
-                                           node=nudnik.metrics.MetricNode(),
-                                           req=stat.request,
-                                           res=stat.response,
-                                           cdelta=utils.diff_nanoseconds(stat.request.ctime, stat.request.stime),
-                                           rdelta=utils.diff_nanoseconds(stat.request.rtime, stat.request.stime),
-                                           sdelta=utils.diff_nanoseconds(stat.request.stime, stat.response.ctime),
-                                           ldelta=utils.diff_nanoseconds(stat.response.ctime, stat.response.ltime),
-                                           pdelta=utils.diff_nanoseconds(stat.response.ltime, stat.response.stime),
-                                           bdelta=utils.diff_nanoseconds(stat.response.stime, stat.timestamp),
-                                           rtt=utils.diff_nanoseconds(stat.request.ctime, stat.timestamp))
+            statstring = current_formatter.render(stat, mode)
         except Exception as e:
-            log.fatal('Fatal error occured while parsing provided format"{}", {}'.format(dataformat, str(e)))
+            log.fatal('Fatal error occured while parsing provided format"{}", {}'.format(current_formatter.dataformat, str(e)))
             break
 
         yield statstring
 
+def _report_attribute(name):
+    return lambda report, mode: getattr(report, name)
+
+def _itime(stat):
+    return stat.request.itime or stat.request.ctime
+
+# Reports expose their own attributes next to these
+REPORT_FIELDS = {
+    'timestamp_str': lambda report, mode: str(report.timestamp),
+    'mode': lambda report, mode: mode,
+    'node': lambda report, mode: nudnik.metrics.get_node(),
+}
+
+# Every field is only computed when the format references it
+STAT_FIELDS = {
+    'timestamp_str': lambda stat, mode: str(stat.timestamp),
+    'timestamp': lambda stat, mode: stat.timestamp,
+    'mode': lambda stat, mode: mode,
+    'node': lambda stat, mode: nudnik.metrics.get_node(),
+    'req': lambda stat, mode: stat.request,
+    'res': lambda stat, mode: stat.response,
+    'cdelta': lambda stat, mode: utils.diff_nanoseconds(stat.request.ctime, stat.request.stime),
+    'rdelta': lambda stat, mode: utils.diff_nanoseconds(stat.request.rtime, stat.request.stime),
+    'sdelta': lambda stat, mode: utils.diff_nanoseconds(stat.request.stime, stat.response.ctime),
+    'ldelta': lambda stat, mode: utils.diff_nanoseconds(stat.response.ctime, stat.response.ltime),
+    'pdelta': lambda stat, mode: utils.diff_nanoseconds(stat.response.ltime, stat.response.stime),
+    'bdelta': lambda stat, mode: utils.diff_nanoseconds(stat.response.stime, stat.timestamp),
+    'rtt': lambda stat, mode: utils.diff_nanoseconds(stat.request.ctime, stat.timestamp),
+    'idelta': lambda stat, mode: utils.diff_nanoseconds(_itime(stat), stat.request.stime),
+    'crtt': lambda stat, mode: utils.diff_nanoseconds(_itime(stat), stat.timestamp),
+}
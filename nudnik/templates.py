@@ -0,0 +1,109 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import requests
+
+import nudnik
+import nudnik.metrics
+import nudnik.formatter
+import nudnik.payload
+import nudnik.utils as utils
+
+# Fields of "request_format" that change with every message
+_DYNAMIC_REQUEST_FIELDS = set(['sequence_id', 'message_id', 'ctime'])
+
+class RequestTemplate(object):
+    ''' Compiled once per stream, only the per-message fields are patched on every render '''
+
+    def __init__(self, cfg, stream_id):
+        self.cfg = cfg
+        self.stream_id = stream_id
+
+        if cfg.protocol in ['grpc', 'etcd']:
+            self.prototype = nudnik.entity_pb2.Request(name=cfg.name,
+                                                       stream_id=stream_id,
+                                                       load=cfg.load_list)
+        else:
+            headers = dict()
+            for header in cfg.headers:
+                headers.update({str(header[0]): str(header[1])})
+
+            self.dynamic_body = len(nudnik.formatter.format_fields(cfg.request_format) & _DYNAMIC_REQUEST_FIELDS) > 0
+            data = self.format_body(0, 0, utils.time_ns())
+            self.prototype = requests.Request(cfg.method, 'http://place_holder', data=data, headers=headers).prepare()
+
+    def format_body(self, sequence_id, message_id, ctime):
+        return self.cfg.request_format.format(name=self.cfg.name,
+                                              stream_id=self.stream_id,
+                                              sequence_id=sequence_id,
+                                              message_id=message_id,
+                                              ctime=ctime,
+                                              load=self.cfg.load_list)
+
+    def render(self, sequence_id, message_id, itime):
+        ctime = utils.time_ns()
+
+        if self.cfg.protocol in ['grpc', 'etcd']:
+            request = nudnik.entity_pb2.Request()
+            request.CopyFrom(self.prototype)
+        else:
+            request = self.prototype.copy()
+            if self.dynamic_body:
+                request.prepare_body(self.format_body(sequence_id, message_id, ctime), None)
+            request.name = self.cfg.name
+            request.stream_id = self.stream_id
+            request.load = self.cfg.load_list
+
+        request.sequence_id = sequence_id
+        request.message_id = message_id
+        request.ctime = ctime
+        request.itime = itime
+        return request
+
+class MetaTemplate(object):
+    ''' Compiles "meta" once, it is only re-formatted per attempt if it references the request '''
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.node = None
+        self.meta = None
+        self.payload = None
+
+        if cfg.meta is None:
+            self.dynamic = False
+            self.payload = nudnik.payload.get_meta(cfg, None)
+            return
+
+        fields = nudnik.formatter.format_fields(cfg.meta)
+        if 'node' in fields:
+            self.node = nudnik.metrics.get_node()
+
+        self.dynamic = 'req' in fields
+        if not self.dynamic:
+            self.meta = cfg.meta.format(node=self.node)
+            # Files and random data are sliced per attempt, plain strings are encoded only once
+            if not self.meta.startswith('@'):
+                self.payload = nudnik.payload.get_meta(cfg, self.meta)
+
+    def render(self, request):
+        if self.dynamic:
+            meta = self.cfg.meta.format(req=request, node=self.node)
+        else:
+            meta = self.meta
+
+        if self.payload is not None:
+            return meta, self.payload
+        return meta, nudnik.payload.get_meta(self.cfg, meta)
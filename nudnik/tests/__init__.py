@@ -15,3 +15,9 @@
 #    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+
+import nudnik.utils as utils
+
+def get_config(argv=None):
+    ''' Effective configuration of a nudnik started with "argv" '''
+    return utils.parse_config(utils.parse_args(argv or list()))
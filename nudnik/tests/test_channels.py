@@ -0,0 +1,49 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import nudnik
+import nudnik.resolver
+import nudnik.channels as channels
+import nudnik.utils as utils
+from nudnik.tests import get_config
+
+class ChannelPoolTest(unittest.TestCase):
+
+    def tearDown(self):
+        nudnik.resolver.stop_resolver()
+        nudnik.resolver._resolver = None
+
+    def pool(self, host, policy):
+        return channels.ChannelPool(get_config(['--host', host, '--port', '5999', '-e', 'grpc_channels_per_address=2', '-e', 'grpc_lb_policy={}'.format(policy)]))
+
+    def test_round_robin_between_channels(self):
+        pool = self.pool('127.0.0.1', 'round_robin')
+        picked = [pool.get_client() for index in range(0, 4)]
+        self.assertEqual([client.host for client in picked], ['127.0.0.1'] * 4)
+        self.assertEqual(len(set([id(client) for client in picked])), 2)
+
+    def test_unresolved_host_falls_back_to_its_name(self):
+        cfg = get_config(['--host', 'no-such-host.invalid'])
+        utils.get_resolver(cfg)
+        nudnik.resolver.stop_resolver()
+        for policy in ['round_robin', 'pick_first', 'random']:
+            pool = self.pool('no-such-host.invalid', policy)
+            self.assertEqual(pool.get_client().host, 'no-such-host.invalid')
+
+if __name__ == '__main__':
+    unittest.main()
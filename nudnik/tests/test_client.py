@@ -0,0 +1,87 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import unittest
+
+import nudnik
+import nudnik.stats
+import nudnik.client as client
+from nudnik.tests import get_config
+
+def _drain(send_queue):
+    items = list()
+    while not send_queue.empty():
+        items.append(send_queue.get())
+        send_queue.task_done()
+    return items
+
+class SendQueueTest(unittest.TestCase):
+
+    def test_drop_keeps_the_oldest(self):
+        send_queue = client.SendQueue(2, 'drop')
+        self.assertEqual([send_queue.offer(item) for item in range(0, 4)], [True, True, False, False])
+        self.assertEqual((_drain(send_queue), send_queue.dropped, send_queue.shed), ([0, 1], 2, 0))
+
+    def test_shed_keeps_the_newest(self):
+        send_queue = client.SendQueue(2, 'shed')
+        self.assertEqual([send_queue.offer(item) for item in range(0, 4)], [True] * 4)
+        self.assertEqual((_drain(send_queue), send_queue.dropped, send_queue.shed), ([2, 3], 0, 2))
+        send_queue.join()
+
+    def test_unbounded(self):
+        send_queue = client.SendQueue(0, 'drop')
+        self.assertTrue(all([send_queue.offer(item) for item in range(0, 1000)]))
+        self.assertEqual(send_queue.dropped, 0)
+
+class EnqueueTest(unittest.TestCase):
+
+    def stream(self, overflow):
+        cfg = get_config(['--queue-size', '1', '--queue-overflow', overflow])
+        return client.Stream(cfg, 0, nudnik.stats.Stats(cfg))
+
+    def test_block_waits_for_room(self):
+        stream = self.stream('block')
+        stream.enqueue(nudnik.entity_pb2.Request(message_id=0))
+        enqueued = threading.Event()
+
+        def enqueue():
+            stream.enqueue(nudnik.entity_pb2.Request(message_id=1))
+            enqueued.set()
+
+        thread = threading.Thread(target=enqueue)
+        thread.start()
+        self.assertFalse(enqueued.wait(0.3))
+        self.assertEqual(stream.queue.get().message_id, 0)
+        self.assertTrue(enqueued.wait(5))
+        thread.join()
+        self.assertEqual((stream.queue.get().message_id, stream.queue.blocked, stream.queue.dropped), (1, 1, 0))
+
+    def test_block_gives_up_on_exit(self):
+        stream = self.stream('block')
+        stream.enqueue(nudnik.entity_pb2.Request(message_id=0))
+        stream.gtfo = 1
+        stream.enqueue(nudnik.entity_pb2.Request(message_id=1))
+        self.assertEqual(stream.queue.qsize(), 1)
+
+    def test_drop_never_blocks(self):
+        stream = self.stream('drop')
+        for message_id in range(0, 3):
+            stream.enqueue(nudnik.entity_pb2.Request(message_id=message_id))
+        self.assertEqual((stream.queue.get().message_id, stream.queue.dropped, stream.queue.blocked), (0, 2, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import nudnik
+import nudnik.stats
+import nudnik.clock as clock
+from nudnik.tests import get_config
+
+def _buffer(exchanges):
+    ''' A buffer of (host, offset, uplink, processing, downlink) exchanges, in nanoseconds '''
+    buf = nudnik.stats.StatsBuffer()
+    sent = 10**18
+    for host, offset, uplink, processing, downlink in exchanges:
+        request = nudnik.entity_pb2.Request(stime=sent)
+        received = sent + uplink + offset
+        ltime = received if host is not None else 0
+        response = nudnik.entity_pb2.Response(hostname=host or '', ctime=received, ltime=ltime, stime=received + processing)
+        buf.append(request, response, sent + uplink + processing + downlink)
+        sent += 10**6
+    return buf
+
+class ClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.Clock(get_config(['--clock-offset-window', '2']))
+
+    def test_the_fastest_round_trip_gives_the_offset(self):
+        reports = self.clock.update(_buffer([('a', 5000, 900, 100, 300),
+                                             ('a', 5000, 200, 700, 200),
+                                             ('b', -3000, 100, 0, 100),
+                                             (None, 0, 1, 1, 1)]), 1)
+        self.assertEqual([(r.host, r.offset, r.delay, r.error, r.samples) for r in reports], [('a', 5000, 400, 200, 2), ('b', -3000, 200, 100, 1)])
+        self.assertEqual(self.clock.offsets, {'a': 5000, 'b': -3000})
+
+    def test_asymmetric_delays_bound_the_error(self):
+        report = self.clock.update(_buffer([('a', 5000, 900, 0, 100)]), 1)[0]
+        self.assertEqual(report.offset, 5000 + (900 - 100) // 2)
+        self.assertTrue(abs(report.offset - 5000) <= report.error)
+
+    def test_best_sample_of_the_window_is_kept_and_silent_servers_are_forgotten(self):
+        self.clock.update(_buffer([('a', 5000, 100, 0, 100)]), 1)
+        reports = self.clock.update(_buffer([('a', 5000, 900, 0, 100)]), 2)
+        self.assertEqual((reports[0].offset, reports[0].delay), (5000, 200))
+
+        reports = self.clock.update(_buffer([]), 3)
+        self.assertEqual((reports[0].offset, reports[0].samples), (5400, 0))
+        self.assertEqual(self.clock.update(_buffer([]), 4), [])
+        self.assertEqual(self.clock.offsets, {})
+
+if __name__ == '__main__':
+    unittest.main()
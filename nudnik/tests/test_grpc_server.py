@@ -0,0 +1,75 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import unittest
+
+import grpc
+
+import nudnik
+import nudnik.stats
+import nudnik.grpc_server
+import nudnik.utils as utils
+from nudnik.tests import get_config
+
+def _request(message_id):
+    return nudnik.entity_pb2.Request(name='NAME', message_id=message_id, ctime=utils.time_ns())
+
+class GrpcServerTest(unittest.TestCase):
+
+    def start(self, argv):
+        cfg = get_config(['--server', '--host', '127.0.0.1', '--port', '0'] + argv)
+        service = nudnik.grpc_server.ParseService(cfg, nudnik.stats.Stats(cfg))
+        self.server, bind_host, port = service.create_server()
+        self.server.start()
+        self.channel = grpc.insecure_channel('127.0.0.1:{}'.format(port))
+        self.stub = nudnik.entity_pb2_grpc.ParserStub(self.channel)
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def test_unary_calls_beyond_workers_are_queued(self):
+        self.start(['--workers', '1', '--grpc-stream-workers', '1', '--load', 'rtt', '0.2'])
+        calls = [self.stub.parse.future(_request(index), timeout=10) for index in range(0, 6)]
+        statuses = [call.result().status_code for call in calls]
+        self.assertEqual(statuses, [nudnik.entity_pb2.Response.OK] * 6)
+
+    def test_streams_beyond_the_limit_are_rejected(self):
+        self.start(['--workers', '1', '--grpc-stream-workers', '1'])
+        release = threading.Event()
+
+        def requests():
+            yield _request(0)
+            release.wait(10)
+
+        first = self.stub.parse_stream(requests(), timeout=10)
+        self.assertEqual(next(first).status_code, nudnik.entity_pb2.Response.OK)
+
+        with self.assertRaises(grpc.RpcError) as raised:
+            list(self.stub.parse_stream(iter([_request(1)]), timeout=10))
+        self.assertEqual(raised.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+        # Unary calls are still served next to the stream
+        self.assertEqual(self.stub.parse(_request(2), timeout=10).status_code, nudnik.entity_pb2.Response.OK)
+
+        # A stream that ended frees its slot
+        release.set()
+        list(first)
+        self.assertEqual(len(list(self.stub.parse_stream(iter([_request(3)]), timeout=10))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
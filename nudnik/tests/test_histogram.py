@@ -0,0 +1,78 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import random
+import unittest
+
+import nudnik.histogram as histogram
+
+def _nearest_rank(values, p):
+    values = sorted(values)
+    return values[max(1, int(math.ceil(p / 100.0 * len(values)))) - 1]
+
+class HistogramTest(unittest.TestCase):
+
+    def test_small_values_are_exact(self):
+        h = histogram.Histogram(precision=8)
+        for value in range(0, 256):
+            self.assertEqual(h.bucket_value(h.bucket(value)), value)
+
+    def test_relative_error_is_bounded(self):
+        rng = random.Random(1)
+        for precision in [4, 8]:
+            h = histogram.Histogram(precision=precision)
+            for index in range(0, 2000):
+                value = rng.randint(1, 10**12)
+                self.assertLess(abs(h.bucket_value(h.bucket(value)) - value) / float(value), 2 ** (1 - precision))
+
+    def test_buckets_keep_the_order_of_values(self):
+        h = histogram.Histogram(precision=4)
+        buckets = [h.bucket(value) for value in range(-5000, 5000)]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(h.bucket_value(h.bucket(-3)), -3)
+
+    def test_percentiles_follow_nearest_rank(self):
+        rng = random.Random(2)
+        values = [int(rng.expovariate(1.0 / 10**6)) for index in range(0, 5000)]
+        h = histogram.Histogram()
+        for value in values:
+            h.record(value)
+        self.assertEqual((h.count, h.min, h.max), (len(values), min(values), max(values)))
+        for name, p in histogram.SUMMARY_PERCENTILES:
+            exact = _nearest_rank(values, p)
+            self.assertLessEqual(abs(h.percentile(p) - exact), exact * 2 ** (1 - h.precision))
+        self.assertEqual(h.percentile(100), max(values))
+
+    def test_percentiles_stay_between_min_and_max(self):
+        h = histogram.Histogram(precision=2)
+        h.record(1000, count=10)
+        self.assertEqual(h.percentile(50), 1000)
+        self.assertEqual(histogram.Histogram().percentile(50), 0)
+
+    def test_merge_equals_recording_everything(self):
+        rng = random.Random(3)
+        values = [rng.randint(-1000, 10**9) for index in range(0, 1000)]
+        merged, first, second = histogram.Histogram(), histogram.Histogram(), histogram.Histogram()
+        for index, value in enumerate(values):
+            merged.record(value)
+            (first if index % 2 else second).record(value)
+        first.merge(second)
+        first.merge(histogram.Histogram())
+        self.assertEqual((first.counts, first.count, first.min, first.max), (merged.counts, merged.count, merged.min, merged.max))
+
+if __name__ == '__main__':
+    unittest.main()
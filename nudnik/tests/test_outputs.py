@@ -0,0 +1,75 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import nudnik
+import nudnik.stats
+import nudnik.outputs
+import nudnik.utils as utils
+from nudnik.tests import get_config
+
+class ListOutput(nudnik.outputs.Output):
+    def __init__(self, cfg, log):
+        super(ListOutput, self).__init__(cfg, log, 'test', None)
+        self.chunks = list()
+
+    def out(self, data):
+        self.chunks.append(data)
+        return True
+
+def _buffer(count):
+    buf = nudnik.stats.StatsBuffer()
+    for index in range(0, count):
+        request = nudnik.entity_pb2.Request(name='NAME', message_id=index, ctime=index)
+        buf.append(request, nudnik.entity_pb2.Response(), index)
+    return buf
+
+class OutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cfg = get_config(['--output-batch-size', '3'])
+        self.log = utils.get_logger()
+
+    def test_chunks_are_bounded_by_rows(self):
+        output = ListOutput(self.cfg, self.log)
+        output.add(['a', 'b'])
+        output.add(['c', 'd', 'e', 'f', 'g'])
+        self.assertEqual(output.batch_rows, 7)
+        output.flush()
+        self.assertEqual(output.chunks, [['a', 'b', 'c'], ['d', 'e', 'f'], ['g']])
+        self.assertEqual((output.written, output.batches, output.batch_rows), (7, 3, 0))
+
+    def test_binary_intervals_are_split_into_chunks(self):
+        output = nudnik.stats.BinaryStats(self.cfg, self.log, '/dev/null', 'clientstats')
+        written = list()
+        output.out = lambda data: written.append([len(item) for item in data])
+        output.add((_buffer(8), list()))
+        output.add((_buffer(0), list()))
+        output.add((_buffer(1), list()))
+        self.assertEqual(output.batch_rows, 9)
+        output.flush()
+        self.assertEqual(written, [[3], [3], [2, 1]])
+        self.assertEqual(output.written, 9)
+
+    def test_slices_keep_every_column(self):
+        buf = _buffer(5).slice(1, 4)
+        self.assertEqual(list(buf.timestamps), [1, 2, 3])
+        self.assertEqual(list(buf.request_column('message_id')), [1, 2, 3])
+        self.assertEqual(len(buf.names), 3)
+
+if __name__ == '__main__':
+    unittest.main()
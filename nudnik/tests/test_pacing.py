@@ -0,0 +1,75 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+import random
+import unittest
+
+import nudnik
+import nudnik.stats
+import nudnik.client
+import nudnik.pacing as pacing
+from nudnik.tests import get_config
+
+class PacerTest(unittest.TestCase):
+
+    def gaps(self, mode, count=20000):
+        random.seed(1)
+        pacer = pacing.Pacer(mode, 200, 2)
+        return [pacer.next_gap() for index in range(0, count)]
+
+    def test_constant(self):
+        pacer = pacing.Pacer('constant', 200, 2)
+        self.assertEqual(pacer.next_gap(), 0.01)
+        self.assertEqual(pacer.next_gap_ns(), 10**7)
+        pacer.set_rate(0, 2)
+        self.assertEqual(pacer.next_gap(), 2)
+
+    def test_random_gaps_keep_the_mean_rate(self):
+        for mode in ['poisson', 'uniform']:
+            gaps = self.gaps(mode)
+            self.assertAlmostEqual(sum(gaps) / len(gaps), 0.01, delta=0.0005)
+            self.assertTrue(min(gaps) >= 0)
+        self.assertTrue(max(self.gaps('uniform')) <= 0.02)
+
+class RecordingStream(nudnik.client.Stream):
+    ''' Open-loop stream that only records what it would send, stalling once on "stall_at" '''
+
+    def __init__(self, cfg, stall_at, stall):
+        super(RecordingStream, self).__init__(cfg, 0, nudnik.stats.Stats(cfg))
+        self.requests = list()
+        self.stall_at = stall_at
+        self.stall = stall
+
+    def enqueue(self, request):
+        self.requests.append(request)
+        if request.message_id == self.stall_at:
+            time.sleep(self.stall)
+
+class OpenLoopTest(unittest.TestCase):
+
+    def test_stalls_are_not_forgiven(self):
+        stream = RecordingStream(get_config(['--rate', '100', '--count', '20', '--pacing', 'constant']), 4, 0.1)
+        stream.run_open_loop()
+        itimes = [request.itime for request in stream.requests]
+        # Every message keeps its intended send time, however late it was created
+        self.assertEqual([itime - itimes[0] for itime in itimes], [index * 10**7 for index in range(0, 20)])
+        late = [request.ctime - request.itime for request in stream.requests[5:]]
+        self.assertTrue(late[0] >= 5 * 10**7)
+        self.assertTrue(all([delay >= 0 for delay in late]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import math
+import random
+import shutil
+import tempfile
+import unittest
+
+import nudnik.columnar as columnar
+import nudnik.report as report
+import nudnik.stats as stats
+
+_numpy = report.numpy
+
+def _write(path, chunks, seed):
+    ''' Writes "chunks" chunks of random messages, every chunk with a names table of its own order '''
+    rng = random.Random(seed)
+    columns = columnar.columns(stats.REQUEST_FIELDS, stats.RESPONSE_FIELDS)
+    with open(path, 'wb') as f:
+        columnar.write_header(f, {'mode': 'clientstats', 'node': 'test', 'columns': columns})
+        for chunk in range(0, chunks):
+            names = ['a', 'b', 'c']
+            rng.shuffle(names)
+            rows = rng.randint(1, 300)
+            values = dict([(column, list()) for column in columns])
+            for row in range(0, rows):
+                ctime = (10**18) + rng.randint(0, 10 * 10**9)
+                stime = ctime + rng.randint(0, 10**6)
+                values['timestamp'].append(stime + rng.randint(10**5, 5 * 10**8))
+                values['name'].append(rng.randint(0, len(names) - 1))
+                values['req_stream_id'].append(rng.randint(0, 3))
+                values['req_worker_id'].append(rng.randint(0, 1))
+                values['req_ctime'].append(ctime)
+                values['req_stime'].append(stime)
+                values['req_itime'].append(rng.choice([0, ctime - rng.randint(0, 10**6)]))
+                # Only some servers timestamp their responses
+                ltime = rng.choice([0, stime + rng.randint(0, 10**6)])
+                values['res_ctime'].append(ltime and stime + 1)
+                values['res_ltime'].append(ltime)
+                values['res_stime'].append(ltime and ltime + rng.randint(0, 10**6))
+                values['res_status_code'].append(rng.choice([0, 0, 0, 1]))
+            for column in columns:
+                if len(values[column]) == 0:
+                    values[column] = [0] * rows
+            columnar.write_chunk(f, rows, names, [report.array.array(columnar.INT64, values[column]) for column in columns])
+
+def _groups(rep, by, metric, interval=None):
+    values, mask = rep.metric(metric)
+    if by == 'timeline':
+        timestamps = rep.keys('timestamp', mask)
+        keys = report._bucket(timestamps, report._minimum(timestamps), int(interval * 10**9))
+    elif by is None:
+        keys = None
+    else:
+        keys = rep.keys(report.BREAKDOWNS[by], mask)
+    groups = report._group_percentiles(keys, values, rep.order(metric, values))
+    return [(int(key), int(count), int(minimum), [int(value) for value in percentiles], int(maximum)) for key, count, minimum, percentiles, maximum in groups]
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.directory, 'stats{}.bin'.format(index)) for index in range(0, 2)]
+        for index, path in enumerate(self.paths):
+            _write(path, 5, index)
+
+    def tearDown(self):
+        report.numpy = _numpy
+        shutil.rmtree(self.directory)
+
+    def load(self, use_numpy):
+        report.numpy = _numpy if use_numpy else None
+        return report.Report(self.paths)
+
+    def all_groups(self, rep):
+        groups = list()
+        for metric in report.METRICS:
+            for by in [None, 'timeline'] + sorted(report.BREAKDOWNS):
+                groups.append((metric, by, _groups(rep, by, metric, interval=0.5)))
+        return groups
+
+    def test_python_percentiles(self):
+        rep = self.load(False)
+        values, mask = rep.metric('rtt')
+        names = rep.keys('name')
+        expected = list()
+        for name_id in sorted(set(names)):
+            group = sorted([value for value, key in zip(values, names) if key == name_id])
+            ranks = [max(0, int(math.ceil(p / 100.0 * len(group))) - 1) for name, p in report.PERCENTILES]
+            expected.append((name_id, len(group), group[0], [group[rank] for rank in ranks], group[-1]))
+        self.assertEqual(_groups(rep, 'name', 'rtt'), expected)
+        self.assertEqual(sorted(rep.names), ['a', 'b', 'c'])
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_numpy_matches_python(self):
+        python_groups = self.all_groups(self.load(False))
+        numpy_groups = self.all_groups(self.load(True))
+        self.assertEqual(numpy_groups, python_groups)
+
+if __name__ == '__main__':
+    unittest.main()
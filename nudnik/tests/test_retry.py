@@ -0,0 +1,103 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import sys
+import time
+import random
+import unittest
+if (sys.version_info >= (3, 0)):
+    import queue as queue
+else:
+    import Queue as queue
+
+import nudnik
+import nudnik.stats
+import nudnik.retry as retry
+from nudnik.tests import get_config
+
+class BackoffTest(unittest.TestCase):
+
+    def test_exponential_up_to_the_maximum(self):
+        cfg = get_config(['--retry-jitter', 'none', '--retry-backoff', '0.1', '--retry-backoff-max', '1'])
+        self.assertEqual([retry.backoff(cfg, rcount) for rcount in range(0, 7)], [0.1, 0.1, 0.2, 0.4, 0.8, 1, 1])
+
+    def test_jitter(self):
+        random.seed(1)
+        for jitter, lowest in [('full', 0), ('equal', 0.4)]:
+            cfg = get_config(['--retry-jitter', jitter, '--retry-backoff', '0.1', '--retry-backoff-max', '10'])
+            delays = [retry.backoff(cfg, 4) for index in range(0, 1000)]
+            self.assertTrue(lowest <= min(delays) < lowest + 0.05)
+            self.assertTrue(0.75 < max(delays) <= 0.8)
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_percent_of_first_attempts(self):
+        budget = retry.RetryBudget(20, 0)
+        for index in range(0, 10):
+            budget.deposit()
+        self.assertEqual([budget.withdraw() for index in range(0, 3)], [True, True, False])
+
+    def test_minimum_per_second(self):
+        budget = retry.RetryBudget(0, 1)
+        allowed = [budget.withdraw() for index in range(0, retry.BUDGET_WINDOW + 1)]
+        self.assertEqual(allowed, [True] * retry.BUDGET_WINDOW + [False])
+
+    def test_unlimited(self):
+        budget = retry.RetryBudget(-1, 0)
+        self.assertTrue(all([budget.withdraw() for index in range(0, 100)]))
+
+class RetrySchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        cfg = get_config(['--retry-count', '2', '--retry-budget', '-1', '--retry-backoff', '0.05', '--retry-jitter', 'none'])
+        self.scheduler = retry.RetryScheduler(cfg, nudnik.stats.Stats(cfg))
+        self.scheduler.daemon = True
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.exit()
+        self.scheduler.join()
+
+    def test_retries_are_counted_and_exhausted(self):
+        request = nudnik.entity_pb2.Request(message_id=1)
+        target = queue.Queue()
+        self.assertTrue(self.scheduler.retry(request, target))
+        self.assertEqual(request.rcount, 1)
+        self.assertTrue(request.rtime > 0)
+        self.assertTrue(self.scheduler.retry(request, target))
+        self.assertFalse(self.scheduler.retry(request, target))
+        report = self.scheduler.report(0)
+        self.assertEqual((report.retries, report.exhausted), (2, 1))
+
+    def test_requests_are_put_back_once_due(self):
+        target = queue.Queue()
+        started = time.time()
+        for message_id, delay in [(1, 0.2), (2, 0.05), (3, 0.1)]:
+            self.scheduler.schedule(nudnik.entity_pb2.Request(message_id=message_id), target, delay)
+        received = [target.get(timeout=5).message_id for index in range(0, 3)]
+        self.assertEqual(received, [2, 3, 1])
+        self.assertTrue(time.time() - started >= 0.2)
+
+    def test_full_queues_are_retried_later(self):
+        target = queue.Queue(maxsize=1)
+        target.put(nudnik.entity_pb2.Request(message_id=0))
+        self.scheduler.schedule(nudnik.entity_pb2.Request(message_id=1), target, 0)
+        time.sleep(0.1)
+        self.assertEqual(target.get(timeout=5).message_id, 0)
+        self.assertEqual(target.get(timeout=5).message_id, 1)
+
+if __name__ == '__main__':
+    unittest.main()
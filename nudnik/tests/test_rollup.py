@@ -0,0 +1,72 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import nudnik
+import nudnik.stats
+import nudnik.rollup as rollup
+from nudnik.tests import get_config
+
+_BILLION = 10**9
+
+def _buffer(messages):
+    ''' A buffer of (seconds, name, rtt nanoseconds, status_code) messages '''
+    buf = nudnik.stats.StatsBuffer()
+    for seconds, name, rtt, status_code in messages:
+        timestamp = int(seconds * _BILLION)
+        request = nudnik.entity_pb2.Request(name=name, ctime=timestamp - rtt)
+        buf.append(request, nudnik.entity_pb2.Response(status_code=status_code), timestamp)
+    return buf
+
+def _summary(reports):
+    return [(report.timestamp // _BILLION, report.name, report.stream_id, report.count, report.failures, report.max) for report in reports]
+
+class RollupTest(unittest.TestCase):
+
+    def rollup(self, window, slide=0):
+        return rollup.Rollup(get_config(['--stats-rollup', 'name', '--stats-rollup-window', str(window), '--stats-rollup-slide', str(slide)]))
+
+    def test_tumbling_windows(self):
+        r = self.rollup(2)
+        reports = r.roll(_buffer([(0.5, 'a', 100, 0), (1.5, 'a', 300, 1), (1.6, 'b', 200, 0), (2.5, 'a', 50, 0)]), int(2.5 * _BILLION))
+        # A pane is only closed a stats interval after it ended
+        self.assertEqual(reports, [])
+
+        reports = r.roll(_buffer([]), int(3.5 * _BILLION))
+        self.assertEqual(_summary(reports), [(2, 'a', '*', 2, 1, 300), (2, 'b', '*', 1, 0, 200)])
+        self.assertEqual(reports[0].window, 2.0)
+        self.assertEqual(reports[0].throughput, 1.0)
+
+        self.assertEqual(_summary(r.roll(_buffer([]), int(5.5 * _BILLION))), [(4, 'a', '*', 1, 0, 50)])
+        self.assertEqual(r.roll(_buffer([]), int(7.5 * _BILLION)), [])
+        self.assertEqual(r.roll(_buffer([]), int(99.5 * _BILLION)), [])
+
+    def test_sliding_windows(self):
+        r = self.rollup(4, 2)
+        reports = r.roll(_buffer([(0.5, 'a', 100, 0), (2.5, 'a', 200, 0), (3.5, 'a', 300, 0)]), int(5.5 * _BILLION))
+        self.assertEqual(_summary(reports), [(2, 'a', '*', 1, 0, 100), (4, 'a', '*', 3, 0, 300)])
+        self.assertEqual(_summary(r.roll(_buffer([]), int(7.5 * _BILLION))), [(6, 'a', '*', 2, 0, 300)])
+        self.assertEqual(r.roll(_buffer([]), int(9.5 * _BILLION)), [])
+
+    def test_late_messages_go_to_the_first_open_pane(self):
+        r = self.rollup(2)
+        r.roll(_buffer([(0.5, 'a', 100, 0)]), int(3.5 * _BILLION))
+        r.roll(_buffer([(1.0, 'a', 700, 0)]), int(3.6 * _BILLION))
+        self.assertEqual(_summary(r.roll(_buffer([]), int(5.5 * _BILLION))), [(4, 'a', '*', 1, 0, 700)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#
+#    This file is part of Nudnik. <https://github.com/salosh/nudnik.git>
+#
+#    Nudnik is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Nudnik is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Nudnik.  If not, see <http://www.gnu.org/licenses/>.
+#
+import random
+import threading
+import unittest
+
+import nudnik
+import nudnik.stats as stats
+from nudnik.tests import get_config
+
+class ShardedCounterTest(unittest.TestCase):
+
+    def test_cells_of_every_thread_are_summed(self):
+        counter = stats.ShardedCounter()
+
+        def add():
+            for index in range(0, 1000):
+                counter.add()
+
+        threads = [threading.Thread(target=add) for index in range(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.add(5)
+        self.assertEqual(counter.value, 4005)
+        self.assertEqual(len(counter.cells), 5)
+
+class FailSequencerTest(unittest.TestCase):
+
+    def failures(self, fail_ratio, count):
+        sequencer = stats.FailSequencer(fail_ratio)
+        return [index for index in range(0, count) if sequencer.next()]
+
+    def test_exact_ratio_spread_evenly(self):
+        self.assertEqual(self.failures(25, 20), [3, 7, 11, 15, 19])
+        self.assertEqual(len(self.failures(12.5, 800)), 100)
+        self.assertEqual(self.failures(0, 100), [])
+        self.assertEqual(len(self.failures(100, 100)), 100)
+
+    def test_sequence_is_deterministic(self):
+        self.assertEqual(self.failures(33.3, 1000), self.failures(33.3, 1000))
+
+    def test_every_thread_has_a_sequence_of_its_own(self):
+        statsthread = stats.Stats(get_config(['--fail-ratio', '50']))
+        results = dict()
+
+        def inject(name):
+            results[name] = [statsthread.inject_failure() for index in range(0, 4)]
+
+        threads = [threading.Thread(target=inject, args=(name,)) for name in range(0, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(results.values()), [[False, True, False, True]] * 3)
+        self.assertFalse(stats.Stats(get_config()).inject_failure())
+
+def _buffer(count, failed=(), retransmitted=()):
+    buf = stats.StatsBuffer()
+    for index in range(0, count):
+        request = nudnik.entity_pb2.Request(name='NAME', message_id=index, rcount=1 if index in retransmitted else 0)
+        response = nudnik.entity_pb2.Response(status_code=1 if index in failed else 0)
+        buf.append(request, response, index)
+    return buf
+
+class SamplerTest(unittest.TestCase):
+
+    def sample(self, ratio, reservoir, keep_failures, buf):
+        sampler = stats.Sampler(ratio, reservoir, keep_failures)
+        sampler.random = random.Random(1)
+        return list(sampler.sample(buf).request_column('message_id'))
+
+    def test_everything_is_kept_by_default(self):
+        buf = _buffer(10)
+        self.assertIs(stats.Sampler(1, 0, True).sample(buf), buf)
+        self.assertIs(stats.Sampler(1, 20, True).sample(buf), buf)
+
+    def test_ratio(self):
+        kept = self.sample(0.25, 0, False, _buffer(10000))
+        self.assertTrue(2300 < len(kept) < 2700)
+        self.assertEqual(kept, sorted(kept))
+        self.assertEqual(self.sample(0, 0, False, _buffer(100)), [])
+
+    def test_failures_and_retransmits_are_kept(self):
+        buf = _buffer(100, failed=(7, 50), retransmitted=(3,))
+        self.assertEqual(self.sample(0, 0, True, buf), [3, 7, 50])
+        self.assertEqual(self.sample(0, 0, False, buf), [])
+
+    def test_reservoir_is_a_sample_of_the_interval(self):
+        kept = self.sample(1, 10, False, _buffer(1000))
+        self.assertEqual(len(kept), 10)
+        self.assertEqual(kept, sorted(set(kept)))
+
+        kept = self.sample(1, 10, True, _buffer(1000, failed=(999,)))
+        self.assertEqual(len(kept), 11)
+        self.assertEqual(kept[-1], 999)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,11 +35,19 @@ if sys.version_info < (3, 0):
 import etcd3
 
 import nudnik
+import nudnik.pacing
+import nudnik.payload
 from nudnik.entity_pb2 import Load
 import nudnik.outputs
 
 _BILLION = float(10**9)
 
+# Sent with every response, clients estimate the clock offset of every server host
+_hostname = socket.gethostname()
+
+# Labels the messages may be rolled up by, see nudnik.rollup
+ROLLUP_LABELS = ['name', 'stream_id', 'worker_id', 'mode', 'status']
+
 DEFAULTS = {
     'config_file': '',
     'protocol': 'grpc',
@@ -51,22 +59,54 @@ DEFAULTS = {
     'request_format': '{{"request": "ping", "timestamp": "{ctime}" }}',
     'response_format': '{{"status": 200, "response": "pong", "timestamp": "{ctime}" }}',
     'dns_ttl': 10,
+    'dns_family': 'ipv4',
+    'grpc_channels_per_address': 0,
+    'grpc_lb_policy': 'round_robin',
+    'grpc_resolver': 'nudnik',
+    'grpc_call': 'unary',
+    'grpc_stream_workers': 100,
     'server': False,
     'name': 'NAME',
     'name_mismatch_error': None,
     'meta': None,
     'meta_size': (4194304 - 48),
+    'payload_size_distribution': 'fixed',
+    'payload_size_min': 0,
+    'payload_size_mean': 65536,
+    'payload_ring_size': 4,
+    'payload_refresh_interval': 1,
     'workers': os.sysconf('SC_NPROCESSORS_ONLN'),
     'streams': 1,
     'initial_stream_index': 0,
+    'processes': 1,
     'interval': 1,
     'rate': 1,
+    'pacing': 'burst',
+    'search': 'off',
+    'search_step': 10,
+    'search_step_duration': 10,
+    'search_warmup': 2,
+    'search_max_rate': 0,
+    'search_slo_p99': 100.0,
+    'search_slo_error_ratio': 1.0,
+    'queue_size': 0,
+    'queue_overflow': 'block',
     'timeout': 1,
+    'engine': 'threads',
+    'max_in_flight': 1000,
+    'http_connections': 10,
+    'http_pipelining': 1,
     'count': 0,
     'chaos': 0,
     'chaos_string': 'In all chaos there is a cosmos, in all disorder a secret order. #Carl_Jung_FTW',
     'load': [],
     'retry_count': -1,
+    'retry_mode': 'inline',
+    'retry_backoff': 0.1,
+    'retry_backoff_max': 10.0,
+    'retry_jitter': 'full',
+    'retry_budget': 20,
+    'retry_budget_min': 10,
     'fail_ratio': 0,
     'ruok': False,
     'ruok_host': '127.0.0.1',
@@ -74,6 +114,8 @@ DEFAULTS = {
     'ruok_path': '/ruok',
     'ruok_headers': [['Content-type', 'application/json']],
     'ruok_response_format': '{{"status": 200, "timestamp": "{date}" }}',
+    'ruok_metrics_path': '/metrics',
+    'ruok_metrics_buckets': [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
     'metrics': [],
     'metrics_interval': 1,
     'metrics_file_path': './nudnikmetrics.out',
@@ -83,23 +125,77 @@ DEFAULTS = {
     'metrics_format_prometheus': '# TYPE nudnik_metrics summary\nnudnik_metrics{{distro="{node.platform}",cpu_usage="{cpu.usage}", percent="{mem.percent}"}} {timestamp}\n',
     'stats': [],
     'stats_interval': 1,
+    'stats_per_message': True,
+    'stats_summary': True,
+    'stats_sample_ratio': 1.0,
+    'stats_sample_reservoir': 0,
+    'stats_sample_keep_failures': True,
+    'stats_rollup': [],
+    'stats_rollup_window': 10.0,
+    'stats_rollup_slide': 0.0,
+    'clock_offset_window': 10.0,
+    'output_queue_size': 10,
+    'output_overflow': 'drop',
+    'output_batch_size': 5000,
+    'output_batch_interval': 1.0,
     'stats_file_path': './nudnikstats.out',
+    'stats_binary_path': './nudnikstats.bin',
     'stats_format_stdout': '{timestamp_str},{res.status_code},{req.name},{req.message_id},{req.ctime},{cdelta},rtt={rtt}',
     'stats_format_retransmit_stdout': '{timestamp_str},{res.status_code},{req.name},{req.message_id},{req.ctime},{req.rtime},{cdelta},{rdelta},{req.rcount},rtt={rtt}',
     'stats_format_file': '{timestamp_str},{res.status_code},{req.name},{req.message_id},{req.ctime},{cdelta},rtt={rtt}',
     'stats_format_retransmit_file': '{timestamp_str},{res.status_code},{req.name},{req.message_id},{req.ctime},{req.rtime},{cdelta},{rdelta},{req.rcount},rtt={rtt}',
-    'stats_format_influxdb': '{mode},hostname={node.nodename},status={res.status_code},name={req.name},sid={req.stream_id},wid={req.worker_id},qid={req.sequence_id} sid={req.stream_id},wid={req.worker_id},mid={req.message_id},ctime={req.ctime},cdelta={cdelta},sdelta={sdelta},pdelta={pdelta},bdelta={bdelta},rtt={rtt} {timestamp}',
-    'stats_format_retransmit_influxdb': '{mode},hostname={node.nodename},status={res.status_code},name={req.name},sid={req.stream_id},wid={req.worker_id},qid={req.sequence_id} sid={req.stream_id},wid={req.worker_id},mid={req.message_id},ctime={req.ctime},rtime={req.rtime},cdelta={cdelta},sdelta={sdelta},pdelta={pdelta},bdelta={bdelta},rdelta={rdelta},rcount={req.rcount},rtt={rtt} {timestamp}',
-    'stats_format_prometheus': '# TYPE nudnik_message summary\nnudnik_message{{ctime="{req.ctime}",message_id="{req.message_id}", rtt="{rtt}", name="{req.name}"}} {timestamp}\n',
-    'stats_format_retransmit_prometheus': '# TYPE nudnik_message summary\nnudnik_message{{ctime="{req.ctime}",message_id="{req.message_id}", rtt="{rtt}", name="{req.name}"}} {timestamp}\n',
+    'stats_format_influxdb': '{mode},hostname={node.nodename},status={res.status_code},name={req.name},sid={req.stream_id},wid={req.worker_id},qid={req.sequence_id} sid={req.stream_id},wid={req.worker_id},mid={req.message_id},ctime={req.ctime},cdelta={cdelta},sdelta={sdelta},pdelta={pdelta},bdelta={bdelta},rtt={rtt},idelta={idelta},crtt={crtt} {timestamp}',
+    'stats_format_retransmit_influxdb': '{mode},hostname={node.nodename},status={res.status_code},name={req.name},sid={req.stream_id},wid={req.worker_id},qid={req.sequence_id} sid={req.stream_id},wid={req.worker_id},mid={req.message_id},ctime={req.ctime},rtime={req.rtime},cdelta={cdelta},sdelta={sdelta},pdelta={pdelta},bdelta={bdelta},rdelta={rdelta},rcount={req.rcount},rtt={rtt},idelta={idelta},crtt={crtt} {timestamp}',
+    'stats_format_prometheus': '# TYPE nudnik_message_rtt gauge\nnudnik_message_rtt{{mode="{mode}",name="{req.name}",stream="{req.stream_id}"}} {rtt}\n',
+    'stats_format_retransmit_prometheus': '# TYPE nudnik_message_rtt gauge\nnudnik_message_rtt{{mode="{mode}",name="{req.name}",stream="{req.stream_id}"}} {rtt}\n',
+    'stats_format_summary_stdout': '{timestamp_str},summary,{metric},count={count},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max}',
+    'stats_format_summary_file': '{timestamp_str},summary,{metric},count={count},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max}',
+    'stats_format_summary_influxdb': '{mode}_summary,hostname={node.nodename},metric={metric} count={count},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max} {timestamp}',
+    'stats_format_summary_prometheus': '# TYPE nudnik_{metric} summary\nnudnik_{metric}{{mode="{mode}",quantile="0.5"}} {p50}\nnudnik_{metric}{{mode="{mode}",quantile="0.9"}} {p90}\nnudnik_{metric}{{mode="{mode}",quantile="0.99"}} {p99}\nnudnik_{metric}{{mode="{mode}",quantile="0.999"}} {p999}\nnudnik_{metric}_count{{mode="{mode}"}} {count}\n',
+    'stats_format_queue_stdout': '{timestamp_str},queue,{name},{stream_id},depth={depth},maxsize={maxsize},dropped={dropped},shed={shed},blocked={blocked}',
+    'stats_format_queue_file': '{timestamp_str},queue,{name},{stream_id},depth={depth},maxsize={maxsize},dropped={dropped},shed={shed},blocked={blocked}',
+    'stats_format_queue_influxdb': 'queue,hostname={node.nodename},name={name},sid={stream_id} depth={depth},maxsize={maxsize},dropped={dropped},shed={shed},blocked={blocked} {timestamp}',
+    'stats_format_retry_stdout': '{timestamp_str},retry,{name},attempts={attempts},retries={retries},rejected={rejected},exhausted={exhausted},pending={pending},amplification={amplification}',
+    'stats_format_retry_file': '{timestamp_str},retry,{name},attempts={attempts},retries={retries},rejected={rejected},exhausted={exhausted},pending={pending},amplification={amplification}',
+    'stats_format_retry_influxdb': 'retry,hostname={node.nodename},name={name} attempts={attempts},first_attempts={first_attempts},retries={retries},rejected={rejected},exhausted={exhausted},pending={pending},amplification={amplification} {timestamp}',
+    'stats_format_retry_prometheus': '# TYPE nudnik_retry_amplification gauge\nnudnik_retry_amplification{{name="{name}"}} {amplification}\n# TYPE nudnik_retry_rejected counter\nnudnik_retry_rejected{{name="{name}"}} {rejected}\n',
+    'stats_format_search_stdout': '{timestamp_str},search,{name},step={step},rate={rate},offered={offered},achieved={achieved},p50={p50},p99={p99},error_ratio={error_ratio},passed={passed}',
+    'stats_format_search_file': '{timestamp_str},search,{name},step={step},rate={rate},offered={offered},achieved={achieved},p50={p50},p90={p90},p99={p99},max={max},error_ratio={error_ratio},passed={passed}',
+    'stats_format_search_influxdb': 'search,hostname={node.nodename},name={name} step={step},rate={rate},offered={offered},achieved={achieved},p50={p50},p90={p90},p99={p99},max={max},error_ratio={error_ratio},passed={passed} {timestamp}',
+    'stats_format_search_prometheus': '# TYPE nudnik_search_p99 gauge\nnudnik_search_p99{{name="{name}",rate="{rate}"}} {p99}\n# TYPE nudnik_search_error_ratio gauge\nnudnik_search_error_ratio{{name="{name}",rate="{rate}"}} {error_ratio}\n',
+    'stats_format_dns_stdout': '{timestamp_str},dns,{host},{address},{action},addresses={addresses}',
+    'stats_format_dns_file': '{timestamp_str},dns,{host},{address},{action},addresses={addresses}',
+    'stats_format_dns_influxdb': 'dns,hostname={node.nodename},host={host},address={address},action={action} addresses={addresses} {timestamp}',
+    'stats_format_dns_prometheus': '# TYPE nudnik_dns_addresses gauge\nnudnik_dns_addresses{{host="{host}"}} {addresses}\n',
+    'stats_format_rollup_stdout': '{timestamp_str},rollup,{window},{name},{stream_id},{worker_id},{status},count={count},throughput={throughput},failures={failures},retransmits={retransmits},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max}',
+    'stats_format_rollup_file': '{timestamp_str},rollup,{window},{name},{stream_id},{worker_id},{status},count={count},throughput={throughput},failures={failures},retransmits={retransmits},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max}',
+    'stats_format_rollup_influxdb': '{mode}_rollup,hostname={node.nodename},window={window},name={name},sid={stream_id},wid={worker_id},status={status} count={count},throughput={throughput},failures={failures},retransmits={retransmits},min={min},p50={p50},p90={p90},p99={p99},p999={p999},max={max} {timestamp}',
+    'stats_format_rollup_prometheus': '# TYPE nudnik_rollup_rtt summary\nnudnik_rollup_rtt{{mode="{mode}",name="{name}",stream="{stream_id}",worker="{worker_id}",status="{status}",quantile="0.5"}} {p50}\nnudnik_rollup_rtt{{mode="{mode}",name="{name}",stream="{stream_id}",worker="{worker_id}",status="{status}",quantile="0.99"}} {p99}\nnudnik_rollup_rtt_count{{mode="{mode}",name="{name}",stream="{stream_id}",worker="{worker_id}",status="{status}"}} {count}\n',
+    'stats_format_clock_stdout': '{timestamp_str},clock,{host},offset={offset},delay={delay},error={error},samples={samples}',
+    'stats_format_clock_file': '{timestamp_str},clock,{host},offset={offset},delay={delay},error={error},samples={samples}',
+    'stats_format_clock_influxdb': 'clock,hostname={node.nodename},server={host} offset={offset},delay={delay},error={error},samples={samples} {timestamp}',
+    'stats_format_clock_prometheus': '# TYPE nudnik_clock_offset gauge\nnudnik_clock_offset{{server="{host}"}} {offset}\n# TYPE nudnik_clock_delay gauge\nnudnik_clock_delay{{server="{host}"}} {delay}\n',
+    'stats_format_output_stdout': '{timestamp_str},output,{backend},pending={pending},written={written},dropped={dropped},failed={failed},batches={batches},spooled={spooled},replayed={replayed}',
+    'stats_format_output_file': '{timestamp_str},output,{backend},pending={pending},written={written},dropped={dropped},failed={failed},batches={batches},spooled={spooled},replayed={replayed}',
+    'stats_format_output_influxdb': 'output,hostname={node.nodename},backend={backend} pending={pending},written={written},dropped={dropped},failed={failed},batches={batches},spooled={spooled},replayed={replayed} {timestamp}',
+    'stats_format_output_prometheus': '# TYPE nudnik_output_dropped counter\nnudnik_output_dropped{{backend="{backend}"}} {dropped}\n# TYPE nudnik_output_failed counter\nnudnik_output_failed{{backend="{backend}"}} {failed}\n',
+    'stats_format_queue_prometheus': '# TYPE nudnik_queue_depth gauge\nnudnik_queue_depth{{name="{name}",stream_id="{stream_id}"}} {depth}\n# TYPE nudnik_queue_dropped counter\nnudnik_queue_dropped{{name="{name}",stream_id="{stream_id}"}} {dropped}\n# TYPE nudnik_queue_shed counter\nnudnik_queue_shed{{name="{name}",stream_id="{stream_id}"}} {shed}\n',
     'etcd_format_key_request': '/nudnik/request/{name}',
     'etcd_format_key_response': '/nudnik/response/{name}',
+    'etcd_batch_size': 64,
     'influxdb_socket_path': '/var/run/influxdb/influxdb.sock',
     'influxdb_protocol': 'http+unix',
     'influxdb_host': '127.0.0.1',
     'influxdb_port': '8086',
     'influxdb_database_prefix': 'nudnik',
     'influxdb_url': '{influxdb_protocol}://{influxdb_host}/write?db={influxdb_database_name}&precision=ns',
+    'influxdb_gzip': True,
+    'influxdb_timeout': 5.0,
+    'influxdb_retries': 3,
+    'influxdb_retry_backoff': 0.5,
+    'influxdb_retry_backoff_max': 10.0,
+    'influxdb_spool_path': './nudnikspool',
+    'influxdb_spool_max_size': 100,
     'prometheus_protocol': 'http',
     'prometheus_host': '127.0.0.1',
     'prometheus_port': '9091',
@@ -174,7 +270,7 @@ class NudnikConfiguration(object):
             if fail_if_missing:
                 raise e
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description='Nudnik - gRPC load tester',
         epilog='2019 (C) Salo Shp <https://github.com/salosh/nudnik.git>'
@@ -195,6 +291,31 @@ def parse_args():
     parser.add_argument('--dns-ttl',
                         type=int,
                         help='Number of seconds before forcing "host" name lookup (Default: 10)')
+    parser.add_argument('--dns-family',
+                        type=str,
+                        choices=['ipv4', 'ipv6', 'any'],
+                        help='Address family of "host" name lookups (Default: ipv4)')
+    parser.add_argument('--etcd-batch-size',
+                        type=int,
+                        help='Maximum number of etcd writes per transaction (Default: 64)')
+    parser.add_argument('--grpc-channels-per-address',
+                        type=int,
+                        help='Number of shared gRPC channels per resolved address, 0 opens a private channel per worker (Default: 0)')
+    parser.add_argument('--grpc-lb-policy',
+                        type=str,
+                        choices=['random', 'pick_first', 'round_robin'],
+                        help='Load-balancing policy between the shared gRPC channels (Default: round_robin)')
+    parser.add_argument('--grpc-resolver',
+                        type=str,
+                        choices=['nudnik', 'dns'],
+                        help='Resolve "host" by Nudnik and open channels per address, or let gRPC resolve it (Default: nudnik)')
+    parser.add_argument('--grpc-call',
+                        type=str,
+                        choices=['unary', 'stream'],
+                        help='Send every message as a unary call, or pipeline all messages of a stream over a long-lived bidi-streaming call (Default: unary)')
+    parser.add_argument('--grpc-stream-workers',
+                        type=int,
+                        help='Maximum number of streaming calls a server serves at once, each with a thread on top of "workers", streams beyond it are rejected (Default: 100)')
     parser.add_argument('--server', '-S',
                         action='store_true',
                         default=None,
@@ -209,6 +330,22 @@ def parse_args():
     parser.add_argument('--meta', '-M',
                         type=str,
                         help='Send this extra data with every request')
+    parser.add_argument('--payload-size-distribution',
+                        type=str,
+                        choices=['fixed', 'uniform', 'exponential'],
+                        help='Distribution of the size of "@" meta payloads, up to "meta_size" (Default: fixed)')
+    parser.add_argument('--payload-size-min',
+                        type=int,
+                        help='Minimum size of "@" meta payloads (Default: 0)')
+    parser.add_argument('--payload-size-mean',
+                        type=int,
+                        help='Mean size of "@" meta payloads with the exponential distribution (Default: 65536)')
+    parser.add_argument('--payload-ring-size',
+                        type=int,
+                        help='Number of pre-generated buffers for "@random" meta payloads (Default: 4)')
+    parser.add_argument('--payload-refresh-interval',
+                        type=int,
+                        help='Number of seconds between replacing one of the "@random" buffers, 0 disables (Default: 1)')
     parser.add_argument('--workers', '-w',
                         type=int,
                         help='Number of workers (Default: Count of CPU cores)')
@@ -218,12 +355,61 @@ def parse_args():
     parser.add_argument('--initial-stream-index',
                         type=int,
                         help='Calculate stream ID from this initial index (Default: 0)')
+    parser.add_argument('--processes',
+                        type=int,
+                        help='Number of client processes, streams are partitioned between them and their stats are merged (Default: 1)')
     parser.add_argument('--interval', '-i',
                         type=int,
                         help='Number of seconds per stream message cycle (Default: 1)')
     parser.add_argument('--rate', '-r',
                         type=int,
                         help='Number of messages per interval (Default: 10)')
+    parser.add_argument('--pacing',
+                        type=str,
+                        choices=nudnik.pacing.PACING_MODES,
+                        help='Message scheduling mode, "burst" sends "rate" messages at the top of every interval, others schedule every message on its own (Default: burst)')
+    parser.add_argument('--search',
+                        type=str,
+                        choices=['off', 'step', 'bisect'],
+                        help='Search for the maximum rate that meets the SLO, by steps of "search_step" or by bisection (Default: off)')
+    parser.add_argument('--search-step',
+                        type=int,
+                        help='Rate increment per step, or the precision of the bisection (Default: 10)')
+    parser.add_argument('--search-step-duration',
+                        type=int,
+                        help='Number of seconds to measure every rate for (Default: 10)')
+    parser.add_argument('--search-warmup',
+                        type=int,
+                        help='Number of seconds to wait after changing the rate before measuring (Default: 2)')
+    parser.add_argument('--search-max-rate',
+                        type=int,
+                        help='Maximum rate to search up to, 0 means unlimited (Default: 0)')
+    parser.add_argument('--search-slo-p99',
+                        type=float,
+                        help='Maximum p99 latency in milliseconds for a rate to be sustainable (Default: 100)')
+    parser.add_argument('--search-slo-error-ratio',
+                        type=float,
+                        help='Maximum percent of failed requests for a rate to be sustainable (Default: 1)')
+    parser.add_argument('--queue-size',
+                        type=int,
+                        help='Maximum number of messages waiting to be sent per stream, 0 means unbounded (Default: 0)')
+    parser.add_argument('--queue-overflow',
+                        type=str,
+                        choices=['block', 'drop', 'shed'],
+                        help='What to do with a new message when the stream queue is full (Default: block)')
+    parser.add_argument('--engine',
+                        type=str,
+                        choices=['threads', 'asyncio'],
+                        help='Client engine, "threads" sends with "workers" blocking threads per stream, "asyncio" multiplexes all streams on a single event loop (Default: threads)')
+    parser.add_argument('--max-in-flight',
+                        type=int,
+                        help='Maximum number of concurrent requests per process when using the "asyncio" engine, or pipelined messages per stream with "stream" gRPC calls (Default: 1000)')
+    parser.add_argument('--http-connections',
+                        type=int,
+                        help='Maximum number of keep-alive connections per resolved address when using the "asyncio" engine with "http" (Default: 10)')
+    parser.add_argument('--http-pipelining',
+                        type=int,
+                        help='Maximum number of pipelined requests per connection when using the "asyncio" engine with "http", 1 disables pipelining (Default: 1)')
     parser.add_argument('--timeout',
                         type=int,
                         help='Maximum number of seconds before failing a request (Default: 1)')
@@ -243,6 +429,26 @@ def parse_args():
     parser.add_argument('--retry-count',
                         type=int,
                         help='Number of times to re-send failed messages (Default: -1, which means infinite times)')
+    parser.add_argument('--retry-mode',
+                        type=str,
+                        choices=['inline', 'backoff'],
+                        help='Re-send failed messages right away, or put them back on the stream queue after an exponential backoff (Default: inline)')
+    parser.add_argument('--retry-backoff',
+                        type=float,
+                        help='Number of seconds to wait before the first re-send in "backoff" mode, doubled on every re-send (Default: 0.1)')
+    parser.add_argument('--retry-backoff-max',
+                        type=float,
+                        help='Maximum number of seconds to wait before a re-send in "backoff" mode (Default: 10)')
+    parser.add_argument('--retry-jitter',
+                        type=str,
+                        choices=['none', 'equal', 'full'],
+                        help='Randomization of the backoff in "backoff" mode (Default: full)')
+    parser.add_argument('--retry-budget',
+                        type=int,
+                        help='Percent of the messages sent that may be re-sent in "backoff" mode, -1 means unlimited (Default: 20)')
+    parser.add_argument('--retry-budget-min',
+                        type=int,
+                        help='Number of re-sends per second that are always allowed in "backoff" mode (Default: 10)')
     parser.add_argument('--fail-ratio',
                         type=str,
                         help='Percent of requests to intentionally fail (Default: 0)')
@@ -258,8 +464,51 @@ def parse_args():
     parser.add_argument('--stats', '-t',
                         type=str,
                         action='append',
-                        choices=['stdout', 'file', 'influxdb', 'prometheus'],
+                        choices=['stdout', 'file', 'binary', 'influxdb', 'prometheus'],
                         help='Enable stats outputs (Default: None)')
+    parser.add_argument('--no-stats-per-message',
+                        action='store_false',
+                        default=None,
+                        dest='stats_per_message',
+                        help='Only output the per interval summaries and reports, not a line per message (default: False)')
+    parser.add_argument('--no-stats-summary',
+                        action='store_false',
+                        default=None,
+                        dest='stats_summary',
+                        help='Do not output per interval latency summaries (default: False)')
+    parser.add_argument('--stats-sample-ratio',
+                        type=float,
+                        help='Probability of a message to be sent to the stats outputs, failures and retransmits are always sent (Default: 1.0)')
+    parser.add_argument('--stats-sample-reservoir',
+                        type=int,
+                        help='Maximum number of sampled messages sent to the stats outputs per interval, 0 means unlimited (Default: 0)')
+    parser.add_argument('--stats-rollup',
+                        type=str,
+                        action='append',
+                        choices=ROLLUP_LABELS,
+                        help='Report the messages rolled up by these labels once per window, may be specified multiple times (Default: None)')
+    parser.add_argument('--stats-rollup-window',
+                        type=float,
+                        help='Length of a rollup window in seconds (Default: 10.0)')
+    parser.add_argument('--stats-rollup-slide',
+                        type=float,
+                        help='Report a sliding window every that many seconds, 0 means tumbling windows (Default: 0.0)')
+    parser.add_argument('--clock-offset-window',
+                        type=float,
+                        help='Seconds of responses the clock offset of every server is estimated from, 0 disables the estimation (Default: 10.0)')
+    parser.add_argument('--output-queue-size',
+                        type=int,
+                        help='Maximum number of intervals waiting to be written per "file", "influxdb" or "prometheus" backend (Default: 10)')
+    parser.add_argument('--output-overflow',
+                        type=str,
+                        choices=['drop', 'shed'],
+                        help='What to do with a new interval when the queue of a backend is full (Default: drop)')
+    parser.add_argument('--output-batch-size',
+                        type=int,
+                        help='Maximum number of lines written to a backend at once (Default: 5000)')
+    parser.add_argument('--output-batch-interval',
+                        type=float,
+                        help='Maximum number of seconds lines may wait to be batched before they are written to a backend (Default: 1.0)')
     parser.add_argument('--extra', '-e',
                         type=str,
                         action='append',
@@ -277,7 +526,7 @@ def parse_args():
                         version='Nudnik v{} - 2019 (C) Salo Shp <https://github.com/salosh/nudnik.git>'.format(nudnik.__version__),
                         help='Display Nudnik version')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 def parse_config(args):
@@ -336,6 +585,11 @@ def parse_config(args):
                                                influxdb_host=cfg.influxdb_host_port,
                                                influxdb_database_name=database_name_metrics)
 
+        # Processes sharing a spool would replay and delete each other's writes
+        if cfg.influxdb_spool_path and not nudnik.outputs.lock_spool(cfg):
+            print('The spool at "{}" is used by another nudnik named "{}", give this one another "name" or "influxdb_spool_path"'.format(cfg.influxdb_spool_path, cfg.name))
+            sys.exit(1)
+
         nudnik.outputs.create_influxdb_database(cfg.influxdb_protocol, cfg.influxdb_host_port, database_name_stats)
         nudnik.outputs.create_influxdb_database(cfg.influxdb_protocol, cfg.influxdb_host_port, database_name_metrics)
 
@@ -356,6 +610,62 @@ def parse_config(args):
                                                          label_name='instance',
                                                          label_value=os.uname()[1])
 
+    if cfg.engine == 'asyncio' and cfg.protocol not in ['grpc', 'http']:
+        print('The "asyncio" engine does not support the "{}" protocol'.format(cfg.protocol))
+        sys.exit(1)
+
+    if cfg.engine == 'asyncio' and cfg.grpc_call != 'unary':
+        print('The "asyncio" engine does not support "{}" gRPC calls'.format(cfg.grpc_call))
+        sys.exit(1)
+
+    if cfg.search != 'off' and (cfg.server or cfg.processes > 1 or cfg.rate <= 0):
+        print('The "search" mode requires client mode in a single process, starting at a positive "rate"')
+        sys.exit(1)
+
+    if cfg.payload_size_min > cfg.meta_size:
+        print('The "payload_size_min" may not exceed "meta_size"')
+        sys.exit(1)
+
+    if cfg.grpc_stream_workers < 0:
+        print('The "grpc_stream_workers" may not be negative')
+        sys.exit(1)
+
+    if cfg.output_queue_size < 1 or cfg.output_batch_size < 1:
+        print('The "output_queue_size" and "output_batch_size" must be positive')
+        sys.exit(1)
+
+    if not isinstance(cfg.ruok_metrics_buckets, list):
+        cfg.ruok_metrics_buckets = str(cfg.ruok_metrics_buckets).split(',')
+    try:
+        cfg.ruok_metrics_buckets = sorted([float(bound) for bound in cfg.ruok_metrics_buckets])
+    except ValueError:
+        print('The "ruok_metrics_buckets" must be a list of upper bounds in seconds')
+        sys.exit(1)
+
+    if not (0 <= cfg.stats_sample_ratio <= 1) or cfg.stats_sample_reservoir < 0:
+        print('The "stats_sample_ratio" must be between 0 and 1 and "stats_sample_reservoir" may not be negative')
+        sys.exit(1)
+
+    if cfg.clock_offset_window < 0:
+        print('The "clock_offset_window" may not be negative')
+        sys.exit(1)
+
+    for label in cfg.stats_rollup:
+        if label not in ROLLUP_LABELS:
+            print('Unknown rollup label "{}", available labels are {}'.format(label, ROLLUP_LABELS))
+            sys.exit(1)
+
+    if len(cfg.stats_rollup) > 0:
+        slide = cfg.stats_rollup_slide or cfg.stats_rollup_window
+        panes = cfg.stats_rollup_window / slide if slide > 0 else 0
+        if cfg.stats_rollup_window < cfg.stats_interval or slide < cfg.stats_interval or abs(panes - round(panes)) > 0.001:
+            print('The "stats_rollup_window" and "stats_rollup_slide" may not be shorter than "stats_interval", and the window must be a multiple of the slide')
+            sys.exit(1)
+
+    if cfg.retry_backoff <= 0 or cfg.retry_backoff_max < cfg.retry_backoff:
+        print('The "retry_backoff" must be positive and may not exceed "retry_backoff_max"')
+        sys.exit(1)
+
     cfg.cycle_per_hour = int( 3600 / cfg.interval )
 
     # Clear '%' sign if provided
@@ -409,6 +719,8 @@ def cast_arg_by_type(key, value):
             return False
     elif isinstance(DEFAULTS[key], int):
         return int(value)
+    elif isinstance(DEFAULTS[key], float):
+        return float(value)
     elif isinstance(DEFAULTS[key], str):
         return str(value)
 
@@ -464,20 +776,6 @@ def generate_load_cmd(args):
 
     return p.communicate()
 
-def get_meta(meta, size=0):
-
-    if meta is not None and meta != '':
-        if meta[0] == '@':
-            meta_filepath = meta[1:]
-            if meta_filepath in ['random', 'urandom', '/dev/random', '/dev/urandom']:
-                return os.urandom(size)
-            with open(meta[1:], 'rb') as f:
-                return f.read(size)
-        else:
-            return meta.encode()
-
-    return ''.encode()
-
 def time_ns():
     # Python < 3.7 doesn't support time.time_ns(), this function unifies stats measurments
     return int(("%.9f" % time.time()).replace('.',''))
@@ -527,7 +825,8 @@ def set_etcd_client(self, force):
         try:
             self.event.wait(timeout=((index * 100)/1000))
 #                self.client = etcd3.client(host=self.host_address, port=self.cfg.port, ca_cert=self.cfg.etcd_cacert, cert_cert=self.cfg.etcd_cert, cert_key=self.cfg.etcd_key)
-            client = etcd3.client(host=self.host_address, port=self.cfg.port)
+            host = '[{}]'.format(self.host_address) if ':' in self.host_address else self.host_address
+            client = etcd3.client(host=host, port=self.cfg.port)
             time_now = str(datetime.now())
             verification_key = '/nudnik/verification/{}'.format(uuid.uuid4())
             client.put(verification_key, time_now)
@@ -552,29 +851,33 @@ def resolv_host(self, force):
     if resolved_elapsed < self.cfg.dns_ttl and force is False:
         return
 
-    ipv4=True
-    ipv6=False
-    if ipv6 is True:
-        if ipv4 is True:
-            family = 0
-        else:
-            family = 10
-    else:
-        family = 2
-
-    addresses = []
-    index = 0
-    while len(addresses) < 1:
-        addresses = socket.getaddrinfo(self.cfg.host, 0, family, 1)
-        for idx in range(0, index):
-            self.event.wait(timeout=((100)/1000))
-        index += 1
+    resolver = get_resolver(self.cfg)
+    if force is True:
+        resolver.invalidate()
 
-    self.host_address = addresses[random.randint(0, (len(addresses) - 1))][-1][0]
+    # Consecutive callers are spread between the addresses in round-robin
+    address = resolver.next_address()
+    if address is None:
+        # Exiting before "host" was ever resolved, the name itself will do until the caller leaves
+        address = self.host_address or self.cfg.host
+    self.host_address = address
     self.host_resolved_at = time_ns()
     if self.cfg.vvv:
         self.log.debug('Host {} resolved as {}'.format(self.cfg.host, self.host_address))
 
+def resolv_addresses(self):
+    return get_resolver(self.cfg).get_addresses()
+
+def get_resolver(cfg):
+    # nudnik.resolver depends on this module, import it only once both are loaded
+    import nudnik.resolver
+    return nudnik.resolver.get_resolver(cfg)
+
+def join_host_port(address, port):
+    if ':' in address and not address.startswith('['):
+        return '[{}]:{}'.format(address, port)
+    return '{}:{}'.format(address, port)
+
 def parse_request(self, request, timestamp):
     if self.cfg.vvvvv:
         self.log.debug(request)
@@ -606,7 +909,7 @@ def parse_request(self, request, timestamp):
             self.exit()
             raise NameMismatchException('Client name "{}" must exactly match server name "{}"'.format(request.name, self.cfg.name))
 
-    if (self.stats.get_fail_ratio() >= self.cfg.fail_ratio):
+    if not self.stats.inject_failure():
         self.stats.add_success()
         status_code = 'OK'
     else:
@@ -619,6 +922,6 @@ def parse_request(self, request, timestamp):
         self.exit()
         raise chaos_exception
 
-    response = {'status_code': status_code, 'ctime': timestamp, 'ltime': ltime, 'stime': time_ns(), 'meta': get_meta(self.cfg.meta, self.cfg.meta_size)}
+    response = {'status_code': status_code, 'ctime': timestamp, 'ltime': ltime, 'stime': time_ns(), 'meta': nudnik.payload.get_meta(self.cfg, self.cfg.meta), 'hostname': _hostname}
 
     return response